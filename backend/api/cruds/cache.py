@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+import asyncio
+import time
+
+
+# 件数の上限と有効期限のあるキャッシュ
+# 上限を超えたら最後に使われたのが古いものから捨てる。
+# get_or_loadは同じキーの読み込みを1つにまとめるので、再接続が集中してもDBへの問い合わせは1回で済む
+class TTLCache:
+    def __init__(self, maxsize: int = 10000, ttl: float = 30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (期限, 値)
+        self.entries = OrderedDict()
+        # 読み込み中のキー -> Future
+        self.loading = {}
+
+        # 計測値
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires < time.monotonic():
+            del self.entries[key]
+            return default
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        self.entries.pop(key, None)
+        # 読み込み中の古い値もキャッシュに入れない
+        self.loading.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+        self.loading.clear()
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]):
+        """キャッシュになければloaderで読み込む。Noneはキャッシュしない"""
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        future = self.loading.get(key)
+        if future is not None:
+            self.hits += 1
+            return await asyncio.shield(future)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self.loading[key] = future
+        try:
+            value = await loader()
+        except Exception as e:
+            future.set_exception(e)
+            # 待っている人がいなくても警告を出さない
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+        finally:
+            # 読み込み中にdeleteされていれば、古いかもしれないのでキャッシュしない
+            invalidated = self.loading.get(key) is not future
+            if not invalidated:
+                del self.loading[key]
+            # 読み込み自体が取り消された
+            if not future.done():
+                future.cancel()
+
+        if value is not None and not invalidated:
+            self.set(key, value)
+        return value
+
+    def metrics(self) -> dict:
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,74 @@
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException, status
+from typing import Callable
+import asyncio
+import time
+
+
+# パスワードのハッシュ化と照合を行う専用のスレッドプール
+# bcryptは1回に数十~数百ミリ秒かかるので、イベントループで呼ぶとその間ほかのWebSocketやタイマーが止まる。
+# bcryptはハッシュの計算中にGILを手放すので、スレッド数までは並列に進む。
+# 待ちがmax_pendingを超えたら、それ以上は受け付けずに503を返す (ログインが集中しても待ち行列が伸び続けない)
+class PasswordPool:
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password")
+        # 実行中と待っている件数
+        self.pending = 0
+
+        # 計測値
+        self.completed = 0
+        self.rejected = 0
+        self.max_depth = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.run_total = 0.0
+
+    async def run(self, func: Callable, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="混み合っています。しばらくしてからやり直してください",
+                headers={"Retry-After": "1"},
+            )
+
+        self.pending += 1
+        self.max_depth = max(self.max_depth, self.pending)
+        queued_at = time.perf_counter()
+
+        def timed():
+            started = time.perf_counter()
+            result = func(*args)
+            return result, started, time.perf_counter()
+
+        # 待っている側が取り消されても、始まった計算はスレッドで最後まで走るので、
+        # 計算が終わるか始まる前に取り消されたときに減らす (待ちの件数に走っている計算も数える)
+        loop = asyncio.get_running_loop()
+        job = self.executor.submit(timed)
+        job.add_done_callback(lambda job: loop.call_soon_threadsafe(self._release))
+        result, started, finished = await asyncio.wrap_future(job)
+
+        wait = started - queued_at
+        self.completed += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        self.run_total += finished - started
+        return result
+
+    def _release(self):
+        self.pending -= 1
+
+    def metrics(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "max_depth": self.max_depth,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "wait_avg": self.wait_total / self.completed if self.completed else 0.0,
+            "wait_max": self.wait_max,
+            "run_avg": self.run_total / self.completed if self.completed else 0.0,
+        }
@@ -0,0 +1,191 @@
+from typing import Optional
+from sqlalchemy import func
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import room as room_model
+from models import player as player_model
+from bisect import bisect_right, insort
+import asyncio
+import time
+
+
+# ロビーに出すルームの一覧を、参加人数付きで1回の問い合わせで読む
+# playersをLEFT JOINしてルームごとに数えるので、ルームごとに/room/{room_id}/playersを呼ばなくて済む。
+# afterより大きいidから順に返す (ページの途中でルームが増えても減っても、前のページと重ならない)
+async def load_lobby(
+    db: AsyncSession,
+    after: int = 0,
+    limit: Optional[int] = None,
+    game_type: Optional[str] = None,
+    open_only: bool = False
+    ):
+
+    players = func.count(player_model.Player.id).label("players")
+    query = (
+        select(room_model.Room.id, room_model.Room.max_players, room_model.Room.game_type, players)
+        .outerjoin(player_model.Player, player_model.Player.room_id == room_model.Room.id)
+        .where(room_model.Room.id > after)
+        .group_by(room_model.Room.id)
+        .order_by(room_model.Room.id)
+    )
+    if game_type:
+        query = query.where(room_model.Room.game_type == game_type)
+    if open_only:
+        query = query.having(players < room_model.Room.max_players)
+    if limit:
+        query = query.limit(limit)
+
+    result = await db.execute(query)
+    return [
+        {"id": row[0], "max_players": row[1], "game_type": row[2], "players": row[3]}
+        for row in result.fetchall()
+    ]
+
+
+def is_open(room: dict) -> bool:
+    return room["players"] < room["max_players"]
+
+
+# ロビーの一覧のキャッシュ
+# ルームの一覧を丸ごと持ち、ページと絞り込みはメモリ上で行うので、ロビーの再読み込みはDBに届かない。
+# このワーカーでのルームの作成・参加・退出・削除はその場で書き換える。
+# ほかのワーカーでの変更は期限切れで読み直すまで反映されない。ttlが0ならキャッシュせず毎回DBに問い合わせる
+class LobbyCache:
+    def __init__(self, ttl: float = 30):
+        self.ttl = ttl
+        # room_id -> {"id", "max_players", "game_type", "players"}
+        self.rooms = {}
+        # room_idの昇順
+        self.ids = []
+        self.expires = 0.0
+        # 書き換えのたびに増やす。読み込み中に書き換えがあれば、読み込んだ一覧は古いかもしれない
+        self.version = 0
+        self.loading = None
+
+        # 計測値
+        self.hits = 0
+        self.misses = 0
+        self.patches = 0
+
+    def valid(self) -> bool:
+        return self.expires >= time.monotonic()
+
+    async def _load(self, db: AsyncSession):
+        """期限が切れていれば読み直す。同時に来た読み込みは1つにまとめる"""
+        if self.valid():
+            self.hits += 1
+            return
+        if self.loading is not None:
+            self.hits += 1
+            await asyncio.shield(self.loading)
+            return
+
+        self.misses += 1
+        version = self.version
+        self.loading = asyncio.get_running_loop().create_future()
+        try:
+            rooms = await load_lobby(db)
+            self.rooms = {room["id"]: room for room in rooms}
+            self.ids = [room["id"] for room in rooms]
+            # 読み込み中に書き換えがあれば古いかもしれないので、この1回だけ使う
+            self.expires = time.monotonic() + self.ttl if self.version == version else 0.0
+            self.loading.set_result(None)
+        except BaseException as e:
+            self.loading.set_exception(e)
+            self.loading.exception()
+            raise
+        finally:
+            self.loading = None
+
+    async def page(
+        self,
+        db: AsyncSession,
+        after: int = 0,
+        limit: int = 20,
+        game_type: Optional[str] = None,
+        open_only: bool = False
+        ) -> dict:
+
+        if self.ttl <= 0:
+            rooms = await load_lobby(db, after, limit + 1, game_type, open_only)
+        else:
+            await self._load(db)
+            rooms = []
+            for room_id in self.ids[bisect_right(self.ids, after):]:
+                room = self.rooms[room_id]
+                if game_type and room["game_type"] != game_type:
+                    continue
+                if open_only and not is_open(room):
+                    continue
+                rooms.append(dict(room))
+                if len(rooms) > limit:
+                    break
+
+        # 1件多く読んで、次のページがあるかを調べる
+        next_after = rooms[limit - 1]["id"] if len(rooms) > limit else None
+        return {"rooms": rooms[:limit], "next": next_after}
+
+    # 以下はコミットしたあとに呼ぶ
+    def put(self, room: dict):
+        self._patched()
+        if not self.valid():
+            return
+        if room["id"] not in self.rooms:
+            insort(self.ids, room["id"])
+        self.rooms[room["id"]] = dict(room)
+
+    def update(self, room_id: int, **fields):
+        self._patched()
+        room = self.rooms.get(room_id)
+        if room is not None:
+            room.update(fields)
+
+    def add_player(self, room_id: int, delta: int = 1):
+        self._patched()
+        room = self.rooms.get(room_id)
+        if room is not None:
+            room["players"] = max(room["players"] + delta, 0)
+
+    def remove(self, room_id: int):
+        self._patched()
+        if self.rooms.pop(room_id, None) is not None:
+            del self.ids[bisect_right(self.ids, room_id) - 1]
+
+    def apply(self, event: dict):
+        """ロビーのイベント (routers/majan/manager/lobby.py) を反映する"""
+        kind = event["type"]
+        if kind == "room_created":
+            self.put(event["room"])
+        elif kind == "room_updated":
+            self.update(event["room_id"], game_type=event["game_type"])
+        elif kind in ("player_joined", "player_left"):
+            # 人数が分かっていればそれに合わせ、分からなければ1人増減する
+            if event.get("players") is not None:
+                self.update(event["room_id"], players=event["players"])
+            else:
+                self.add_player(event["room_id"], 1 if kind == "player_joined" else -1)
+        elif kind == "room_deleted":
+            self.remove(event["room_id"])
+
+    def players(self, room_id: int) -> Optional[int]:
+        room = self.rooms.get(room_id)
+        return room["players"] if room is not None and self.valid() else None
+
+    def clear(self):
+        self._patched()
+        self.rooms = {}
+        self.ids = []
+        self.expires = 0.0
+
+    def _patched(self):
+        self.version += 1
+        self.patches += 1
+
+    def metrics(self) -> dict:
+        return {
+            "rooms": len(self.rooms),
+            "valid": self.valid(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "patches": self.patches,
+        }
@@ -1,4 +1,6 @@
 from fastapi import Depends, HTTPException, status
+from sqlalchemy import delete, insert, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from schemas import room as room_schema
@@ -6,6 +8,31 @@ from models import room as room_model
 from models import player as player_model
 from models import user as user_model
 from cruds.user import get_current_user_from_cookie
+from cruds.cache import TTLCache
+from cruds.lobby import LobbyCache
+from env import Env
+
+# (user_id, room_id) -> そのルームでのPlayerのid。WebSocketの接続のたびにDBに問い合わせないようにする
+# 参加していなければ(None)キャッシュしない。参加・退出・ルーム削除で消す (ほかのワーカーのキャッシュは期限切れで入れ替わる)
+player_cache = TTLCache(Env.AUTH_CACHE_SIZE, Env.AUTH_CACHE_TTL)
+
+# ロビーの一覧。ルームの作成・参加・退出・削除のたびに書き換える
+lobby_cache = LobbyCache(Env.LOBBY_CACHE_TTL)
+
+# ロビーの変更を受け取るコルーチン関数 (routers/game.pyがLobbyHub.publishを登録する)
+lobby_listeners = []
+
+# コミットしたあとに呼び、ロビーのキャッシュに反映してから購読しているクライアントに知らせる
+async def notify_lobby(event: dict):
+    lobby_cache.apply(event)
+    if event["type"] in ("player_joined", "player_left") and event.get("players") is None:
+        event["players"] = lobby_cache.players(event["room_id"])
+    for listener in lobby_listeners:
+        try:
+            await listener(event)
+        except Exception as e:
+            # 知らせられなくても変更は済んでいる (クライアントは次の取得で追いつく)
+            print(f"Error in notify_lobby: {e}")
 
 async def check_player_existence(
     user_id, room_id, db
@@ -22,6 +49,20 @@ async def check_player_existence(
     return player
     
 
+# そのルームに参加していればPlayerのidを、していなければNoneを返す
+async def get_player_id(user_id, room_id, db):
+    
+    async def load_player_id():
+        result = await db.execute(
+            select(player_model.Player.id)
+            .where(player_model.Player.user_id == user_id)
+            .where(player_model.Player.room_id == room_id)
+        )
+        return result.scalars().first()
+    
+    return await player_cache.get_or_load((user_id, room_id), load_player_id)
+
+
 
 # /room POST
 async def create_room(
@@ -47,12 +88,12 @@ async def create_room(
 
     room_data = room_model.Room(
         max_players=form_data.max_players,
-        game_type=form_data.game_type
+        game_type=form_data.game_type,
+        player_count=1
     )
 
     db.add(room_data)
-    await db.commit()
-    await db.refresh(room_data)
+    await db.flush()
 
     room_id = room_data.id
 
@@ -61,8 +102,19 @@ async def create_room(
         user_id=user_id,
     )
 
+    # ルームと作成者の参加は同じトランザクションでコミットする
     db.add(player_data)
     await db.commit()
+    player_cache.delete((user_id, room_id))
+    await notify_lobby({
+        "type": "room_created",
+        "room": {
+            "id": room_id,
+            "max_players": form_data.max_players,
+            "game_type": form_data.game_type.value,
+            "players": 1
+        }
+    })
 
     return {
         "id": room_id,
@@ -81,6 +133,17 @@ async def get_rooms(db: AsyncSession):
     
     return rooms
 
+# /room/lobby GET
+async def get_lobby(
+    db: AsyncSession,
+    after: int = 0,
+    limit: int = 20,
+    game_type: str = None,
+    open_only: bool = False
+    ):
+
+    return await lobby_cache.page(db, after, limit, game_type, open_only)
+
 #/room/{room_id} PUT
 async def update_room(
     room_id: int,
@@ -103,6 +166,7 @@ async def update_room(
     room_data.game_type = form_data.game_type
     
     await db.commit()
+    await notify_lobby({"type": "room_updated", "room_id": room_id, "game_type": form_data.game_type.value})
     
     return {
         "id": room_id,
@@ -127,7 +191,8 @@ async def delete_room(
             detail="You are not in this room"
         )
     
-    room_data = await db.get(room_model.Room, room_id)
+    # 先にルームの行をロックして、削除中に参加されないようにする
+    room_data = await db.get(room_model.Room, room_id, with_for_update=True)
     
     result = await db.execute(
         select(player_model.Player).where(player_model.Player.room_id == room_id)
@@ -142,6 +207,10 @@ async def delete_room(
     
     await db.commit()
     
+    for player in players:
+        player_cache.delete((player.user_id, room_id))
+    await notify_lobby({"type": "room_deleted", "room_id": room_id})
+    
     return {"message": "delete success"}
 
 # /room/{room_id}/join POST
@@ -153,49 +222,63 @@ async def join_room(
     
     user_id = current_user["id"]
     
-    player = await check_player_existence(user_id, room_id, db)
+    # 空きがあるときだけ人数を1つ増やす。ルームの行はコミットまでロックされるので、
+    # 同時に参加しても1人ずつ通り、max_playersを超えることはない
+    result = await db.execute(
+        update(room_model.Room)
+        .where(room_model.Room.id == room_id)
+        .where(room_model.Room.player_count < room_model.Room.max_players)
+        .values(player_count=room_model.Room.player_count + 1)
+    )
     
-    if player:
+    if result.rowcount == 0:
+        await db.rollback()
+        await raise_join_error(user_id, room_id, db)
+    
+    # 同じルームに2回参加しようとすると (user_id, room_id) の一意制約で弾かれ、人数の増加も取り消される
+    try:
+        await db.execute(
+            insert(player_model.Player)
+            .values(room_id=room_id, user_id=user_id)
+        )
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="You are already in this room"
         )
-        
+    
+    player_cache.delete((user_id, room_id))
+    await notify_lobby({"type": "player_joined", "room_id": room_id, "user_id": user_id})
+    
+    return {
+        "id": room_id,
+        "user_id": user_id,
+    }
+    
+# 参加できなかった理由を調べて返す (失敗したときだけ問い合わせる)
+async def raise_join_error(user_id, room_id, db):
+    
     room_data = await db.get(room_model.Room, room_id)
     if not room_data:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Room not found"
         )
-        
-    result = await db.execute(
-        select(player_model.Player)
-        .where(player_model.Player.room_id == room_id)
-    )
-    
-    players = result.scalars().all()
-    player_count = len(players)
     
-    if player_count >= room_data.max_players:
+    player = await check_player_existence(user_id, room_id, db)
+    if player:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Room is full. Maximum players: {room_data.max_players}"
+            detail="You are already in this room"
         )
     
-    
-    player_data = player_model.Player(
-        room_id=room_id,
-        user_id=user_id,
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=f"Room is full. Maximum players: {room_data.max_players}"
     )
     
-    db.add(player_data)
-    await db.commit()
-    
-    return {
-        "id": room_id,
-        "user_id": user_id,
-    }
-    
 # /room/{room_id}/leave DELETE
 async def leave_room(
     room_id: int,
@@ -213,8 +296,28 @@ async def leave_room(
             detail="You are not in this room"
         )
     
-    await db.delete(player)
+    # 参加と同じくルームの行を先にロックしてから、人数を減らしてPlayerを消す
+    await db.execute(
+        update(room_model.Room)
+        .where(room_model.Room.id == room_id)
+        .values(player_count=room_model.Room.player_count - 1)
+    )
+    result = await db.execute(
+        delete(player_model.Player)
+        .where(player_model.Player.id == player.id)
+    )
+    
+    # 同時に退出していた
+    if result.rowcount == 0:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="You are not in this room"
+        )
+    
     await db.commit()
+    player_cache.delete((user_id, room_id))
+    await notify_lobby({"type": "player_left", "room_id": room_id, "user_id": user_id})
     
     return {"message": "leave success"}
 
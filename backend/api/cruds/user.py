@@ -1,7 +1,7 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from fastapi import Cookie, HTTPException, status, Response, Depends
-from db import get_db
+from db import get_read_db
 from typing import Optional
 from datetime import datetime, timedelta, timezone
 from typing import Union
@@ -11,6 +11,8 @@ import models.user as user_model
 import schemas.user as user_schema
 from passlib.context import CryptContext
 from env import Env
+from cruds.cache import TTLCache
+from cruds.hashing import PasswordPool
 
 
 SECRET_KEY = Env.SECRET_KEY
@@ -20,11 +22,17 @@ ACCESS_TOKEN_EXPIRE_MINUTES = Env.ACCESS_TOKEN_EXPIRE_MINUTES
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+# user_id -> {"id", "name", "email"}。トークンに名前とメールがないときだけ使う
+user_cache = TTLCache(Env.AUTH_CACHE_SIZE, Env.AUTH_CACHE_TTL)
 
-def verify_password(plain_password: str, hashed_password: str):
-    return pwd_context.verify(plain_password, hashed_password)
+# bcryptはイベントループを止めないよう専用のスレッドプールで行う
+password_pool = PasswordPool(Env.PASSWORD_WORKERS, Env.PASSWORD_QUEUE_SIZE)
+
+async def get_password_hash(password):
+    return await password_pool.run(pwd_context.hash, password)
+
+async def verify_password(plain_password: str, hashed_password: str):
+    return await password_pool.run(pwd_context.verify, plain_password, hashed_password)
 
 async def get_user_by_email(db: AsyncSession, email: str):
     result = await db.execute(
@@ -42,7 +50,7 @@ async def authenticate_user(db: AsyncSession, email: str, password: str):
     user = await get_user_by_email(db, email)
     if not user:
         return None
-    if not verify_password(password, user.password):
+    if not await verify_password(password, user.password):
         return None
     return user
 
@@ -57,8 +65,9 @@ def create_access_token(data: dict, expires_delta: Union[timedelta, None] = None
     return encoded_jwt
 
 
+# ユーザーの取得は読み取りだけなのでレプリカから
 async def get_current_user_from_cookie(
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     access_token: Optional[str] = Cookie(None)
 ):
     
@@ -98,6 +107,50 @@ async def get_current_user_from_cookie(
     }
 
 
+# WebSocket用。署名と期限を確かめたトークンのクレームをそのまま信用し、DBには問い合わせない
+# (create_access_tokenでsub, name, emailを入れている)
+async def get_current_user_from_token(
+    db: AsyncSession = Depends(get_read_db),
+    access_token: Optional[str] = Cookie(None)
+):
+    
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="認証情報が不正です",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    
+    if not access_token:
+        raise credentials_exception
+    
+    try:
+        payload = jwt.decode(access_token, SECRET_KEY, algorithms=[ALGORITHM])
+        user_id = int(payload["sub"])
+    except (jwt.InvalidTokenError, KeyError, ValueError):
+        raise credentials_exception
+    
+    if payload.get("name") and payload.get("email"):
+        return {
+            "id": user_id,
+            "name": payload["name"],
+            "email": payload["email"]
+        }
+    
+    # クレームが足りない古いトークンはDBから取り、しばらくキャッシュする
+    async def load_user():
+        result = await db.execute(select(user_model.User).where(user_model.User.id == user_id))
+        user = result.scalar_one_or_none()
+        if user is None:
+            return None
+        return {"id": user.id, "name": user.name, "email": user.email}
+    
+    user = await user_cache.get_or_load(user_id, load_user)
+    if user is None:
+        raise credentials_exception
+    
+    return user
+
+
 # /user/register
 async def register(user_body: user_schema.UserCreate, db: AsyncSession):
     
@@ -117,7 +170,7 @@ async def register(user_body: user_schema.UserCreate, db: AsyncSession):
             detail="Email already exists"
         )
         
-    hashed_password = get_password_hash(user_body.password)
+    hashed_password = await get_password_hash(user_body.password)
     
     db_user = user_model.User(
         name=user_body.name,
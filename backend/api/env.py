@@ -15,10 +15,65 @@ class Env:
     DB_HOST = os.environ.get("DB_HOST")
     DB_PORT = os.environ.get("DB_PORT")
     DB_NAME = os.environ.get("DB_NAME")
+    # 読み取り用のレプリカ (なければプライマリを使う)
+    DB_READ_HOST = os.environ.get("DB_READ_HOST")
+    DB_READ_PORT = os.environ.get("DB_READ_PORT")
+
+    # 接続プール。pool_size本を保ち、混んだらmax_overflow本まで増やす。recycle秒より古い接続は張り直す
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+    DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+    DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+    DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+    DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true"
+    # SELECTの実行時間の上限(ミリ秒)。0なら上限なし
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", 0))
+    # 実行したSQLをログに出す
+    DB_ECHO = os.environ.get("DB_ECHO", "false").lower() == "true"
     
     SECRET_KEY = os.environ.get("SECRET_KEY")
     ALGORITHM = os.environ.get("ALGORITHM")
     ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES"))
+
+    # WebSocketの接続ごとの送信キューの長さと、一杯のときの扱い (coalesce / drop / disconnect)
+    SEND_QUEUE_SIZE = int(os.environ.get("SEND_QUEUE_SIZE", 64))
+    SEND_QUEUE_POLICY = os.environ.get("SEND_QUEUE_POLICY", "coalesce")
+
+    # ルームのアクターのメールボックスの長さ。一杯のときは積む側の受信を待たせる
+    ROOM_MAILBOX_SIZE = int(os.environ.get("ROOM_MAILBOX_SIZE", 256))
+
+    # 複数ワーカーで動かすときの各ワーカーの内部向けURL (カンマ区切り) と、このプロセスの番号
+    # 例: WORKER_URLS=ws://127.0.0.1:8001,ws://127.0.0.1:8002 。空ならワーカーは1つ
+    WORKER_URLS = [url for url in os.environ.get("WORKER_URLS", "").split(",") if url]
+    WORKER_ID = int(os.environ.get("WORKER_ID", 0))
+    # ワーカー間で転送した接続の署名に使う秘密鍵 (全ワーカーで同じ値にする)。なければSECRET_KEYを使う
+    FORWARD_SECRET = os.environ.get("FORWARD_SECRET") or os.environ.get("SECRET_KEY")
+    # ワーカー間のpub/sub (memory:// / redis://host:6379 / unix:///path/to/redis.sock)
+    EVENT_BUS_URL = os.environ.get("EVENT_BUS_URL", "memory://")
+
+    # 対局中のゲームのスナップショットの保存先 (空なら保存しない / file:///path / db)
+    SNAPSHOT_STORE = os.environ.get("SNAPSHOT_STORE", "")
+
+    # 何も起きなければルームを閉じるまでの秒数 (開始前 / 対局中 / 終了後)。0なら閉じない
+    ROOM_TTL_LOBBY = float(os.environ.get("ROOM_TTL_LOBBY", 1800))
+    ROOM_TTL_PLAYING = float(os.environ.get("ROOM_TTL_PLAYING", 3600))
+    ROOM_TTL_FINISHED = float(os.environ.get("ROOM_TTL_FINISHED", 300))
+    # ルーム数とメモリの見積もり(MB)の上限。超えたら終了したルームから閉じる。0なら上限なし
+    MAX_ROOMS = int(os.environ.get("MAX_ROOMS", 0))
+    ROOM_MEMORY_BUDGET_MB = int(os.environ.get("ROOM_MEMORY_BUDGET_MB", 0))
+    # 見回りの間隔(秒)
+    REAPER_INTERVAL = float(os.environ.get("REAPER_INTERVAL", 30))
+
+    # 認証で使うユーザーとルームの参加状況のキャッシュ (件数の上限と有効期限の秒数)
+    AUTH_CACHE_SIZE = int(os.environ.get("AUTH_CACHE_SIZE", 10000))
+    AUTH_CACHE_TTL = float(os.environ.get("AUTH_CACHE_TTL", 30))
+    # ロビーの一覧のキャッシュの有効期限(秒)。0ならキャッシュしない
+    LOBBY_CACHE_TTL = float(os.environ.get("LOBBY_CACHE_TTL", 10))
+    # ロビーの変更を/lobby/wsにまとめて送る間隔(秒)
+    LOBBY_FLUSH_INTERVAL = float(os.environ.get("LOBBY_FLUSH_INTERVAL", 0.5))
+
+    # パスワードのハッシュ化・照合のスレッド数と、受け付ける待ちの件数 (超えたら503)
+    PASSWORD_WORKERS = int(os.environ.get("PASSWORD_WORKERS", os.cpu_count() or 1))
+    PASSWORD_QUEUE_SIZE = int(os.environ.get("PASSWORD_QUEUE_SIZE", 64))
  
   
 
@@ -1,13 +1,26 @@
 import uvicorn
 import yaml
 import json
+import multiprocessing
+import signal
+import socket
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+from env import Env
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from routers import user
 from routers import room
 from routers import game
 
-app = FastAPI()
+# 起動したらほかのワーカーのロビーの変更を受け取り始める
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    game.lobby.start()
+    yield
+    game.lobby.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:5173",
@@ -42,5 +55,39 @@ app.include_router(room.room_router)
 app.include_router(game.game_router)
 
 
+# WORKER_URLSにワーカーが複数あれば、ワーカーごとにプロセスを立てる。
+# どのワーカーも公開ポート(8000)を共有して受け付け、担当でないルームの接続は
+# 担当ワーカーの内部向けのポートに中継する (routers/majan/manager/ownership.py)
+def serve_worker(worker_id: int, sockets: list):
+    game.manager.ownership.worker_id = worker_id
+    uvicorn.Server(uvicorn.Config(app)).run(sockets=sockets)
+
+
+def run_workers(host: str = "0.0.0.0", port: int = 8000):
+    public = socket.create_server((host, port), reuse_port=True)
+    processes = []
+    for worker_id, url in enumerate(Env.WORKER_URLS):
+        parsed = urlparse(url)
+        internal = socket.create_server((parsed.hostname, parsed.port))
+        process = multiprocessing.get_context("fork").Process(
+            target=serve_worker, args=(worker_id, [public, internal])
+        )
+        process.start()
+        processes.append(process)
+
+    # 親が止められたらワーカーも止める
+    def stop(signum, frame):
+        for process in processes:
+            process.terminate()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for process in processes:
+        process.join()
+
+
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", reload=True)
\ No newline at end of file
+    if len(Env.WORKER_URLS) > 1:
+        run_workers()
+    else:
+        uvicorn.run("main:app", host="0.0.0.0", reload=True)
\ No newline at end of file
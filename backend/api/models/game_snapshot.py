@@ -0,0 +1,11 @@
+from sqlalchemy import Column, String, LargeBinary, DateTime, text
+from db import Base
+
+
+# 対局中のゲームのスナップショット (routers/majan/manager/snapshot.py)
+class GameSnapshot(Base):
+    __tablename__ = "game_snapshots"
+    
+    room_id = Column(String(64), primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime, server_default=text('CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP'), nullable=False)
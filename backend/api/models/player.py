@@ -1,9 +1,10 @@
-from sqlalchemy import Column, Integer, Enum, ForeignKey
+from sqlalchemy import Column, Integer, Enum, ForeignKey, UniqueConstraint
 from db import Base
 
 
 class Player(Base):
     __tablename__ = "players"
+    __table_args__ = (UniqueConstraint("user_id", "room_id", name="unique_user_room"),)
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -6,4 +6,6 @@ class Room(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     max_players = Column(Integer, nullable=False)
-    game_type = Column(Enum('sanma', 'yonma'), nullable=False)
\ No newline at end of file
+    game_type = Column(Enum('sanma', 'yonma'), nullable=False)
+    # 参加している人数。参加はこの列をmax_playersまでの条件付きで増やし、ルームの行のロックで順番に通す
+    player_count = Column(Integer, nullable=False, default=0, server_default="0")
\ No newline at end of file
@@ -1,145 +1,91 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-from cruds.user import get_current_user_from_cookie
-from models import player as player_model
-from sqlalchemy.future import select
+from cruds.user import get_current_user_from_token
+from cruds import room as room_crud
 from sqlalchemy.ext.asyncio import AsyncSession
 from db import get_db
+from env import Env
 from .majan.manager.connection_manager import ConnectionManager
+from .majan.manager.lobby import LobbyHub
+from .majan.manager.protocol import ProtocolError, receive_message
 
 game_router = APIRouter()
 manager = ConnectionManager()
 
+# ロビーの変更はゲームと同じイベントバスで全ワーカーに流す
+lobby = LobbyHub(manager.bus, room_crud.lobby_cache, Env.LOBBY_FLUSH_INTERVAL)
+room_crud.lobby_listeners.append(lobby.publish)
+
+@game_router.websocket("/lobby/ws")
+async def lobby_endpoint(websocket: WebSocket):
+    
+    # ロビーの変更をまとめて送るだけなので、どのワーカーでも受け付ける (一覧はGET /room/lobbyで取る)
+    await lobby.connect(websocket)
+    
+    try:
+        while True:
+            # クライアントからは何も受け取らない
+            await websocket.receive_text()
+            
+    except WebSocketDisconnect:
+        pass
+    finally:
+        lobby.disconnect(websocket)
+
 @game_router.websocket("/room/{room_id}/ws")
 async def websocket_endpoint(
     websocket: WebSocket, 
     room_id: str,
     db: AsyncSession = Depends(get_db),
-    current_user: dict = Depends(get_current_user_from_cookie)
+    # トークンのクレームで認証するので、ユーザーはDBに問い合わせない
+    current_user: dict = Depends(get_current_user_from_token)
     ):
     
+    # 複数ワーカーのとき、このルームを担当していなければ担当ワーカーに中継する
+    if manager.ownership.should_forward(websocket, room_id):
+        await manager.ownership.forward(websocket, room_id)
+        return
+    
     user_id = current_user["id"]
     player_name = current_user["name"]
     
-    result = await db.execute(
-        select(player_model.Player)
-        .where(player_model.Player.user_id == user_id)
-    )
-
-    player = result.scalars().first()
-    
-    player_id = player.id
+    # ルームのidは数字だけ
+    if not room_id.isdigit():
+        await websocket.close(code=1008)
+        return
     
-    await manager.connect(websocket, room_id, player_id)
+    # このルームでのPlayerのidはキャッシュから (参加・退出・ルーム削除で消える)
+    player_id = await room_crud.get_player_id(user_id, int(room_id), db)
     
-    game = manager.get_game(room_id)
+    # このルームに参加していない
+    if player_id is None:
+        await websocket.close(code=1008)
+        return
     
-    # タイムアウトイベントのコールバックを設定
-    if game:
-        async def on_doubt_timeout(timeout_result):
-            await manager.broadcast({
-                "action": "doubt_timeout",
-                "winner": timeout_result["winner"],
-                "reason": timeout_result["reason"]
-            }, room_id)
-        
-        # コールバックを登録
-        game.on_doubt_timeout = on_doubt_timeout
-    
-    # player_idがplayersにない
-    if game and player_id not in game.players:
-        # ゲームが開始されている場合はエラーを返す
-        if game.game_started:
-            await manager.send_personal(
-                {"error": "ゲームはすでに開始されています"},
-                room_id, player_id
-            )
-            
-        # そうでなければプレイヤーを追加
-        else:
-            game.add_player(player_id, player_name)
-            await manager.broadcast(
-                {"action": "player_joined", "player_id": player_id, "name": player_name},
-                room_id
-            )
+    await manager.connect(websocket, room_id, player_id)
     
     try:
+        # 参加はルームのアクターが処理する (ゲームが開始されていればエラーを返す)
+        await manager.join(room_id, player_id, player_name)
+        
         while True:
-            data = await websocket.receive_json()
-            
-            #get_gameでroom_idに対応するBinaryMahjongGameを取得
-            game = manager.get_game(room_id)
-            
-            if not game:
-                await websocket.send_json({"error": "ゲームが見つかりません"})
+            # JSONでもバイナリ(msgpack)でも同じdictで受け取る
+            try:
+                data = await receive_message(websocket)
+            except ProtocolError as e:
+                # 読めないメッセージは捨て、接続は切らずにエラーを返す
+                await manager.send_personal({"error": str(e)}, room_id, player_id)
                 continue
-                
-            # actionを取得
-            action = data.get("action")
             
-            # actionが"start_game"の場合, start_gameメソッドを実行
-            if action == "start_game":
-                # trueが返ってきた場合
-                if game.start_game():
-                    await manager.broadcast({"action": "game_started"}, room_id)
-                else:
-                    await websocket.send_json({"error": "ゲームを開始できません"})
-                    
-          
-            # actionが"discard"の場合, discard_haiメソッドを実行
-            elif action == "discard":
-                hai_idx = data.get("hai_idx")
-                success, result = await game.discard_hai(player_id, hai_idx)
-                
-                if success:
-                    await manager.broadcast({
-                        "action": "hai_discarded",
-                        "player_id": player_id,
-                        "message": result.get("message", ""),
-                        "ron_available": result.get("ron_available", False),
-                        "ron_timeout": result.get("ron_timeout", 0)
-                    }, room_id)
-                else:
-                    await websocket.send_json({"error": result})
-                    
-            elif action == "claim_ron":
-                success, result = await game.claim_ron(player_id)
-                
-                if success:
-                    await manager.broadcast({
-                        "action": "ron_claimed",
-                        "player_id": player_id,
-                        "doubt_available": result.get("doubt_available", False),
-                        "doubt_timeout": result.get("doubt_timeout", 30)
-                    }, room_id)
-                else:
-                    await websocket.send_json({"error": result})
-                        
-            # actionが"claim_doubt"の場合, claim_doubtメソッドを実行
-            elif action == "claim_doubt":
-                target_id = data.get("target_id")
-                success, result = await game.claim_doubt(player_id, target_id)
-                
-                if success:
-                    await manager.broadcast({
-                        "action": "doubt_result",
-                        "doubter_id": player_id,
-                        "target_id": target_id,
-                        "winner": result["winner"],
-                        "reason": result["reason"]
-                    }, room_id)
-                else:
-                    await websocket.send_json({"error": result})
-                    
-            # actionが"get_game_state"の場合, get_game_stateメソッドを実行
-            elif action == "get_game_state":
-                await websocket.send_json({
-                    "action": "game_state",
-                    "game_state": game.get_game_state(player_id)
-                })
+            # ゲームは直接触らず、ルームのメールボックスに積む。処理と結果の送信はアクターが順番に行う
+            if not await manager.submit(room_id, player_id, data):
+                # ルームが閉じられた。送信キューが残っていればエラーを送って切る
+                await manager.send_personal({"error": "ゲームが見つかりません"}, room_id, player_id)
+                await websocket.close(code=1001)
+                break
                 
     except WebSocketDisconnect:
-        manager.disconnect(room_id, player_id)
-        await manager.broadcast({
-            "action": "player_disconnected",
-            "player_id": player_id
-        }, room_id)
\ No newline at end of file
+        pass
+    finally:
+        # どんな理由で抜けても接続を外す。ルームのアクターがなければ送信キューを直接止める
+        if not await manager.leave(room_id, player_id, websocket):
+            manager.disconnect(room_id, player_id, websocket)
@@ -1,6 +1,10 @@
 from mahjong.constants import EAST, SOUTH, WEST, NORTH
+import inspect
 import random
 from . import rule, janshi, taku
+from .policy import ConsolePolicy, NpcPolicy
+from .sink import EventSink, PrintSink
+from .yama import Yama
 
 
 
@@ -9,20 +13,36 @@ class Game:
     KAZE = {EAST: '東', SOUTH: '南', WEST: '西', NORTH: '北'}
 
 
-    def __init__(self, hanchan=False, play=False, aka=False, player=4):
-        a = 0
+    # headless=Trueなら判断はすべてNpcPolicy、表示はEventSinkになり、入出力なしで進行する
+    # policies(4人分)とsinkを渡せば、判断と表示をそれぞれ差し替えられる
+    # rngを渡すと起家決めと洗牌にそれを使う (シミュレーションでの再現用)
+    def __init__(self, hanchan=False, play=False, aka=False, player=4, headless=False, policies=None, sink=None,
+                 rng=None):
+        self.rng = rng or random
         self.taku = taku.Taku(aka)
         self.aka = aka
         self.hanchan = hanchan
         self.play = play
         self.kansen = not play
+        self.player = player
 
         self.janshi = []
         for i in range(player):
             jun = janshi.Janshi(play=True)
             self.janshi.append(jun)
         for i in range(4 - player):
-            self.janshi.append(str(janshi.Janshi(play=False)))
+            self.janshi.append(janshi.Janshi(play=False))
+
+        if policies is None:
+            if headless:
+                policies = [NpcPolicy() for i in range(4)]
+            else:
+                policies = [ConsolePolicy() if jun.play else NpcPolicy() for jun in self.janshi]
+        self.policies = policies
+
+        if sink is None:
+            sink = EventSink() if headless else PrintSink(pause=play)
+        self.sink = sink
 
         self.junme = 1
         self.chiicha = 0
@@ -30,7 +50,11 @@ class Game:
 
         self.ryukyoku = False
         self.agari = False
+        self.tobi = False
+
 
+    def emit(self, event, **data):
+        self.sink.emit(self, event, **data)
 
     def playername(self, player):
         for i in range(player):
@@ -45,83 +69,79 @@ class Game:
             self.janshi[(self.oya + i) % 4].jikaze_str = self.KAZE[self.janshi[(self.oya + i) % 4].jikaze] + '家'
 
     def oyagime(self):
-        self.chiicha = random.randint(0, 3)
+        self.chiicha = self.rng.randint(0, 3)
         self.oya = self.chiicha
         self.kazegime()
-        print('起家 ' + self.janshi[self.chiicha].name + '\n')
+        self.emit('chiicha', idx=self.chiicha)
 
     def bakaze_str(self):
         return self.KAZE[self.taku.bakaze]
 
     def start(self):
-        global idx
         self.junme = 1
-        self.ryuukyoku = False
+        self.ryukyoku = False
         self.agari = False
         self.tobi = False
 
-        for i in range(4):
-            janshi.riichi = False
+        for jun in self.janshi:
+            jun.riichi = False
+            jun.kawa = []
 
         self.oya = (self.oya + self.taku.kyoku) % 4
         self.kazegime()
 
-        print(str(self.bakaze_str()) + ' ' + str(self.taku.kyoku) + '局\n')
+        self.emit('kyoku_start', bakaze=self.taku.bakaze, kyoku=self.taku.kyoku)
 
-        self.taku.yama = self.taku.hai.copy()
-        #random.shuffle(self.taku.yama)
+        self.taku.yama = Yama(self.taku.hai)
+        self.taku.yama.shuffle(self.rng)
 
         for i in range(4):
             idx = (self.oya + i) % 4
             self.janshi[idx].haipai(self.taku.yama)
             self.janshi[idx].riipai()
+            self.emit('haipai', idx=idx, jun=i)
+
+        self.emit('dora', dora_hyouji=self.taku.dora_hyouji)
+
+    def agari_shori(self, agari_idx, tsumo, hai=None, houjuu_idx=None):
+        janshi = self.janshi[agari_idx]
+        # ロンのときは和了牌を手牌の最後に加えて計算する
+        tehai = janshi.tehai if tsumo else janshi.tehai + [hai]
+        result = rule.Rule.agari(tehai, self.taku.dora_hyouji, tsumo,
+                                 janshi.riichi, janshi.jikaze, self.taku.bakaze)
+
+        if result.cost:
+            if tsumo:
+                tensuu = 0
+                for i in range(4):
+                    if i != agari_idx:
+                        if self.janshi[i].jikaze == EAST:
+                            payment = result.cost['main']
+                        else:
+                            payment = result.cost['additional']
+                        self.janshi[i].lost_tenbou(payment)
+                        tensuu += payment
+            else:
+                tensuu = result.cost['main']
+                self.janshi[houjuu_idx].lost_tenbou(tensuu)
 
-            if self.janshi[idx].play:
-                print(self.janshi[idx].jikaze_str + f'{i+1}の手牌')
-                print([hai.str for hai in self.janshi[idx].tehai])
-
-                print('\n')
-
-        print('ドラ表示牌')
-        print([dora.str for dora in self.taku.dora_hyouji])
-
-        if self.play:
-            input('Press any key')
-
-    def agari_shori(self, agari_idx, tsumo):
-        print(self.janshi[agari_idx].name + 'の和了')
-
-    # result = rule.Rule.agari(self.janshi[agari_idx].tehai, self.taku.dora_hyouji, tsumo,
-    #                          self.janshi[agari_idx].riichi, self.janshi[agari_idx].jikaze, self.taku.bakaze)
-    # if result:
-    #     print(result.yaku)
-    #            if self.janshi[agari_idx].jikaze == EAST:
-    #         print(str(result.cost['main']) + 'オール\n')
-    #     else:
-    #         print(str(result.cost['main']), str(result.cost['additional']) + '点\n')
-    #     self.janshi[agari_idx].get_tenbou(result.cost['main'] + result.cost['additional'] * 2)
+            # 供託の立直棒も和了者が受け取る
+            janshi.get_tenbou(tensuu + self.taku.riibou * 1000)
+            self.taku.riibou = 0
 
-    #     for i in range(4):
-    #         if i != agari_idx:
-    #             if i == self.oya:
-    #                 self.janshi[i].lost_tenbou(result.cost['main'])
-    #            else:
-    #            self.janshi[i].lost_tenbou(result.cost['additional'])
-    #else:
-    #    print('和了の計算に失敗しました')
+        self.emit('agari', idx=agari_idx, tsumo=tsumo, result=result)
 
     def ryuukyoku_shori(self):
         self.ryukyoku = True
         number_of_tenpai = 0
-        for janshi in self.janshi:
-            shantensu = rule.Rule.shantensuu(janshi.tehai)
+        for idx, janshi in enumerate(self.janshi):
+            shantensu = janshi.shantensuu()
             if shantensu == 0:
-                print(janshi.name + '聴牌')
                 janshi.tenpai = True
                 number_of_tenpai += 1
             else:
-                print(janshi.name + '不聴')
                 janshi.tenpai = False
+            self.emit('tenpai', idx=idx, tenpai=janshi.tenpai)
         if number_of_tenpai != 0:
             for janshi in self.janshi:
                 if janshi.tenpai:
@@ -133,159 +153,89 @@ class Game:
     def finish_kyoku(self):
         self.taku.kyoku += 1
         for i in range(4):
-            print(self.janshi[i].name + ' ' + str(self.janshi[i].tenbou) + '点')
             if (self.janshi[i].tenbou < 0):
-                print('トビ')
                 self.tobi = True
-        print('\n')
-        if self.play:
-            input('Press any key')
-
-    def player_choice(self, player_idx, shantensu):
-        janshi = self.janshi[player_idx]
-        riichi = False
-
-        # 立直できる状況のときの処理
-        if shantensu == 0 and not janshi.riichi and len(self.taku.yama) > 17:
-            temp = input('立直しますか?(Y/N) : ')
-            if temp == 'Y' or temp == 'y':
-                riichi = True
-
-        # 立直するときの入力処理
-        if riichi:
-            riichi_idx = janshi.riichi_idx()
-            while 1:
-                try:
-                    print(riichi_idx)
-                    txt = '捨て牌の番号を入力してください' + str(riichi_idx) + ' : '
-                    sutehai = int(input(txt))
-                except ValueError:
-                    print('半角の整数で入力してください')
-                if not sutehai in riichi_idx:
-                    print('その牌では立直できません')
-                else:
-                    break
-
-        # すでに立直しているときはツモ切りを実行
-        elif janshi.riichi:
-            input('ツモ切りします(Press Enter) ')
-            sutehai = 13
+        self.emit('kyoku_end', tobi=self.tobi)
 
-        # 通常時の処理
-        else:
-            while 1:
-                try:
-                    sutehai = int(input('捨て牌の番号を入力してください(0~13) : '))
-                except ValueError:
-                    print('0から13の整数を半角で入力してください')
-                if sutehai < 0 or 13 < sutehai:
-                    print('0から13の整数を入力してください')
-                else:
-                    break
-
-        # このメソッド内でjanshi.riichiをTrueにしてしまうと立直時にツモ切りしてしまうため
-        # riichiを戻し打牌処理を行ってからjanshi.riichiをTrueにする
-        return sutehai, riichi
-
-    def ichijun(self):
-        print('\n' + str(self.junme) + '巡目')
+    # 判断が必要な箇所では (Policyのメソッド名, プレイヤー, 引数) をyieldし、判断結果を受け取る。
+    # 同期のPolicyだけならichijun/game、コルーチンを返すPolicyを含むならagameで進める
+    def _ichijun(self):
+        self.emit('junme', junme=self.junme)
         for i in range(4):
             # 東→南→西→北の巡で処理を行うための変数
             idx = (self.oya + i) % 4
             janshi = self.janshi[idx]
 
-            print(janshi.jikaze_str + '(' + janshi.name + ')' + 'の手番')
-
-            if self.kansen:
-                print([hai.str for hai in janshi.tehai], end=' ')
-            elif janshi.play:
-                print([str(j) + ': ' + janshi.tehai[j].str for j in range(len(janshi.tehai))], end=' ')
+            self.emit('teban', idx=idx)
 
             tsumohai = janshi.tsumo(self.taku.yama)
+            self.emit('tsumo', idx=idx, hai=tsumohai)
 
-            if self.kansen:
-                print(tsumohai.str)
-            elif janshi.play:
-                print('13: ' + tsumohai.str)
-
-            shantensu = rule.Rule.shantensuu(janshi.tehai)
+            shantensu = janshi.shantensuu()
 
             if shantensu == -1:
-                agari = False
-                if janshi.play:
-                    temp = input('和了しますか?(Y/N) : ')
-                    if temp == 'Y' or temp == 'y':
-                        agari = True
-                else:
-                    agari = True
+                agari = yield ('agari', idx, {})
                 if agari:
                     self.agari_shori(idx, tsumo=True)
                     self.agari = True
                     self.finish_kyoku()
                     break
 
-            if self.kansen or janshi.play:
-                if shantensu == 0:
-                    print('聴牌')
-                else:
-                    print(str(shantensu) + '向聴')
+            self.emit('shanten', idx=idx, shantensu=shantensu)
 
             riichi = False
 
-            # プレイヤーの行動選択処理
-            if janshi.play:
-                sutehai, riichi = self.player_choice(idx, shantensu)
+            # 立直できる状況のときの処理
+            if shantensu == 0 and not janshi.riichi and self.taku.yama.nokori > 3:
+                riichi = yield ('riichi', idx, {})
 
-            # NPCの行動選択処理
-            else:
-                # 聴牌し、山が残り17牌以上なら強制的に立直する
-                if shantensu == 0 and not janshi.riichi and len(self.taku.yama) > 17:
-                    print(janshi.jikaze_str + 'のリーチ')
-                    riichi = True
+            # すでに立直しているときはツモ切りを実行
+            if janshi.riichi:
+                yield ('tsumogiri', idx, {})
                 sutehai = 13
+            elif riichi:
+                sutehai = yield ('dahai', idx, {'riichi_idx': janshi.riichi_idx()})
+            else:
+                sutehai = yield ('dahai', idx, {})
 
-            # 打牌処理と打牌の表示
+            # 打牌処理
+            # janshi.riichiを先にTrueにしてしまうと立直時にツモ切りしてしまうため、打牌後にTrueにする
             discarded_tile = janshi.dahai(sutehai)
-            print('打 ' + discarded_tile.str)
 
             # リーチ時の処理
             if riichi:
+                self.emit('riichi', idx=idx)
                 janshi.lost_tenbou(1000)
                 self.taku.riibou += 1
                 janshi.riichi = True
 
+            self.emit('dahai', idx=idx, hai=discarded_tile)
+
             # Check for Ron by other players
             for other_idx in range(4):
                 if other_idx != idx and self.janshi[other_idx].can_ron(discarded_tile):
-                    if self.janshi[other_idx].play:
-                        temp = input(self.janshi[other_idx].name + 'のロンしますか?(Y/N) : ')
-                        if temp == 'Y' or temp == 'y':
-                            print(self.janshi[other_idx].name + 'のロン')
-                            self.agari_shori(other_idx, tsumo=False)
-                            self.agari = True
-                            self.finish_kyoku()
-                            return
-                    else:
-                        print(self.janshi[other_idx].name + 'のロン')
-                        self.agari_shori(other_idx, tsumo=False)
+                    ron = yield ('ron', other_idx, {'hai': discarded_tile})
+                    if ron:
+                        self.emit('ron', idx=other_idx, hai=discarded_tile)
+                        self.agari_shori(other_idx, tsumo=False, hai=discarded_tile, houjuu_idx=idx)
                         self.agari = True
                         self.finish_kyoku()
                         return
 
-            # 山が残り14牌になったら流局処理
-            if len(self.taku.yama) == 14:
-                print('流局\n')
+            # 王牌を残して山がなくなったら流局処理
+            if self.taku.yama.nokori == 0:
+                self.emit('ryuukyoku')
                 self.ryuukyoku_shori()
                 self.ryukyoku = True
                 self.finish_kyoku()
                 break
 
             janshi.riipai()
-            print('\n')
+            self.emit('teban_end', idx=idx)
         self.junme += 1
 
-    def game(self):
-        self.playername(player=4)
+    def _game(self):
+        self.playername(player=self.player)
         self.oyagime()
 
         if self.hanchan:
@@ -297,7 +247,7 @@ class Game:
             self.start()
 
             while 1:
-                self.ichijun()
+                yield from self._ichijun()
                 if self.agari == True or self.ryukyoku == True:
                     break
 
@@ -309,3 +259,39 @@ class Game:
                 self.taku.bakaze = SOUTH
                 self.taku.kyoku = 1
 
+    def _decide(self, decision):
+        name, idx, kwargs = decision
+        return getattr(self.policies[idx], name)(self, idx, **kwargs)
+
+    def _run(self, gen):
+        try:
+            decision = next(gen)
+            while True:
+                result = self._decide(decision)
+                if inspect.isawaitable(result):
+                    if inspect.iscoroutine(result):
+                        result.close()
+                    raise TypeError('コルーチンを返すPolicyを使うときはagameで進行してください')
+                decision = gen.send(result)
+        except StopIteration as e:
+            return e.value
+
+    async def _arun(self, gen):
+        try:
+            decision = next(gen)
+            while True:
+                result = self._decide(decision)
+                if inspect.isawaitable(result):
+                    result = await result
+                decision = gen.send(result)
+        except StopIteration as e:
+            return e.value
+
+    def ichijun(self):
+        return self._run(self._ichijun())
+
+    def game(self):
+        return self._run(self._game())
+
+    async def agame(self):
+        return await self._arun(self._game())
@@ -2,19 +2,48 @@ class Hai:
     KINDS = {0: '萬', 1: '筒', 2: '索', 3: '東', 4: '南', 5: '西', 6: '北', 7: '白', 8: '発', 9: '中'}
     AKADORA = {16: '赤5萬', 52: '赤5筒', 88: '赤5索'}
 
+    # 牌はプロセス内で共有するため変更不可にする
+    __slots__ = ('idx136', 'number', 'akaari', 'kinds', 'str', 'idx34')
+
     def __init__(self,number,aka=True):
-        self.number = number
-        self.akaari = aka
+        _set = object.__setattr__
+        # 0~135の牌ID
+        _set(self, 'idx136', number)
+        _set(self, 'akaari', aka)
 
         if number < 108:
-            self.kinds = number // 36
-            self.number = self.number // 4 - self.kinds * 9
-            if aka and self.number in self.AKADORA:
-                self.str = self.AKADORA[self.number]
+            _set(self, 'kinds', number // 36)
+            _set(self, 'number', number // 4 - self.kinds * 9)
+            if aka and number in self.AKADORA:
+                _set(self, 'str', self.AKADORA[number])
             else:
-                self.str = str(self.number + 1) + self.KINDS[self.kinds]
+                _set(self, 'str', str(self.number + 1) + self.KINDS[self.kinds])
 
         else:
-            self.kinds = 3
-            self.number = (self.number - 108) // 4
-            self.str = self.KINDS[self.kinds+self.number]
\ No newline at end of file
+            _set(self, 'kinds', 3)
+            _set(self, 'number', (number - 108) // 4)
+            _set(self, 'str', self.KINDS[self.kinds+self.number])
+
+        # 34種インデックス (0~8: 萬, 9~17: 筒, 18~26: 索, 27~33: 字牌)
+        _set(self, 'idx34', self.kinds * 9 + self.number)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Hai is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('Hai is immutable')
+
+    def __repr__(self):
+        return 'Hai(' + str(self.idx136) + ', ' + self.str + ')'
+
+
+# 赤ドラの有無ごとに136枚の牌を1度だけ作る
+_HAI_TABLE = {}
+
+
+def hai_table(aka=False):
+    table = _HAI_TABLE.get(aka)
+    if table is None:
+        table = tuple(Hai(i, aka) for i in range(136))
+        _HAI_TABLE[aka] = table
+    return table
@@ -13,6 +13,11 @@ class Janshi:
         self.kawa = []
         self.tenbou = 25000
 
+        # 手牌を34種の枚数で持つ。haipai/tsumo/dahaiで差分更新する
+        self.hai34 = [0] * 34
+        # 聴牌時の待ち牌(34種インデックス)。手牌が変わったときだけ計算し直す
+        self.machi = frozenset()
+
         self.riichi = False
         self.tenpai = False
         self.first = first
@@ -21,22 +26,26 @@ class Janshi:
 
     def haipai(self, yama):
         if self.first:
-            self.tehai = yama[0:14]
-            del yama[0:14]
+            self.tehai = yama.haipai(14)
         else:
-            self.tehai = yama[0:13]
-            del yama[0:13]
+            self.tehai = yama.haipai(13)
+
+        self.hai34 = [0] * 34
+        for hai in self.tehai:
+            self.hai34[hai.idx34] += 1
+        self.update_machi()
         
     
 
     def tsumo(self, yama):
-        hai = yama[0]
-        del yama[0]
+        hai = yama.tsumo()
         self.tehai.append(hai)
+        self.hai34[hai.idx34] += 1
+        self.update_machi()
         return hai
 
     def riipai(self):
-        self.tehai = sorted(self.tehai, key=lambda t: t.kinds * 9 + t.number)
+        self.tehai = sorted(self.tehai, key=lambda t: t.idx34)
 
     def get_tenbou(self, tensuu):
         self.tenbou += tensuu
@@ -48,26 +57,52 @@ class Janshi:
         if self.riichi:
             hai = self.tehai[13]
             del self.tehai[13]
+            self.hai34[hai.idx34] -= 1
+            self.update_machi()
             return hai
 
         else:
             hai = self.tehai[sutehai]
             del self.tehai[sutehai]
+            self.hai34[hai.idx34] -= 1
+            self.update_machi()
             self.kawa.append(hai)
             return hai
 
+    def shantensuu(self):
+        return rule.Rule.shantensuu34(self.hai34)
+
+    def dahai_kouho(self, ukeire=True, saiyuukou=False):
+        return rule.Rule.dahai_kouho(self.hai34, ukeire, saiyuukou)
+
     def riichi_idx(self):
+        # 同じ種類の牌はまとめて1回だけ評価する
+        kouho = self.dahai_kouho(ukeire=False)
         riichi_idx = []
         for i in range(len(self.tehai)):
-            shantensuu = rule.Rule.shantensuu(self.tehai[:i] + self.tehai[i + 1:])
-            if shantensuu == 0:
+            if kouho[self.tehai[i].idx34][0] == 0:
                 riichi_idx.append(i)
         return riichi_idx
 
+    def update_machi(self):
+        # 打牌待ちの手牌(3n+2枚)には待ちがない
+        if len(self.tehai) % 3 != 1 or rule.Rule.shantensuu34(self.hai34) != 0:
+            self.machi = frozenset()
+            return
+
+        machi = []
+        for idx34 in range(34):
+            # 4枚とも手の内にある牌では和了れない
+            if self.hai34[idx34] == 4:
+                continue
+            self.hai34[idx34] += 1
+            if rule.Rule.shantensuu34(self.hai34) == -1:
+                machi.append(idx34)
+            self.hai34[idx34] -= 1
+        self.machi = frozenset(machi)
+
     def can_ron(self, discarded_tile):
-        temp_tehai = self.tehai + [discarded_tile]
-        shantensuu = rule.Rule.shantensuu(temp_tehai)
-        return shantensuu == -1
+        return discarded_tile.idx34 in self.machi
 
 
 
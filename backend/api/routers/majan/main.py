@@ -1,4 +1,8 @@
-import game
+# python -m routers.majan.main で対局する
+from . import game
+
+
+if __name__ == '__main__':
+    game = game.Game(hanchan=False, play=True, aka=True)
+    game.game()
 
-game = game.Game(hanchan=False, play=True, aka=True)
-game.game()
@@ -0,0 +1,205 @@
+from typing import Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlparse
+import asyncio
+import inspect
+import json
+
+# ワーカー(プロセス)をまたいでイベントを届けるpub/sub
+#
+# EVENT_BUS_URL で実装を選ぶ
+#   memory://                   1プロセスの中だけで届ける (ワーカーが1つのときとテスト用)
+#   redis://:password@host:6379 Redis互換のサーバーのPUBLISH/SUBSCRIBE (pub/subはDBによらない)
+#   unix:///run/redis.sock      同じくUnixソケットで接続する
+#
+# メッセージはdictで、JSONにして送る。ハンドラーはdictを受け取り、コルーチンを返してもよい
+
+Handler = Callable[[dict], Optional[Awaitable[None]]]
+
+
+class EventBus:
+    def __init__(self):
+        self.handlers: Dict[str, List[Handler]] = {}
+        # 計測値
+        self.published = 0
+        self.delivered = 0
+        self.failed = 0
+
+    def subscribe(self, channel: str, handler: Handler):
+        self.handlers.setdefault(channel, []).append(handler)
+
+    def unsubscribe(self, channel: str, handler: Handler):
+        handlers = self.handlers.get(channel)
+        if handlers and handler in handlers:
+            handlers.remove(handler)
+            if not handlers:
+                del self.handlers[channel]
+
+    async def publish(self, channel: str, message: dict):
+        raise NotImplementedError
+
+    async def close(self):
+        self.handlers.clear()
+
+    # 届いたメッセージを購読しているハンドラーに順に渡す
+    async def _deliver(self, channel: str, message: dict):
+        for handler in list(self.handlers.get(channel, ())):
+            try:
+                result = handler(message)
+                if inspect.isawaitable(result):
+                    await result
+                self.delivered += 1
+            except Exception:
+                self.failed += 1
+
+    def metrics(self) -> dict:
+        return {
+            "channels": len(self.handlers),
+            "published": self.published,
+            "delivered": self.delivered,
+            "failed": self.failed,
+        }
+
+
+class MemoryBus(EventBus):
+    async def publish(self, channel: str, message: dict):
+        self.published += 1
+        # 別プロセスに送るときと同じく、JSONにできないメッセージはここで弾く
+        await self._deliver(channel, json.loads(json.dumps(message)))
+
+
+class RedisBus(EventBus):
+    """Redis互換のサーバーとRESPで直接話す (PUBLISHとSUBSCRIBEだけ使う)"""
+
+    def __init__(self, url: str, retry_seconds: float = 1.0):
+        super().__init__()
+        parsed = urlparse(url)
+        self.scheme = parsed.scheme
+        self.path = parsed.path
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.retry_seconds = retry_seconds
+
+        # PUBLISHは返事を順番に読むので1つずつ送る
+        self.lock = asyncio.Lock()
+        self.publisher = None
+        # SUBSCRIBE用の接続は受信専用のタスクが読む
+        self.subscriber = None
+        self.task = None
+
+    async def _open(self):
+        if self.scheme == "unix":
+            reader, writer = await asyncio.open_unix_connection(self.path)
+        else:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            writer.write(_command("AUTH", self.password))
+            await _read_reply(reader)
+        return reader, writer
+
+    async def publish(self, channel: str, message: dict):
+        data = json.dumps(message, ensure_ascii=False, separators=(",", ":"))
+        async with self.lock:
+            for retry in (False, True):
+                try:
+                    if self.publisher is None:
+                        self.publisher = await self._open()
+                    reader, writer = self.publisher
+                    writer.write(_command("PUBLISH", channel, data))
+                    await writer.drain()
+                    await _read_reply(reader)
+                    break
+                except (OSError, asyncio.IncompleteReadError):
+                    # 切れていたら1度だけつなぎ直す
+                    self._close_publisher()
+                    if retry:
+                        raise
+        self.published += 1
+
+    def subscribe(self, channel: str, handler: Handler):
+        first = channel not in self.handlers
+        super().subscribe(channel, handler)
+        if self.task is None or self.task.done():
+            # つないだときにそれまでのチャンネルをまとめて購読する
+            self.task = asyncio.get_running_loop().create_task(self._listen())
+        elif first and self.subscriber:
+            self.subscriber[1].write(_command("SUBSCRIBE", channel))
+
+    def unsubscribe(self, channel: str, handler: Handler):
+        super().unsubscribe(channel, handler)
+        if channel not in self.handlers and self.subscriber:
+            self.subscriber[1].write(_command("UNSUBSCRIBE", channel))
+
+    async def _listen(self):
+        while self.handlers:
+            try:
+                self.subscriber = await self._open()
+                reader, writer = self.subscriber
+                writer.write(_command("SUBSCRIBE", *self.handlers))
+                while True:
+                    reply = await _read_reply(reader)
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+                        await self._deliver(reply[1].decode(), json.loads(reply[2]))
+            except asyncio.CancelledError:
+                raise
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                # サーバーが落ちても、戻ってきたら購読し直す
+                self._close_subscriber()
+                await asyncio.sleep(self.retry_seconds)
+
+    def _close_publisher(self):
+        if self.publisher:
+            self.publisher[1].close()
+            self.publisher = None
+
+    def _close_subscriber(self):
+        if self.subscriber:
+            self.subscriber[1].close()
+            self.subscriber = None
+
+    async def close(self):
+        await super().close()
+        if self.task:
+            self.task.cancel()
+        self._close_subscriber()
+        self._close_publisher()
+
+
+def _command(*args) -> bytes:
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        data = arg.encode() if isinstance(arg, str) else arg
+        out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(out)
+
+
+async def _read_reply(reader: asyncio.StreamReader):
+    line = await reader.readuntil(b"\r\n")
+    kind, body = line[:1], line[1:-2]
+    if kind == b"+":
+        return body
+    if kind == b"-":
+        raise ValueError(body.decode())
+    if kind == b":":
+        return int(body)
+    if kind == b"$":
+        n = int(body)
+        if n < 0:
+            return None
+        data = await reader.readexactly(n + 2)
+        return data[:-2]
+    if kind == b"*":
+        n = int(body)
+        if n < 0:
+            return None
+        return [await _read_reply(reader) for i in range(n)]
+    raise ValueError("不明な応答です: " + repr(line))
+
+
+def create_bus(url: str) -> EventBus:
+    scheme = urlparse(url or "memory://").scheme
+    if scheme == "memory":
+        return MemoryBus()
+    if scheme in ("redis", "unix"):
+        return RedisBus(url)
+    raise ValueError("不明なイベントバスです: " + str(url))
@@ -1,54 +1,268 @@
 from fastapi import WebSocket
 from typing import Dict
+from env import Env
 from .game_manager import BinaryMahjongGame
+from .bus import EventBus, create_bus
+from .ownership import RoomOwnership
+from .scheduler import get_scheduler
+from .protocol import negotiate
+from .reaper import RoomReaper
+from .room_actor import RoomActor
+from .snapshot import SnapshotStore, create_store
+from .send_queue import SendQueue
+from .state_renderer import StateRenderer
+import asyncio
 
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, queue_size: int = None, queue_policy: str = None, mailbox_size: int = None,
+                 ownership: RoomOwnership = None, bus: EventBus = None, store: SnapshotStore = None):
         self.games: Dict[str, BinaryMahjongGame] = {}
-        self.active_connections: Dict[str, Dict[str, WebSocket]] = {}
+        # 接続ごとの送信キュー。送信は各キューのタスクが行うので、遅い接続がほかを待たせない
+        self.active_connections: Dict[str, Dict[str, SendQueue]] = {}
+        self.queue_size = queue_size or Env.SEND_QUEUE_SIZE
+        self.queue_policy = queue_policy or Env.SEND_QUEUE_POLICY
+        # 接続ごとに送信済みのゲーム状態の版。broadcastではここからの差分だけを送る
+        self.state_versions: Dict[str, Dict[str, int]] = {}
+        # ルームとプロトコルごとのゲーム状態のエンコード (共通部分を版ごとに1度だけエンコードする)
+        self.renderers: Dict[str, Dict[str, StateRenderer]] = {}
+        # ルームごとのアクター。ゲームへの操作はすべてこのメールボックスを通して順番に処理する
+        self.actors: Dict[str, RoomActor] = {}
+        self.mailbox_size = mailbox_size or Env.ROOM_MAILBOX_SIZE
+        # 複数ワーカーで動かすときの、ルームを担当するワーカーの決定
+        self.ownership = ownership or RoomOwnership(Env.WORKER_ID, Env.WORKER_URLS, Env.FORWARD_SECRET)
+        # ワーカー間のpub/sub。ルームの接続は担当ワーカーに集まるのでルームの送信には使わず、
+        # ロビーの変更を全ワーカーに届けるのに使う (lobby.LobbyHub)
+        self.bus = bus or create_bus(Env.EVENT_BUS_URL)
+        # 対局中のゲームのスナップショットの保存先 (Noneなら保存しない)
+        self.store = store or create_store(Env.SNAPSHOT_STORE)
+        # スナップショットを読み込み中のルーム。同時に接続してきても読み込みは1度だけにする
+        self.loading: Dict[str, asyncio.Task] = {}
+        # 使われなくなったルームを閉じ、ルーム数とメモリを上限に収める
+        self.reaper = RoomReaper(
+            self,
+            {"lobby": Env.ROOM_TTL_LOBBY, "playing": Env.ROOM_TTL_PLAYING, "finished": Env.ROOM_TTL_FINISHED},
+            Env.MAX_ROOMS, Env.ROOM_MEMORY_BUDGET_MB * 1024 * 1024, Env.REAPER_INTERVAL,
+        )
         
     async def connect(self, websocket: WebSocket, room_id: str, player_id: str):
-        await websocket.accept()
+        # クライアントがバイナリのサブプロトコルを要求していればそれで、なければJSONで送る
+        codec = negotiate(websocket)
+        await websocket.accept(subprotocol=codec.name)
         
         # ルームが存在しなければ、avtive_connectionsにルームを追加
         if room_id not in self.active_connections:
-            self.active_connections[room_id] = {}
-            # ゲームを初期化して追加
-            self.games[room_id] = BinaryMahjongGame(room_id)
+            await self._open_room(room_id)
             
-        # player_idをkeyにしてWebSocketを追加
-        self.active_connections[room_id][player_id] = websocket
+        # player_idをkeyにして送信キューを追加 (同じプレイヤーの古い接続があれば止める)
+        old = self.active_connections[room_id].get(player_id)
+        if old:
+            old.stop()
+        queue = SendQueue(websocket, self.queue_size, self.queue_policy, codec)
+        queue.start()
+        self.active_connections[room_id][player_id] = queue
+        self.state_versions[room_id].pop(player_id, None)
         
         await self.broadcast(
             {"action": "player_connected", "player_id": player_id},
             room_id
         )
         
-    def disconnect(self, room_id: str, player_id: str):
+    # スナップショットがあれば対局を続きから、なければ新しいゲームでルームを作る
+    async def _open_room(self, room_id: str):
+        task = self.loading.get(room_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load_game(room_id))
+            self.loading[room_id] = task
+        try:
+            game, timers = await task
+        finally:
+            self.loading.pop(room_id, None)
+        # 同時に読み込みを待っていた接続がすでにルームを作った
+        if room_id in self.active_connections:
+            return
+        self.reaper.start()
+
+        self.active_connections[room_id] = {}
+        self.state_versions[room_id] = {}
+        self.games[room_id] = game
+        self.renderers[room_id] = {}
+        self.actors[room_id] = RoomActor(room_id, game, self, self.mailbox_size, self.store)
+        self.actors[room_id].start()
+        # タイマーはアクターのメールボックスを通すので、アクターを付けてから登録し直す
+        game.resume_timers(timers)
+
+    async def _load_game(self, room_id: str):
+        if self.store:
+            try:
+                restored = await self.store.restore(room_id)
+            except Exception:
+                # 保存先が使えなくても新しいゲームで始める
+                self.store.failed += 1
+                restored = None
+            if restored:
+                return restored
+        return BinaryMahjongGame(room_id), []
+
+    # websocketを渡すと、その接続がまだ使われているときだけ削除する。削除したかを返す
+    def disconnect(self, room_id: str, player_id: str, websocket: WebSocket = None) -> bool:
+        removed = False
         # ルームとプレイヤーが存在すれば削除
         if room_id in self.active_connections and player_id in self.active_connections[room_id]:
-            del self.active_connections[room_id][player_id]
+            queue = self.active_connections[room_id][player_id]
+            if websocket is None or queue.websocket is websocket:
+                self.active_connections[room_id].pop(player_id).stop()
+                self.state_versions[room_id].pop(player_id, None)
+                removed = True
             
         # ルームに誰も接続していなければ削除
         if room_id in self.active_connections and not self.active_connections[room_id]:
-            if room_id in self.games:
-                del self.games[room_id]
-            del self.active_connections[room_id]
+            self._close_room(room_id)
+        return removed
+
+    # ルームを閉じる。残っている接続は切り、各接続の受信ループはWebSocketDisconnectで終わる
+    def evict(self, room_id: str):
+        for queue in self.active_connections.get(room_id, {}).values():
+            queue.close(code=1001)
+        self._close_room(room_id)
+
+    # ゲームとアクターを捨てる。アクターがタイマーを取り消し、対局中ならスナップショットを残す
+    def _close_room(self, room_id: str):
+        if room_id in self.games:
+            del self.games[room_id]
+            del self.renderers[room_id]
+            self.actors.pop(room_id).stop()
+        self.active_connections.pop(room_id, None)
+        self.state_versions.pop(room_id, None)
+
+    # 以下はルームのアクターのメールボックスにコマンドを積む。ルームがなければFalseを返す
+    async def join(self, room_id: str, player_id: str, name: str) -> bool:
+        actor = self.actors.get(room_id)
+        if not actor:
+            return False
+        await actor.submit("join", player_id, {"name": name})
+        return True
+
+    async def leave(self, room_id: str, player_id: str, websocket: WebSocket) -> bool:
+        actor = self.actors.get(room_id)
+        if not actor:
+            return False
+        await actor.submit("leave", player_id, {"websocket": websocket})
+        return True
+
+    async def submit(self, room_id: str, player_id: str, data: dict) -> bool:
+        actor = self.actors.get(room_id)
+        if not actor:
+            return False
+        await actor.receive(player_id, data)
+        return True
             
+    def _renderer(self, room_id: str, codec) -> StateRenderer:
+        renderers = self.renderers.get(room_id)
+        if renderers is None:
+            return None
+        renderer = renderers.get(codec.name)
+        if renderer is None:
+            renderer = StateRenderer(self.games[room_id], codec)
+            renderers[codec.name] = renderer
+        return renderer
+
+    # 各接続のキューに積むだけで、送信の完了は待たない
+    # メッセージ本体とゲーム状態の共通部分はプロトコルごとに1度だけエンコードし、接続ごとには手牌だけを継ぎ足す
     async def broadcast(self, message: dict, room_id: str):
         if room_id in self.active_connections:
-            for player_id, connection in self.active_connections[room_id].items():
-                game = self.games.get(room_id)
-                if game:
-                    player_message = {**message}
-                    if "game_state" not in player_message:
-                        player_message["game_state"] = game.get_game_state(player_id)
-                    await connection.send_json(player_message)
-                    
+            game = self.games.get(room_id)
+            if not game:
+                return
+            encoded = {}
+            # 手牌を持たない観戦者向けのフレームは、同じプロトコル・同じ版からなら同じものを使い回す
+            shared = {}
+            for player_id, queue in list(self.active_connections[room_id].items()):
+                codec = queue.codec
+                if codec.name not in encoded:
+                    encoded[codec.name] = codec.message(message)
+                body = encoded[codec.name]
+
+                if "game_state" in message:
+                    self._put(room_id, player_id, queue, codec.frame(body), message)
+                    continue
+
+                renderer = self._renderer(room_id, codec)
+                since = self.state_versions[room_id].get(player_id)
+                is_shared = renderer.is_shared(player_id)
+                frame = shared.get((codec.name, since)) if is_shared else None
+                if frame is None:
+                    # 前回送った版からの差分を付ける。送ったことがないか差分で表せなければ全体を送る
+                    delta = None
+                    if since is not None:
+                        delta = renderer.delta(player_id, since)
+                    if delta is not None:
+                        frame = codec.with_delta(body, delta)
+                    else:
+                        frame = codec.with_snapshot(body, renderer.snapshot(player_id))
+                    if is_shared:
+                        shared[(codec.name, since)] = frame
+                self.state_versions[room_id][player_id] = game.version
+                self._put(room_id, player_id, queue, frame, message)
+
+    # キューが一杯でフレームが捨てられたら差分が繋がらなくなるので、次は全体を送る
+    # イベントはキューの側で状態を外して残すので、ここではgame_stateとして全体だけを返す
+    def _put(self, room_id: str, player_id: str, queue: SendQueue, frame, message: dict):
+        def snapshot():
+            renderer = self._renderer(room_id, queue.codec)
+            body = queue.codec.message({"action": "game_state"})
+            self.state_versions[room_id][player_id] = renderer.game.version
+            return queue.codec.with_snapshot(body, renderer.snapshot(player_id))
+
+        event = None if message.get("action") == "game_state" else message
+        # ルームが閉じた後は全体を作れないので、一杯なら新しいフレームを捨てる
+        if not queue.put(frame, snapshot if room_id in self.renderers else None, event):
+            self.state_versions[room_id].pop(player_id, None)
+
     async def send_personal(self, message: dict, room_id: str, player_id: str):
         if (room_id in self.active_connections and 
             player_id in self.active_connections[room_id]):
-            await self.active_connections[room_id][player_id].send_json(message)
+            queue = self.active_connections[room_id][player_id]
+            self._put(room_id, player_id, queue, queue.codec.frame(queue.codec.message(message)), message)
+
+    # ゲーム状態の全体を送り、その接続の版を記録する (差分を取りこぼしたときの取り直しにも使う)
+    async def send_game_state(self, room_id: str, player_id: str):
+        if (room_id in self.active_connections and
+                player_id in self.active_connections[room_id]):
+            queue = self.active_connections[room_id][player_id]
+            renderer = self._renderer(room_id, queue.codec)
+            if not renderer:
+                return
+            message = {"action": "game_state"}
+            self.state_versions[room_id][player_id] = renderer.game.version
+            frame = queue.codec.with_snapshot(queue.codec.message(message), renderer.snapshot(player_id))
+            self._put(room_id, player_id, queue, frame, message)
+
+    # 送信キューの計測値 (キューの長さ、送信までの待ち時間など) をルームごとに返す
+    def metrics(self) -> dict:
+        return {
+            room_id: {player_id: queue.metrics() for player_id, queue in connections.items()}
+            for room_id, connections in self.active_connections.items()
+        }
+
+    # ルームのアクターの計測値 (メールボックスの長さ、1秒あたりの処理数、待ち時間)
+    def actor_metrics(self) -> dict:
+        return {room_id: actor.metrics() for room_id, actor in self.actors.items()}
+
+    # ルームごとと全体のメモリの見積もり、段階、閉じたルームの件数
+    def memory_metrics(self) -> dict:
+        return self.reaper.metrics()
+
+    # スナップショットの保存と復元の計測値 (回数、大きさ、かかった時間)
+    def snapshot_metrics(self) -> dict:
+        return self.store.metrics() if self.store else {}
+
+    # ワーカーの転送とイベントバスの計測値
+    def cluster_metrics(self) -> dict:
+        return {"ownership": self.ownership.metrics(), "bus": self.bus.metrics()}
+
+    # ロン・ダウトの受付時間のタイマーの計測値 (件数と発火の遅れ)
+    def timer_metrics(self) -> dict:
+        return get_scheduler().metrics()
 
     def get_game(self, room_id: str) -> BinaryMahjongGame:
         return self.games.get(room_id)
\ No newline at end of file
@@ -1,13 +1,30 @@
 from .. import taku, janshi
+from ..hai import Hai
+from .replay import ReplayWriter
+from .scheduler import TimerWheel, get_scheduler
+from collections import deque
 import random
+import time
 from typing import Any, Tuple
-from asyncio import sleep
-import asyncio
+
+# 差分を返せるように残しておく変更の件数。これより古い版からは全体を送り直す
+CHANGE_LOG_SIZE = 256
+
 
 # ゲーム状態を管理するクラス
 class BinaryMahjongGame:
-    def __init__(self, room_id: str):
+    # seedを渡すと同じ山を再現できる。省略時はランダムに決めてself.seedに残す
+    # ロンとダウトの受付時間(秒)はルームごとに変えられる。タイマーは省略時はイベントループ共通のものを使う
+    def __init__(self, room_id: str, seed: int = None, ron_time_seconds: float = 10,
+                 doubt_time_seconds: float = 30, scheduler: TimerWheel = None):
         self.room_id = room_id
+        self.ron_time_seconds = ron_time_seconds
+        self.doubt_time_seconds = doubt_time_seconds
+        self.scheduler = scheduler
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(64)
+        self.seed = seed
+        self.rng = random.Random(seed)
         self.taku = taku.Taku(aka=True)
         self.players = {}  
         self.player_seats = {}  
@@ -23,6 +40,17 @@ class BinaryMahjongGame:
         
         self.ron_timer = None
         self.doubt_timer = None
+        # ダウト時間切れを知らせるコールバック (async)。RoomActorが設定する
+        self.on_doubt_timeout = None
+        # タイマーの発火をルームのメールボックスに積む関数。RoomActorが設定し、なければその場で処理する
+        self.post = None
+
+        # ツモ・打牌・ロン・ダウトの記録 (start_gameで作る)
+        self.replay = None
+
+        # ゲーム状態の版。状態が変わるたびに1つ進め、変更内容をchangesに残す
+        self.version = 0
+        self.changes = deque(maxlen=CHANGE_LOG_SIZE)
 
     # プレイヤーを追加
     def add_player(self, player_id: str, name: str) -> bool:
@@ -39,6 +67,7 @@ class BinaryMahjongGame:
         seat_position = len(self.players)
         self.player_seats[player_id] = seat_position
         self.players[player_id] = player
+        self._changed(snapshot=True)
 
         return True
 
@@ -47,7 +76,8 @@ class BinaryMahjongGame:
         if len(self.players) < 2 or self.game_started:
             return False
 
-        random.shuffle(self.taku.yama)
+        self.taku.yama.shuffle(self.rng)
+        self.replay = ReplayWriter(self.seed, self.taku.aka, list(self.player_seats))
 
         # 配牌
         for player_id, player in self.players.items():
@@ -56,6 +86,7 @@ class BinaryMahjongGame:
 
         self.current_turn_idx = 0
         self.game_started = True
+        self._changed(snapshot=True)
 
         return True
 
@@ -65,6 +96,189 @@ class BinaryMahjongGame:
                 return player_id
         return None
 
+    # 状態の変更を1件残す。
+    # fieldsはget_game_stateの最上位の項目、discardは(捨てたプレイヤー, 牌)、hand_playerは手牌が変わったプレイヤー。
+    # snapshot=Trueなら差分では表せない変更 (参加や配牌) で、受け取る側は全体を取り直す
+    def _changed(self, discard=None, hand_player=None, snapshot=False, **fields):
+        self.version += 1
+        if snapshot:
+            self.changes.append((self.version, None, None, None))
+        else:
+            self.changes.append((self.version, fields, discard, hand_player))
+
+    # 以下の_で始まるメソッドは状態の変更と記録だけを行う (タイマーは持たない)。
+    # リプレイの再実行からもそのまま呼ばれる
+
+    # 打牌して記録する
+    def _dahai(self, player_id: str, hai_idx: int):
+        player = self.players[player_id]
+        discarded_hai = player.dahai(hai_idx)
+
+        # 最後に捨てた牌と捨てたプレイヤーを記録
+        self.last_discarded_hai = discarded_hai
+        self.last_action_player = player_id
+
+        # ロン宣言が可能なフラグを立てる
+        self.ron_available = True
+
+        self.replay.dahai(self.player_seats[player_id], hai_idx, discarded_hai)
+        self._changed(discard=(player_id, discarded_hai), hand_player=player_id,
+                      last_discarded_hai=discarded_hai, last_action_player=player_id)
+        return discarded_hai
+
+    # ロンの猶予が過ぎたので次の手番に進む。ツモった牌を返し、山がなければ流局してNoneを返す
+    def _next_turn(self):
+        # ロン宣言できなくする
+        self.ron_available = False
+
+        # 次の手番へ
+        self.current_turn_idx = (self.current_turn_idx + 1) % len(self.players)
+
+        # 次のプレイヤーにツモさせる
+        next_player_id = self.get_current_player_id()
+        if next_player_id:
+            next_player = self.players[next_player_id]
+            # 王牌(14枚)はツモらない
+            if self.taku.yama.nokori > 0:
+                hai = next_player.tsumo(self.taku.yama)
+                next_player.riipai()
+                self.replay.tsumo(self.current_turn_idx, hai)
+                self._changed(hand_player=next_player_id, current_turn=self.current_turn_idx,
+                              current_player_id=next_player_id, hai_left=self.taku.yama.nokori)
+                return hai
+            else:
+                # 山がなくなったら流局
+                self.game_finished = True
+                self.replay.ryuukyoku()
+        self._changed(current_turn=self.current_turn_idx, current_player_id=next_player_id,
+                      game_finished=self.game_finished)
+        return None
+
+    # ロン宣言を受け付けて記録する。ロンが実際に成立するかを返す
+    def _ron(self, player_id: str) -> bool:
+        player = self.players[player_id]
+
+        # バイナリ麻雀では、ロン宣言は自由だがダウト可能
+        self.doubt_available = True
+        self.ron_available = False  # ロン宣言されたらもうロンできない
+
+        # ロン宣言をしたプレイヤーを記録
+        self.ron_player = player_id
+
+        # 内部的にロン可能か確認（クライアントには知らせない）
+        is_ron_valid = player.can_ron(self.last_discarded_hai)
+
+        self.replay.ron(self.player_seats[player_id], self.last_discarded_hai, is_ron_valid)
+        self._changed(doubt_available=True, ron_player=player_id)
+        return is_ron_valid
+
+    # ダウトを判定して記録する
+    def _doubt(self, doubter_id: str, target_id: str) -> dict:
+        # ダウト不可にする
+        self.doubt_available = False
+
+        target_player = self.players[target_id]
+
+        # ロンが実際に可能かどうか確認
+        is_ron_valid = target_player.can_ron(self.last_discarded_hai)
+
+        self.game_finished = True
+        self.replay.doubt(self.player_seats[doubter_id], self.player_seats[target_id])
+
+        if is_ron_valid:
+            # ロン成立ならダウト失敗、ロン宣言者の勝ち
+            self.winner = target_id
+            self._changed(doubt_available=False, game_finished=True, winner=target_id)
+            return {
+                "winner": target_id,
+                "reason": "ロン成立、ダウト失敗"
+            }
+        else:
+            # ロン不成立ならダウト成功、ダウト宣言者の勝ち
+            self.winner = doubter_id
+            self._changed(doubt_available=False, game_finished=True, winner=doubter_id)
+            return {
+                "winner": doubter_id,
+                "reason": "ロン不成立、ダウト成功"
+            }
+
+    # ダウトされないまま時間切れになったので、ロン宣言者の勝ちにして記録する
+    def _doubt_timeout(self, player_id: str, is_ron_valid: bool) -> dict:
+        # ダウト時間が過ぎた場合の処理
+        self.doubt_available = False
+        self.game_finished = True
+        self.winner = player_id
+        self.replay.timeout(self.player_seats[player_id])
+        self._changed(doubt_available=False, game_finished=True, winner=player_id)
+
+        # ロン宣言が実際に有効だったかでゲーム結果を判定
+        if is_ron_valid:
+            return {
+                "winner": player_id,
+                "reason": "ロン成立、ダウト時間切れ"
+            }
+        else:
+            # バイナリ麻雀の場合、ロンが不成立でも時間切れなら不正ロンを見逃したことになるので
+            # ロン宣言者の勝ち（通常の麻雀ルールとは違う特殊ルール）
+            return {
+                "winner": player_id,
+                "reason": "ロン不成立だが、ダウト時間切れによりロン宣言者の勝ち"
+            }
+
+    def _get_scheduler(self) -> TimerWheel:
+        if self.scheduler is None:
+            self.scheduler = get_scheduler()
+        return self.scheduler
+
+    def _cancel_timer(self, name: str):
+        timer = getattr(self, name)
+        if timer:
+            timer.cancel()
+            setattr(self, name, None)
+
+    # すでに登録したタイマーがあれば取り消して登録し直す。nameはron_timerかdoubt_timer
+    def _start_timer(self, name: str, delay: float, callback, *args):
+        self._cancel_timer(name)
+        setattr(self, name, self._get_scheduler().schedule(delay, self._timer_fired, name, callback, args))
+
+    def _timer_fired(self, name: str, callback, args):
+        timer = getattr(self, name)
+        if self.post:
+            return self.post(self._apply_timer, name, timer, callback, args)
+        return self._apply_timer(name, timer, callback, args)
+
+    # メールボックスに積まれている間に取り消されたり登録し直されたりしたタイマーは無視する
+    def _apply_timer(self, name: str, timer, callback, args):
+        if timer is None or getattr(self, name) is not timer:
+            return None
+        setattr(self, name, None)
+        return callback(*args)
+
+    # スナップショットから戻したタイマーを残り時間で登録し直す。期限を過ぎていればすぐに発火する
+    # timersは [名前, 壁時計の期限, 引数] の並び (snapshot.load)。RoomActorを付けたあとに呼ぶ
+    def resume_timers(self, timers: list):
+        callbacks = {'ron_timer': self._on_ron_timeout, 'doubt_timer': self._on_doubt_timer}
+        for name, deadline, args in timers:
+            self._start_timer(name, max(0.0, deadline - time.time()), callbacks[name], *args)
+
+    # ロンの猶予時間が過ぎたときにタイマーから呼ばれる
+    def _on_ron_timeout(self):
+        # 猶予時間後、誰もロンしていなければ次の手番に進む
+        # このチェックが重要 - 他の処理で状態が変わっている可能性があるため
+        if self.ron_available and not self.game_finished:
+            self._next_turn()
+
+    # ダウト時間が過ぎたときにタイマーから呼ばれる。通知のコルーチンはRoomActor (なければタイマー) が待つ
+    def _on_doubt_timer(self, player_id: str, is_ron_valid: bool):
+        # まだダウトされてない場合かつ、まだ勝者が決まっていない場合
+        if self.doubt_available and not self.game_finished:
+            timeout_result = self._doubt_timeout(player_id, is_ron_valid)
+
+            # イベントを発火して、タイムアウト結果をブロードキャストする
+            if self.on_doubt_timeout:
+                return self.on_doubt_timeout(timeout_result)
+        return None
+
     # 牌を捨てる
     async def discard_hai(self, player_id: str, hai_idx: int) -> Tuple[bool, dict]:
         # ゲームが開始されていないか、終了している場合はfalseを返す
@@ -83,51 +297,11 @@ class BinaryMahjongGame:
             return False, "無効な牌のインデックスです"
 
         # 牌を捨てる
-        discarded_hai = player.dahai(hai_idx)
-
-        # 最後に捨てた牌と捨てたプレイヤーを記録
-        self.last_discarded_hai = discarded_hai
-        self.last_action_player = player_id
-
-        ron_time_seconds = 10
+        self._dahai(player_id, hai_idx)
 
-        # ロン宣言が可能なフラグを立てる
-        self.ron_available = True
+        ron_time_seconds = self.ron_time_seconds
 
-        # すでに実行中のタイマーがあればキャンセル
-        if hasattr(self, 'ron_timer') and self.ron_timer:
-            self.ron_timer.cancel()
-
-        # 非同期で実行するタイマー関数を定義
-        async def ron_timer_callback():
-            try:
-                await asyncio.sleep(ron_time_seconds)
-
-                # 猶予時間後、誰もロンしていなければ次の手番に進む
-                # このチェックが重要 - 他の処理で状態が変わっている可能性があるため
-                if self.ron_available and not self.game_finished:
-                    # ロン宣言できなくする
-                    self.ron_available = False
-
-                    # 次の手番へ
-                    self.current_turn_idx = (self.current_turn_idx + 1) % len(self.players)
-
-                    # 次のプレイヤーにツモさせる
-                    next_player_id = self.get_current_player_id()
-                    if next_player_id:
-                        next_player = self.players[next_player_id]
-                        if len(self.taku.yama) > 0:
-                            next_player.tsumo(self.taku.yama)
-                            next_player.riipai()
-                        else:
-                            # 山がなくなったら流局
-                            self.game_finished = True
-            except asyncio.CancelledError:
-                # タイマーがキャンセルされた場合（ロンが宣言された場合など）
-                pass
-
-        # タイマーをバックグラウンドタスクとして開始
-        self.ron_timer = asyncio.create_task(ron_timer_callback())
+        self._start_timer('ron_timer', ron_time_seconds, self._on_ron_timeout)
 
         # 即座に結果を返す（待たない）
         result = {
@@ -140,38 +314,27 @@ class BinaryMahjongGame:
 
     # ロンの宣言
     async def claim_ron(self, player_id: str) -> Tuple[bool, Any]:
+        # ゲームに参加していないプレイヤー (開始後にルームに入った人など) はfalseを返す
+        # タイマーや状態を変える前に弾かないと、ron_timerだけが消えてゲームが止まる
+        if player_id not in self.players:
+            return False, "ゲームに参加していません"
+
         # ゲームが開始されていないか、終了している場合はfalseを返す
         if not self.game_started or self.game_finished:
             return False, "ゲームは開始されていないか終了しています"
 
         # ロン宣言が可能な状態でないとfalseを返す
-        if not hasattr(self, 'ron_available') or not self.ron_available:
+        if not self.ron_available:
             return False, "現在ロン宣言はできません"
 
-        # ロン宣言をしたプレイヤーを格納
-        player = self.players[player_id]
-
-        # バイナリ麻雀では、ロン宣言は自由だがダウト可能
-        self.doubt_available = True
-        self.ron_available = False  # ロン宣言されたらもうロンできない
-
-        # すでに実行中のron_timerがあればキャンセル
-        if hasattr(self, 'ron_timer') and self.ron_timer:
-            self.ron_timer.cancel()
-            self.ron_timer = None
+        # 登録済みのron_timerがあれば取り消す
+        self._cancel_timer('ron_timer')
 
-        # ロン宣言をしたプレイヤーを記録
-        self.ron_player = player_id
-
-        # 内部的にロン可能か確認（クライアントには知らせない）
-        is_ron_valid = player.can_ron(self.last_discarded_hai)
+        # ロン宣言をしたプレイヤーを記録し、内部的にロン可能か確認（クライアントには知らせない）
+        is_ron_valid = self._ron(player_id)
 
         # ダウト時間（秒）
-        doubt_time_seconds = 30
-
-        # すでに実行中のタイマーがあればキャンセル
-        if hasattr(self, 'doubt_timer') and self.doubt_timer:
-            self.doubt_timer.cancel()
+        doubt_time_seconds = self.doubt_time_seconds
 
         # 結果を保持する変数
         result = {
@@ -180,48 +343,17 @@ class BinaryMahjongGame:
             "doubt_timeout": doubt_time_seconds
         }
 
-        # 非同期で実行するタイマー関数を定義
-        async def doubt_timer_callback():
-            try:
-                await asyncio.sleep(doubt_time_seconds)
-
-                # まだダウトされてない場合かつ、まだ勝者が決まっていない場合
-                if self.doubt_available and not self.game_finished:
-                    # ダウト時間が過ぎた場合の処理
-                    self.doubt_available = False
-                    self.game_finished = True
-
-                    # ロン宣言が実際に有効だったかでゲーム結果を判定
-                    if is_ron_valid:
-                        self.winner = player_id
-                        timeout_result = {
-                            "winner": player_id,
-                            "reason": "ロン成立、ダウト時間切れ"
-                        }
-                    else:
-                        # バイナリ麻雀の場合、ロンが不成立でも時間切れなら不正ロンを見逃したことになるので
-                        # ロン宣言者の勝ち（通常の麻雀ルールとは違う特殊ルール）
-                        self.winner = player_id
-                        timeout_result = {
-                            "winner": player_id,
-                            "reason": "ロン不成立だが、ダウト時間切れによりロン宣言者の勝ち"
-                        }
-
-                    # イベントを発火して、タイムアウト結果をブロードキャストする
-                    if hasattr(self, 'on_doubt_timeout'):
-                        await self.on_doubt_timeout(timeout_result)
-            except asyncio.CancelledError:
-                # タイマーがキャンセルされた場合（ダウトが宣言された場合など）
-                pass
-
-        # タイマーをバックグラウンドタスクとして開始
-        self.doubt_timer = asyncio.create_task(doubt_timer_callback())
+        self._start_timer('doubt_timer', doubt_time_seconds, self._on_doubt_timer, player_id, is_ron_valid)
 
         # 即座に結果を返す（待たない）
         return True, result
 
     # ロン宣言に対してダウトを宣言
     async def claim_doubt(self, doubter_id: str, target_id: str) -> Tuple[bool, Any]:
+        # ゲームに参加していないプレイヤーはfalseを返す (タイマーの取り消しや終了の前に弾く)
+        if doubter_id not in self.players:
+            return False, "ゲームに参加していません"
+
         # doubt_availableがFalseの場合はfalseを返す
         if not self.doubt_available:
             return False, "ダウトできません"
@@ -234,46 +366,31 @@ class BinaryMahjongGame:
         if target_id != self.ron_player:
             return False, "ロン宣言をしていないプレイヤーにダウトできません"
 
-        # すでに実行中のタイマーがあればキャンセル
-        if self.doubt_timer:
-            self.doubt_timer.cancel()
-            self.doubt_timer = None
-
-        # ダウト不可にする
-        self.doubt_available = False
-
-        target_player = self.players[target_id]
-
-        # ロンが実際に可能かどうか確認
-        is_ron_valid = target_player.can_ron(self.last_discarded_hai)
+        # 登録済みのタイマーがあれば取り消す
+        self._cancel_timer('doubt_timer')
 
-        self.game_finished = True
-
-        if is_ron_valid:
-            # ロン成立ならダウト失敗、ロン宣言者の勝ち
-            self.winner = target_id
-            return True, {
-                "winner": target_id,
-                "reason": "ロン成立、ダウト失敗"
-            }
-        else:
-            # ロン不成立ならダウト成功、ダウト宣言者の勝ち
-            self.winner = doubter_id
-            return True, {
-                "winner": doubter_id,
-                "reason": "ロン不成立、ダウト成功"
-            }
+        return True, self._doubt(doubter_id, target_id)
     
     def get_game_state(self, viewer_id: str = None) -> dict:
         """ゲーム状態を取得"""
+        state = self.get_public_state()
+        state.update(self.get_private_state(viewer_id))
+        return state
+
+    # 以下のtile_idがTrueなら、牌を名前ではなく0~135の牌IDで返す (バイナリのプロトコル用)
+    def get_public_state(self, tile_id: bool = False) -> dict:
+        """全員に共通するゲーム状態を取得 (手牌は含まない)"""
+        tile = _tile_id if tile_id else _tile_str
+        dora_hyouji = self.taku.dora_hyouji
         state = {
+            "version": self.version,
             "room_id": self.room_id,
             "game_started": self.game_started,
             "game_finished": self.game_finished,
             "current_turn": self.current_turn_idx,
             "current_player_id": self.get_current_player_id(),
-            "hai_left": len(self.taku.yama),  
-            "dora_indicator": self.taku.dora_hyouji[0].str if self.taku.dora_hyouji else None,
+            "hai_left": self.taku.yama.nokori,
+            "dora_indicator": tile(dora_hyouji[0]) if dora_hyouji else None,
             "players": {},
             "doubt_available": self.doubt_available,
             "ron_player": self.ron_player
@@ -283,26 +400,92 @@ class BinaryMahjongGame:
         if self.winner:
             state["winner"] = self.winner
            
-        # プレイヤー本人を取得
         for player_id, player in self.players.items():
-            is_viewer = (player_id == viewer_id)
-            
             # そのプレイヤーの名前、座席、これまでに捨てた牌を取得
-            player_state = {
+            state["players"][player_id] = {
                 "name": player.name,
                 "seat": self.player_seats[player_id],
-                "discarded": [hai.str for hai in player.kawa] 
+                "discarded": [tile(hai) for hai in player.kawa] 
             }
             
-            # 自分の手牌は表示するが、他者の手牌は非表示
-            if is_viewer:
-                player_state["hand"] = [hai.str for hai in player.tehai] 
-                
-            state["players"][player_id] = player_state
-            
         # 最後に捨てられた牌の情報
         if self.last_discarded_hai:
-            state["last_discarded_hai"] = self.last_discarded_hai.str
+            state["last_discarded_hai"] = tile(self.last_discarded_hai)
             state["last_action_player"] = self.last_action_player
             
-        return state
\ No newline at end of file
+        return state
+
+    def get_private_state(self, viewer_id: str = None, tile_id: bool = False) -> dict:
+        """viewer本人にだけ見せる状態を取得。観戦者(プレイヤーでない)なら空"""
+        player = self.players.get(viewer_id)
+        if player is None:
+            return {}
+        # 自分の手牌は表示するが、他者の手牌は非表示
+        return {
+            "viewer_id": viewer_id,
+            "hand": self.get_hand(viewer_id, tile_id)
+        }
+
+    def get_hand(self, player_id: str, tile_id: bool = False) -> list:
+        tile = _tile_id if tile_id else _tile_str
+        return [tile(hai) for hai in self.players[player_id].tehai]
+
+    def get_public_delta(self, since: int, tile_id: bool = False) -> Tuple[dict, set]:
+        """版sinceから現在までの全員に共通する差分と、手牌が変わったプレイヤーの集合を取得
+
+        差分で表せないときはNoneを返すので、get_game_stateで全体を送る
+        """
+        if since == self.version:
+            return {"from": since, "to": self.version, "state": {}}, set()
+
+        # 新しい方から遡り、sinceより後の変更だけを集める
+        changes = []
+        for change in reversed(self.changes):
+            if change[0] <= since:
+                break
+            changes.append(change)
+        # 変更履歴から溢れている、またはsinceが未来の版
+        if not changes or changes[-1][0] != since + 1:
+            return None
+
+        tile = _tile_id if tile_id else _tile_str
+        fields = {}
+        discarded = {}
+        hand_players = set()
+        for version, changed, discard, hand_player in reversed(changes):
+            if changed is None:
+                return None
+            fields.update(changed)
+            if discard:
+                discarded.setdefault(discard[0], []).append(tile(discard[1]))
+            if hand_player is not None:
+                hand_players.add(hand_player)
+
+        # 変更履歴には牌をHaiのまま残しているので、ここで名前かIDにする
+        for key, value in fields.items():
+            if isinstance(value, Hai):
+                fields[key] = tile(value)
+        delta = {"from": since, "to": self.version, "state": fields}
+        # 捨て牌はプレイヤーごとに追加された分だけ
+        if discarded:
+            delta["discarded"] = discarded
+        return delta, hand_players
+
+    def get_state_delta(self, viewer_id: str, since: int) -> dict:
+        """版sinceから現在までの差分を取得。差分で表せないときはNoneを返す"""
+        public = self.get_public_delta(since)
+        if public is None:
+            return None
+        delta, hand_players = public
+        # 手牌は本人にだけ、変わったときに送る
+        if viewer_id in hand_players:
+            delta["hand"] = self.get_hand(viewer_id)
+        return delta
+
+
+def _tile_str(hai: Hai) -> str:
+    return hai.str
+
+
+def _tile_id(hai: Hai) -> int:
+    return hai.idx136
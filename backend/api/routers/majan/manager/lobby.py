@@ -0,0 +1,161 @@
+from fastapi import WebSocket
+from typing import Dict, Optional
+from .bus import EventBus
+from .protocol import JSON
+from .send_queue import SendQueue
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# ロビーの変更をクライアントに送る
+#
+# ルームの作成・参加・退出・削除 (cruds/room.py) はイベントバスの "lobby" チャンネルに流れ、
+# どのワーカーも受け取ったイベントを自分のロビーのキャッシュに反映し、/lobby/ws の接続に送る。
+# イベントは interval 秒ごとにまとめて1つのフレームにするので、ルームが次々に変わっても
+# 接続ごとの送信は1秒あたり1/interval回までになる。フレームは1度だけエンコードして全接続で共有する。
+#
+#   フレーム: {"type": "lobby", "events": [イベント, ...]}
+#   イベント: {"type": "room_created", "room": {"id", "max_players", "game_type", "players"}}
+#             {"type": "room_updated", "room_id", "game_type"}
+#             {"type": "player_joined" / "player_left", "room_id", "user_id", "players" (分からなければnull)}
+#             {"type": "room_deleted", "room_id"}
+#   {"type": "lobby_reset"} はイベントを取りこぼしたので、一覧を取り直してほしいという合図
+
+CHANNEL = "lobby"
+
+RESET = JSON.encode({"type": "lobby_reset"})
+
+
+class LobbyHub:
+    def __init__(self, bus: EventBus, cache=None, interval: float = 0.5, max_batch: int = 256,
+                 queue_size: int = 16):
+        self.bus = bus
+        # ほかのワーカーでの変更を反映するロビーのキャッシュ (cruds.lobby.LobbyCache)
+        self.cache = cache
+        self.interval = interval
+        # 1回にまとめるイベントの上限。超えたら個々のイベントの代わりにlobby_resetを送る
+        self.max_batch = max_batch
+        self.queue_size = queue_size
+        self.subscribers: Dict[WebSocket, SendQueue] = {}
+        # 送信待ちのイベント
+        self.pending = []
+        self.overflowed = False
+        self.ready = asyncio.Event()
+        self.task = None
+        self.subscribed = False
+
+        # 計測値
+        self.events = 0
+        self.frames = 0
+        self.resets = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self):
+        if not self.subscribed:
+            self.bus.subscribe(CHANNEL, self._received)
+            self.subscribed = True
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self.subscribed:
+            self.bus.unsubscribe(CHANNEL, self._received)
+            self.subscribed = False
+        if self.task:
+            self.task.cancel()
+        for queue in self.subscribers.values():
+            queue.stop()
+        self.subscribers.clear()
+
+    async def connect(self, websocket: WebSocket):
+        await websocket.accept()
+        self.start()
+        queue = SendQueue(websocket, self.queue_size, "coalesce", JSON)
+        queue.start()
+        self.subscribers[websocket] = queue
+
+    def disconnect(self, websocket: WebSocket):
+        queue = self.subscribers.pop(websocket, None)
+        if queue:
+            queue.stop()
+
+    async def publish(self, event: dict):
+        """このワーカーでの変更をすべてのワーカーに流す (キャッシュはcruds側で反映済み)"""
+        self.start()
+        await self.bus.publish(CHANNEL, {"origin": os.getpid(), "event": event})
+
+    async def _received(self, message: dict):
+        event = message["event"]
+        # ほかのワーカーでの変更は、このワーカーのキャッシュにまだ入っていない
+        if self.cache is not None and message.get("origin") != os.getpid():
+            self.cache.apply(event)
+        if self.subscribers:
+            self._add(event)
+
+    def _add(self, event: dict):
+        self.events += 1
+        if self.overflowed:
+            return
+        if event["type"] == "room_deleted":
+            # 同じまとまりの中のそのルームのイベントは送らなくてよい。作成もまだ送っていなければ削除も送らない
+            room_id = event["room_id"]
+            created = any(e["type"] == "room_created" and e["room"]["id"] == room_id for e in self.pending)
+            self.pending = [e for e in self.pending if _room_id(e) != room_id]
+            if created:
+                return
+        self.pending.append(event)
+        if len(self.pending) > self.max_batch:
+            self.pending = []
+            self.overflowed = True
+        self.ready.set()
+
+    async def _run(self):
+        while True:
+            await self.ready.wait()
+            # 最初のイベントからinterval秒の間に来たイベントをまとめる
+            await asyncio.sleep(self.interval)
+            self.ready.clear()
+            try:
+                self.flush()
+            except Exception:
+                # 1回失敗しても送信は止めない
+                self.failed += 1
+                logger.exception("ロビーの変更の送信に失敗しました")
+
+    def flush(self):
+        if self.overflowed:
+            frame = RESET
+            self.resets += 1
+        elif self.pending:
+            frame = JSON.encode({"type": "lobby", "events": self.pending})
+        else:
+            return
+        self.pending = []
+        self.overflowed = False
+        self.frames += 1
+
+        # キューが一杯の接続には、溜まっているフレームの代わりにlobby_resetを送る
+        for queue in list(self.subscribers.values()):
+            if not queue.put(frame, lambda: RESET):
+                self.dropped += 1
+
+    def metrics(self) -> dict:
+        return {
+            "subscribers": len(self.subscribers),
+            "pending": len(self.pending),
+            "events": self.events,
+            "frames": self.frames,
+            "resets": self.resets,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "interval": self.interval,
+        }
+
+
+def _room_id(event: dict) -> Optional[int]:
+    if event["type"] == "room_created":
+        return event["room"]["id"]
+    return event.get("room_id")
@@ -0,0 +1,130 @@
+from fastapi import WebSocket
+from typing import List
+import asyncio
+import hashlib
+import hmac
+import websockets
+
+# ルームを担当するワーカーの決定と、担当でないワーカーに来た接続の転送
+#
+# ワーカーは WORKER_URLS の並び順の番号で呼ぶ。各ルームはroom_idとワーカー番号のハッシュが
+# 最大になるワーカー (rendezvous hashing) が担当するので、どのワーカーで計算しても同じになり、
+# ワーカーを増減しても担当が変わるのはそのワーカーの分のルームだけになる。
+# 担当でないワーカーに来たWebSocketは、担当ワーカーの内部向けのURLにつないで中継する。
+
+# 転送した接続に付けるヘッダー。設定のずれで転送がループしないよう、付いていたら自分で処理する
+# 値は "転送元のワーカー番号:署名"。署名はワーカー間で共有する秘密鍵での (ワーカー番号:room_id) のHMACで、
+# クライアントが自分で付けても署名が合わないので、担当の確認を飛ばせない
+FORWARDED_HEADER = "x-bmj-forwarded"
+
+
+class RoomOwnership:
+    def __init__(self, worker_id: int = 0, worker_urls: List[str] = None, secret: str = None):
+        self.worker_id = worker_id
+        # 各ワーカーの内部向けのURL (ws://127.0.0.1:8001 など)。空ならワーカーは1つ
+        self.worker_urls = worker_urls or []
+        # 転送ヘッダーの署名に使う秘密鍵。なければ転送ヘッダーを受け付けない
+        self.secret = secret.encode() if secret else None
+
+        # 計測値
+        self.forwarded = 0
+        self.forward_failed = 0
+        self.rejected = 0
+
+    def owner(self, room_id: str) -> int:
+        if len(self.worker_urls) <= 1:
+            return self.worker_id
+
+        def score(worker: int) -> bytes:
+            return hashlib.blake2b(f"{worker}:{room_id}".encode(), digest_size=8).digest()
+
+        return max(range(len(self.worker_urls)), key=score)
+
+    def is_local(self, room_id: str) -> bool:
+        return self.owner(room_id) == self.worker_id
+
+    def sign(self, worker_id: int, room_id: str) -> str:
+        return hmac.new(self.secret, f"{worker_id}:{room_id}".encode(), hashlib.sha256).hexdigest()
+
+    def is_forwarded(self, websocket: WebSocket, room_id: str) -> bool:
+        """ほかのワーカーが署名して転送してきた接続か"""
+        value = websocket.headers.get(FORWARDED_HEADER)
+        if value is None:
+            return False
+        worker_id, _, signature = value.partition(":")
+        if self.secret is None or not hmac.compare_digest(signature, self.sign(worker_id, room_id)):
+            # クライアントが付けた偽のヘッダーは無視する
+            self.rejected += 1
+            return False
+        return True
+
+    def should_forward(self, websocket: WebSocket, room_id: str) -> bool:
+        if self.is_forwarded(websocket, room_id):
+            return False
+        return not self.is_local(room_id)
+
+    def url(self, room_id: str, path: str) -> str:
+        return self.worker_urls[self.owner(room_id)].rstrip("/") + path
+
+    async def forward(self, websocket: WebSocket, room_id: str):
+        """担当ワーカーにつなぎ、どちらかが閉じるまでフレームをそのまま中継する"""
+        # 認証はつなぎ先でもう一度行うので、クッキーとサブプロトコルを引き継ぐ
+        headers = []
+        if self.secret is not None:
+            headers.append((FORWARDED_HEADER, f"{self.worker_id}:{self.sign(self.worker_id, room_id)}"))
+        if "cookie" in websocket.headers:
+            headers.append(("cookie", websocket.headers["cookie"]))
+        subprotocols = websocket.scope.get("subprotocols") or None
+
+        try:
+            upstream = await websockets.connect(
+                self.url(room_id, websocket.url.path),
+                additional_headers=headers,
+                subprotocols=subprotocols,
+            )
+        except (OSError, websockets.WebSocketException):
+            # 担当ワーカーが落ちている
+            self.forward_failed += 1
+            await websocket.close(code=1013)
+            return
+
+        self.forwarded += 1
+        await websocket.accept(subprotocol=upstream.subprotocol)
+
+        async def client_to_upstream():
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                if message.get("bytes") is not None:
+                    await upstream.send(message["bytes"])
+                else:
+                    await upstream.send(message["text"])
+
+        async def upstream_to_client():
+            async for message in upstream:
+                if isinstance(message, bytes):
+                    await websocket.send_bytes(message)
+                else:
+                    await websocket.send_text(message)
+
+        tasks = [asyncio.create_task(client_to_upstream()), asyncio.create_task(upstream_to_client())]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await upstream.close()
+            try:
+                await websocket.close(code=upstream.close_code or 1000)
+            except Exception:
+                pass
+
+    def metrics(self) -> dict:
+        return {
+            "worker_id": self.worker_id,
+            "workers": max(len(self.worker_urls), 1),
+            "forwarded": self.forwarded,
+            "forward_failed": self.forward_failed,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,217 @@
+from fastapi import WebSocket, WebSocketDisconnect
+from typing import Optional, Tuple
+import json
+import msgpack
+
+# WebSocketのメッセージ形式
+#
+# 既定はJSON。接続時にサブプロトコル "bmj.msgpack.v1" を要求したクライアントにはmsgpackのバイナリで送る。
+# バイナリでは牌を0~135の牌ID、actionとキーを小さな整数、ゲーム状態を配列で表す。
+#
+#   フレーム:      [action, {キー: 値}, 全体 or nil, 差分 or nil]
+#   全体:          [共通部分, [viewer_id, 手牌] or nil]
+#   共通部分:      STATE_FIELDSの順の配列。playersは [[player_id, name, seat, 捨て牌], ...]
+#   差分:          [[from, to, {STATE_FIELDSの番号: 値}, {player_id: 追加の捨て牌} or nil], 手牌 or nil]
+#   クライアント→: [action, {キー: 値}]
+#
+# 番号は一覧の添字なので、一覧には末尾に追加していくこと (frontend/src/utils/binaryProtocol.tsと揃える)
+
+MSGPACK_SUBPROTOCOL = "bmj.msgpack.v1"
+
+ACTIONS = [
+    "player_connected", "player_joined", "player_disconnected", "game_started", "hai_discarded",
+    "ron_claimed", "doubt_result", "doubt_timeout", "game_state",
+    "start_game", "discard", "claim_ron", "claim_doubt", "get_game_state",
+]
+
+KEYS = [
+    "player_id", "name", "message", "error", "ron_available", "ron_timeout", "doubt_available",
+    "doubt_timeout", "doubter_id", "target_id", "winner", "reason", "hai_idx",
+]
+
+STATE_FIELDS = [
+    "version", "room_id", "game_started", "game_finished", "current_turn", "current_player_id",
+    "hai_left", "dora_indicator", "players", "doubt_available", "ron_player", "winner",
+    "last_discarded_hai", "last_action_player",
+]
+
+class ProtocolError(ValueError):
+    """クライアントから届いたメッセージが読めない"""
+    pass
+
+
+def _lookup(table: list, code, kind: str) -> str:
+    if isinstance(code, str):
+        return code
+    if isinstance(code, int) and not isinstance(code, bool) and 0 <= code < len(table):
+        return table[code]
+    raise ProtocolError(f"不明な{kind}です: {code!r}")
+
+
+_ACTION_CODES = {action: i for i, action in enumerate(ACTIONS)}
+_KEY_CODES = {key: i for i, key in enumerate(KEYS)}
+_FIELD_CODES = {field: i for i, field in enumerate(STATE_FIELDS)}
+
+
+class JsonCodec:
+    """JSONの文字列。エンコード済みのオブジェクトの末尾にキーを継ぎ足してフレームを作る"""
+    name = None
+    binary = False
+
+    @staticmethod
+    def encode(obj) -> str:
+        # starletteのsend_jsonと同じ形式
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+    @staticmethod
+    def splice(text: str, key: str, value_text: str) -> str:
+        if text == "{}":
+            return '{"' + key + '":' + value_text + '}'
+        return text[:-1] + ',"' + key + '":' + value_text + '}'
+
+    @staticmethod
+    def merge(text: str, other_text: str) -> str:
+        if other_text == "{}":
+            return text
+        if text == "{}":
+            return other_text
+        return text[:-1] + ',' + other_text[1:]
+
+    def message(self, message: dict) -> str:
+        return self.encode(message)
+
+    def frame(self, message: str) -> str:
+        return message
+
+    def with_snapshot(self, message: str, snapshot: str) -> str:
+        return self.splice(message, "game_state", snapshot)
+
+    def with_delta(self, message: str, delta: str) -> str:
+        return self.splice(message, "delta", delta)
+
+    def public_snapshot(self, game) -> str:
+        return self.encode(game.get_public_state())
+
+    def snapshot(self, public: str, game, viewer_id: str) -> str:
+        return self.merge(public, self.encode(game.get_private_state(viewer_id)))
+
+    def public_delta(self, game, since: int) -> Optional[Tuple[str, set]]:
+        public = game.get_public_delta(since)
+        if public is None:
+            return None
+        delta, hand_players = public
+        return self.encode(delta), hand_players
+
+    def delta(self, public: str, game, viewer_id: str, hand_changed: bool) -> str:
+        # 手牌は本人にだけ、変わったときに送る
+        if hand_changed:
+            return self.splice(public, "hand", self.encode(game.get_hand(viewer_id)))
+        return public
+
+    def decode(self, data: str) -> dict:
+        try:
+            message = json.loads(data)
+        except (ValueError, TypeError) as e:
+            raise ProtocolError("JSONを読めません: " + str(e))
+        if not isinstance(message, dict):
+            raise ProtocolError("メッセージはオブジェクトにしてください")
+        return message
+
+
+class MsgpackCodec:
+    """msgpackのバイナリ。配列をつなげてフレームを作る"""
+    name = MSGPACK_SUBPROTOCOL
+    binary = True
+
+    _NIL = msgpack.packb(None)
+    _ARRAY2 = b'\x92'
+    _ARRAY4 = b'\x94'
+
+    @staticmethod
+    def encode(obj) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def message(self, message: dict) -> bytes:
+        # [action, {キー: 値}] の2つ分。フレームにするときに全体と差分を後ろに足す
+        action = message.get("action")
+        extras = {}
+        for key, value in message.items():
+            if key in ("action", "game_state", "delta"):
+                continue
+            extras[_KEY_CODES.get(key, key)] = value
+        return self.encode(_ACTION_CODES.get(action, action)) + self.encode(extras)
+
+    def with_snapshot(self, message: bytes, snapshot: bytes) -> bytes:
+        return self._ARRAY4 + message + snapshot + self._NIL
+
+    def with_delta(self, message: bytes, delta: bytes) -> bytes:
+        return self._ARRAY4 + message + self._NIL + delta
+
+    def frame(self, message: bytes) -> bytes:
+        return self._ARRAY4 + message + self._NIL + self._NIL
+
+    def public_snapshot(self, game) -> bytes:
+        state = game.get_public_state(tile_id=True)
+        state["players"] = [
+            [player_id, player["name"], player["seat"], player["discarded"]]
+            for player_id, player in state["players"].items()
+        ]
+        return self.encode([state.get(field) for field in STATE_FIELDS])
+
+    def snapshot(self, public: bytes, game, viewer_id: str) -> bytes:
+        private = game.get_private_state(viewer_id, tile_id=True)
+        if private:
+            private = [private["viewer_id"], private["hand"]]
+        else:
+            private = None
+        return self._ARRAY2 + public + self.encode(private)
+
+    def public_delta(self, game, since: int) -> Optional[Tuple[bytes, set]]:
+        public = game.get_public_delta(since, tile_id=True)
+        if public is None:
+            return None
+        delta, hand_players = public
+        fields = {_FIELD_CODES[field]: value for field, value in delta["state"].items()}
+        packed = [delta["from"], delta["to"], fields, delta.get("discarded")]
+        return self.encode(packed), hand_players
+
+    def delta(self, public: bytes, game, viewer_id: str, hand_changed: bool) -> bytes:
+        hand = game.get_hand(viewer_id, tile_id=True) if hand_changed else None
+        return self._ARRAY2 + public + self.encode(hand)
+
+    def decode(self, data: bytes) -> dict:
+        # クライアントからのメッセージ [action, {キー: 値}] をJSONと同じdictにする
+        try:
+            fields = msgpack.unpackb(data, strict_map_key=False)
+        except (ValueError, TypeError, msgpack.UnpackException) as e:
+            raise ProtocolError("msgpackを読めません: " + (str(e) or type(e).__name__))
+        if not isinstance(fields, list) or len(fields) != 2:
+            raise ProtocolError("メッセージは [action, {キー: 値}] にしてください")
+        action, extras = fields
+        if extras is not None and not isinstance(extras, dict):
+            raise ProtocolError("メッセージは [action, {キー: 値}] にしてください")
+        message = {"action": _lookup(ACTIONS, action, "action")}
+        for key, value in (extras or {}).items():
+            message[_lookup(KEYS, key, "キー")] = value
+        return message
+
+
+JSON = JsonCodec()
+MSGPACK = MsgpackCodec()
+
+
+def negotiate(websocket: WebSocket):
+    """クライアントが要求したサブプロトコルから使うコーデックを選ぶ"""
+    if MSGPACK_SUBPROTOCOL in websocket.scope.get("subprotocols", []):
+        return MSGPACK
+    return JSON
+
+
+async def receive_message(websocket: WebSocket) -> dict:
+    """テキストでもバイナリでも受け取り、dictにして返す。読めなければProtocolErrorを送出する"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("bytes") is not None:
+        return MSGPACK.decode(message["bytes"])
+    return JSON.decode(message["text"])
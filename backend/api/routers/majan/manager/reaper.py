@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# 使われなくなったルームの片付けと、ルーム数・メモリの上限
+#
+# 一定間隔でルームを見回り、段階 (lobby: 開始前 / playing: 対局中 / finished: 終了後) ごとの
+# 時間より長く何も起きていないルームを閉じる。閉じるときは接続を切り、タイマーを取り消す
+# (対局中ならスナップショットは残るので、戻ってくれば続きから始まる)。
+# ルーム数かメモリの見積もりが上限を超えたら、終了したルームを古く使われた順に閉じる。
+
+# メモリの見積もりに使う大きさ (4人で配牌まで済んだゲームと、変更履歴1件をtracemallocで測った値)
+ROOM_BASE_BYTES = 16 * 1024
+CHANGE_BYTES = 400
+
+STAGES = ("lobby", "playing", "finished")
+
+
+def stage_of(game) -> str:
+    if game.game_finished:
+        return "finished"
+    if game.game_started:
+        return "playing"
+    return "lobby"
+
+
+class RoomReaper:
+    def __init__(self, manager, ttl: dict, max_rooms: int = 0, memory_budget: int = 0, interval: float = 30):
+        self.manager = manager
+        # 段階ごとの、何も起きなければ閉じるまでの秒数
+        self.ttl = ttl
+        # 0なら上限なし
+        self.max_rooms = max_rooms
+        self.memory_budget = memory_budget
+        self.interval = interval
+        self.task = None
+
+        # 計測値 (閉じた理由ごとの件数、失敗した見回りの回数)
+        self.sweeps = 0
+        self.evicted = {}
+        self.failed = 0
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.sweep()
+            except Exception:
+                # 1回失敗しても見回りは止めない
+                self.failed += 1
+                logger.exception("ルームの見回りに失敗しました")
+
+    def room_bytes(self, room_id: str) -> int:
+        """ルームが使っているメモリの見積もり"""
+        manager = self.manager
+        game = manager.games[room_id]
+        size = ROOM_BASE_BYTES + len(game.changes) * CHANGE_BYTES
+        if game.replay:
+            size += len(game.replay)
+        # エンコード済みのゲーム状態のキャッシュと、送信待ちのフレーム
+        for renderer in manager.renderers.get(room_id, {}).values():
+            if renderer.snapshot_public:
+                size += len(renderer.snapshot_public)
+        for queue in manager.active_connections.get(room_id, {}).values():
+            size += sum(len(message) for queued_at, message, event in queue.queue)
+        return size
+
+    def sweep(self, now: float = None):
+        """1回分の見回り。閉じたルームのroom_idを返す"""
+        manager = self.manager
+        now = time.monotonic() if now is None else now
+        self.sweeps += 1
+        closed = []
+
+        for room_id in list(manager.games):
+            game = manager.games[room_id]
+            # 送信に失敗した(相手が落ちている)接続は、受信ループの代わりに切断を積む
+            for player_id, queue in manager.active_connections.get(room_id, {}).items():
+                if queue.closed and not queue.reaped:
+                    queue.reaped = True
+                    asyncio.get_running_loop().create_task(manager.leave(room_id, player_id, queue.websocket))
+                    self._count("half_open")
+
+            # 終わったゲームのタイマーは不要
+            if game.game_finished:
+                game._cancel_timer('ron_timer')
+                game._cancel_timer('doubt_timer')
+
+            stage = stage_of(game)
+            ttl = self.ttl.get(stage)
+            if ttl and now - manager.actors[room_id].last_active > ttl:
+                manager.evict(room_id)
+                closed.append(room_id)
+                self._count("idle_" + stage)
+
+        closed += self._enforce_budget()
+        return closed
+
+    # 上限を超えていれば、終了したルームを最後に使われたのが古い順に閉じる
+    def _enforce_budget(self) -> list:
+        manager = self.manager
+        rooms = len(manager.games)
+        total = self.total_bytes() if self.memory_budget else 0
+
+        def over():
+            return (self.max_rooms and rooms > self.max_rooms) or (self.memory_budget and total > self.memory_budget)
+
+        if not over():
+            return []
+        finished = sorted(
+            (room_id for room_id, game in manager.games.items() if game.game_finished),
+            key=lambda room_id: manager.actors[room_id].last_active,
+        )
+        closed = []
+        for room_id in finished:
+            if not over():
+                break
+            if self.memory_budget:
+                total -= self.room_bytes(room_id)
+            manager.evict(room_id)
+            rooms -= 1
+            closed.append(room_id)
+            self._count("budget")
+        return closed
+
+    def total_bytes(self) -> int:
+        return sum(self.room_bytes(room_id) for room_id in self.manager.games)
+
+    def _count(self, reason: str):
+        self.evicted[reason] = self.evicted.get(reason, 0) + 1
+
+    def metrics(self) -> dict:
+        manager = self.manager
+        now = time.monotonic()
+        rooms = {}
+        for room_id, game in manager.games.items():
+            rooms[room_id] = {
+                "stage": stage_of(game),
+                "bytes": self.room_bytes(room_id),
+                "connections": len(manager.active_connections.get(room_id, {})),
+                "idle": now - manager.actors[room_id].last_active,
+            }
+        return {
+            "rooms": len(rooms),
+            "max_rooms": self.max_rooms,
+            "total_bytes": sum(room["bytes"] for room in rooms.values()),
+            "memory_budget": self.memory_budget,
+            "sweeps": self.sweeps,
+            "evicted": dict(self.evicted),
+            "failed": self.failed,
+            "per_room": rooms,
+        }
@@ -0,0 +1,145 @@
+# バイナリ麻雀の対局記録
+#
+# ヘッダ (マジック, バージョン, シード, 赤ドラ, 席の人数と各席のplayer_id) のあとに、
+# 1件3バイト固定の記録を追記していく。
+#   1バイト目: 上位4ビットが種類、下位4ビットが席
+#   2,3バイト目: 種類ごとの引数 (牌は0~135の牌ID)
+# 山はシードから作り直せるので配牌は記録しない。1局でおよそ数百バイトになる。
+
+import struct
+
+MAGIC = b'BMJR'
+VERSION = 1
+
+_HEADER = struct.Struct('<4sBQBB')
+_RECORD = struct.Struct('3B')
+
+# 記録の種類
+TSUMO = 1       # (席, 牌ID, 0)        ロンの猶予が過ぎて次の席がツモった
+DAHAI = 2       # (席, 手牌インデックス, 牌ID)
+RON = 3         # (席, 牌ID, 成立なら1)
+DOUBT = 4       # (席, ダウトされた席, 0)
+TIMEOUT = 5     # (ロン宣言した席, 0, 0) ダウト時間切れ
+RYUUKYOKU = 6   # (0, 0, 0)           山がなくなった
+
+KINDS = {TSUMO: 'tsumo', DAHAI: 'dahai', RON: 'ron', DOUBT: 'doubt', TIMEOUT: 'timeout', RYUUKYOKU: 'ryuukyoku'}
+
+
+class ReplayError(ValueError):
+    pass
+
+
+class ReplayWriter:
+    """対局中に記録を追記していく"""
+
+    def __init__(self, seed, aka, seats):
+        self.buf = bytearray(_HEADER.pack(MAGIC, VERSION, seed, aka, len(seats)))
+        for player_id in seats:
+            name = str(player_id).encode('utf-8')
+            self.buf.append(len(name))
+            self.buf += name
+
+    def _append(self, kind, seat, a=0, b=0):
+        self.buf += _RECORD.pack(kind << 4 | seat, a, b)
+
+    def tsumo(self, seat, hai):
+        self._append(TSUMO, seat, hai.idx136)
+
+    def dahai(self, seat, hai_idx, hai):
+        self._append(DAHAI, seat, hai_idx, hai.idx136)
+
+    def ron(self, seat, hai, valid):
+        self._append(RON, seat, hai.idx136, int(valid))
+
+    def doubt(self, seat, target_seat):
+        self._append(DOUBT, seat, target_seat)
+
+    def timeout(self, seat):
+        self._append(TIMEOUT, seat)
+
+    def ryuukyoku(self):
+        self._append(RYUUKYOKU, 0)
+
+    @classmethod
+    def frombytes(cls, data: bytes):
+        """途中まで書いた記録から続きを書く (スナップショットからの復元用)"""
+        writer = cls.__new__(cls)
+        writer.buf = bytearray(data)
+        return writer
+
+    def getvalue(self) -> bytes:
+        return bytes(self.buf)
+
+    def __len__(self):
+        return len(self.buf)
+
+
+class Replay:
+    """記録を読み込み、任意の位置まで対局を再実行する"""
+
+    def __init__(self, data: bytes):
+        data = memoryview(data)
+        if len(data) < _HEADER.size:
+            raise ReplayError('記録が短すぎます')
+        magic, version, self.seed, aka, n = _HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ReplayError('バイナリ麻雀の記録ではありません')
+        if version != VERSION:
+            raise ReplayError('対応していないバージョンです: ' + str(version))
+        self.aka = bool(aka)
+
+        pos = _HEADER.size
+        self.seats = []
+        for i in range(n):
+            size = data[pos]
+            self.seats.append(bytes(data[pos + 1:pos + 1 + size]).decode('utf-8'))
+            pos += 1 + size
+
+        body = data[pos:]
+        if len(body) % _RECORD.size:
+            raise ReplayError('記録の末尾が欠けています')
+        # (種類, 席, 引数1, 引数2) のタプルにしておく
+        self.records = [(head >> 4, head & 0x0f, a, b) for head, a, b in _RECORD.iter_unpack(body)]
+
+    def __len__(self):
+        return len(self.records)
+
+    def describe(self):
+        """記録を人が読める形で返す"""
+        return [(KINDS[kind], self.seats[seat], a, b) for kind, seat, a, b in self.records]
+
+    def run(self, upto: int = None):
+        """最初からupto件目 (省略時は最後) までを再実行したBinaryMahjongGameを返す
+
+        記録された牌と再実行で出た牌が食い違えばReplayErrorを送出する。
+        """
+        from .game_manager import BinaryMahjongGame
+
+        game = BinaryMahjongGame('replay', seed=self.seed)
+        for player_id in self.seats:
+            game.add_player(player_id, player_id)
+        game.start_game()
+
+        seats = self.seats
+        for i, (kind, seat, a, b) in enumerate(self.records[:upto]):
+            if kind == TSUMO:
+                hai = game._next_turn()
+                if hai is None or hai.idx136 != a or game.current_turn_idx != seat:
+                    raise ReplayError(str(i) + '件目のツモが一致しません')
+            elif kind == DAHAI:
+                hai = game._dahai(seats[seat], a)
+                if hai.idx136 != b:
+                    raise ReplayError(str(i) + '件目の打牌が一致しません')
+            elif kind == RON:
+                if game._ron(seats[seat]) != bool(b):
+                    raise ReplayError(str(i) + '件目のロン判定が一致しません')
+            elif kind == DOUBT:
+                game._doubt(seats[seat], seats[a])
+            elif kind == TIMEOUT:
+                game._doubt_timeout(seats[seat], game.players[seats[seat]].can_ron(game.last_discarded_hai))
+            elif kind == RYUUKYOKU:
+                if game._next_turn() is not None:
+                    raise ReplayError(str(i) + '件目で流局しません')
+            else:
+                raise ReplayError(str(i) + '件目の種類が不明です: ' + str(kind))
+        return game
@@ -0,0 +1,250 @@
+from . import snapshot
+import asyncio
+import inspect
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# 1つのルームのゲームを順番に処理するアクター
+#
+# プレイヤーの受信ループやロン・ダウトのタイマーはゲームを直接触らず、コマンドをメールボックスに積む。
+# ルームごとに1つのタスクがメールボックスから順に取り出して適用し、結果をブロードキャストする。
+# ゲームを変更するのはこのタスクだけなので、ロックなしで積まれた順に決まった結果になる。
+
+# クライアントから受け付けるaction。join・leave・timerはサーバーの中からだけ積む
+CLIENT_ACTIONS = ("start_game", "discard", "claim_ron", "claim_doubt", "get_game_state")
+
+
+class RoomActor:
+    def __init__(self, room_id: str, game, manager, mailbox_size: int = 256, store=None):
+        self.room_id = room_id
+        self.game = game
+        self.manager = manager
+        # スナップショットの保存先 (snapshot.SnapshotStore)。Noneなら保存しない
+        self.store = store
+        self.checkpointed = game.version
+        # 保存待ちのスナップショット。保存中に変わったら最新の1つだけを続けて保存する
+        self.pending = None
+        self.saving = None
+        # (action, player_id, data, 積んだ時刻)
+        self.mailbox = asyncio.Queue(mailbox_size)
+        self.task = None
+        # 最後にコマンドを処理した時刻。RoomReaperが使われていないルームを閉じるのに使う
+        self.last_active = time.monotonic()
+        self.handlers = {
+            "join": self._join,
+            "leave": self._leave,
+            "timer": self._timer,
+            "start_game": self._start_game,
+            "discard": self._discard,
+            "claim_ron": self._claim_ron,
+            "claim_doubt": self._claim_doubt,
+            "get_game_state": self._get_game_state,
+        }
+
+        # タイマーの発火もメールボックスを通す
+        game.post = self.post_timer
+        game.on_doubt_timeout = self._on_doubt_timeout
+
+        # 計測値
+        self.started_at = None
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.max_depth = 0
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self.task = asyncio.create_task(self._run())
+
+    # ルームがなくなったら止める。積まれているコマンドは捨て、残っているタイマーも取り消す
+    # 対局中ならスナップショットを残し、プレイヤーが戻ってきたときに続きから始める
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+        self.game.post = None
+        self.game._cancel_timer('ron_timer')
+        self.game._cancel_timer('doubt_timer')
+        if self.store and (self.game.game_finished or not self.game.game_started):
+            asyncio.create_task(self._drop())
+
+    # 状態が変わっていればスナップショットを作って保存に回す。書き込みは待たない
+    def _checkpoint(self):
+        if self.store is None or self.game.version == self.checkpointed:
+            return
+        self.checkpointed = self.game.version
+        self.pending = snapshot.dump(self.game)
+        if self.saving is None or self.saving.done():
+            self.saving = asyncio.create_task(self._save())
+
+    async def _save(self):
+        while self.pending is not None:
+            data, self.pending = self.pending, None
+            try:
+                await self.store.checkpoint(self.game, data)
+            except Exception:
+                self.store.failed += 1
+
+    async def _drop(self):
+        if self.saving:
+            await self.saving
+        try:
+            await self.store.delete(self.room_id)
+        except Exception:
+            self.store.failed += 1
+
+    async def submit(self, action: str, player_id: str = None, data: dict = None):
+        """コマンドを積む。メールボックスが一杯なら空くまで待つ (送ってきた接続の受信がそのぶん止まる)"""
+        await self.mailbox.put((action, player_id, data or {}, time.perf_counter()))
+        self.max_depth = max(self.max_depth, self.mailbox.qsize())
+
+    async def receive(self, player_id: str, data: dict):
+        """クライアントからのメッセージを積む。知らないactionは無視する"""
+        action = data.get("action")
+        if action in CLIENT_ACTIONS:
+            await self.submit(action, player_id, data)
+
+    # ゲームのタイマーから呼ばれる。タイマーは待てないので、一杯なら空いたときに積むタスクにする
+    def post_timer(self, callback, *args):
+        command = ("timer", None, {"callback": callback, "args": args}, time.perf_counter())
+        try:
+            self.mailbox.put_nowait(command)
+        except asyncio.QueueFull:
+            asyncio.get_running_loop().create_task(self.mailbox.put(command))
+        self.max_depth = max(self.max_depth, self.mailbox.qsize())
+
+    async def _run(self):
+        while True:
+            action, player_id, data, queued_at = await self.mailbox.get()
+            started = time.perf_counter()
+            self.last_active = time.monotonic()
+            wait = started - queued_at
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            try:
+                await self.handlers[action](player_id, data)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # 1つのコマンドの失敗でルームを止めない
+                self.failed += 1
+                logger.exception("ルーム%sで%sの処理に失敗しました (player_id=%s)", self.room_id, action, player_id)
+            self._checkpoint()
+            self.processed += 1
+            self.busy += time.perf_counter() - started
+
+    async def _join(self, player_id: str, data: dict):
+        game = self.game
+        # すでに参加しているプレイヤーの再接続
+        if player_id in game.players:
+            return
+
+        # ゲームが開始されている場合はエラーを返す
+        if game.game_started:
+            await self.manager.send_personal(
+                {"error": "ゲームはすでに開始されています"},
+                self.room_id, player_id
+            )
+        # そうでなければプレイヤーを追加
+        elif game.add_player(player_id, data["name"]):
+            await self.manager.broadcast(
+                {"action": "player_joined", "player_id": player_id, "name": data["name"]},
+                self.room_id
+            )
+
+    async def _leave(self, player_id: str, data: dict):
+        # 同じプレイヤーが新しい接続に切り替えていれば、古い接続の切断は無視する
+        if not self.manager.disconnect(self.room_id, player_id, data.get("websocket")):
+            return
+        await self.manager.broadcast({
+            "action": "player_disconnected",
+            "player_id": player_id
+        }, self.room_id)
+
+    async def _timer(self, player_id: str, data: dict):
+        result = data["callback"](*data["args"])
+        if inspect.isawaitable(result):
+            await result
+
+    async def _on_doubt_timeout(self, timeout_result: dict):
+        await self.manager.broadcast({
+            "action": "doubt_timeout",
+            "winner": timeout_result["winner"],
+            "reason": timeout_result["reason"]
+        }, self.room_id)
+
+    async def _start_game(self, player_id: str, data: dict):
+        # trueが返ってきた場合
+        if self.game.start_game():
+            await self.manager.broadcast({"action": "game_started"}, self.room_id)
+        else:
+            await self.manager.send_personal({"error": "ゲームを開始できません"}, self.room_id, player_id)
+
+    async def _discard(self, player_id: str, data: dict):
+        # クライアントから届いた値なので整数かを先に確かめる (手牌の範囲はdiscard_haiが手番の確認のあとで確かめる)
+        hai_idx = data.get("hai_idx")
+        if not isinstance(hai_idx, int) or isinstance(hai_idx, bool):
+            await self.manager.send_personal({"error": "無効な牌のインデックスです"}, self.room_id, player_id)
+            return
+
+        success, result = await self.game.discard_hai(player_id, hai_idx)
+
+        if success:
+            await self.manager.broadcast({
+                "action": "hai_discarded",
+                "player_id": player_id,
+                "message": result.get("message", ""),
+                "ron_available": result.get("ron_available", False),
+                "ron_timeout": result.get("ron_timeout", 0)
+            }, self.room_id)
+        else:
+            await self.manager.send_personal({"error": result}, self.room_id, player_id)
+
+    async def _claim_ron(self, player_id: str, data: dict):
+        success, result = await self.game.claim_ron(player_id)
+
+        if success:
+            await self.manager.broadcast({
+                "action": "ron_claimed",
+                "player_id": player_id,
+                "doubt_available": result.get("doubt_available", False),
+                "doubt_timeout": result.get("doubt_timeout", 30)
+            }, self.room_id)
+        else:
+            await self.manager.send_personal({"error": result}, self.room_id, player_id)
+
+    async def _claim_doubt(self, player_id: str, data: dict):
+        target_id = data.get("target_id")
+        success, result = await self.game.claim_doubt(player_id, target_id)
+
+        if success:
+            await self.manager.broadcast({
+                "action": "doubt_result",
+                "doubter_id": player_id,
+                "target_id": target_id,
+                "winner": result["winner"],
+                "reason": result["reason"]
+            }, self.room_id)
+        else:
+            await self.manager.send_personal({"error": result}, self.room_id, player_id)
+
+    # 全体の状態を送るので、差分を取りこぼしたときの取り直しにも使う
+    async def _get_game_state(self, player_id: str, data: dict):
+        await self.manager.send_game_state(self.room_id, player_id)
+
+    def metrics(self) -> dict:
+        elapsed = time.perf_counter() - self.started_at if self.started_at else 0.0
+        return {
+            "depth": self.mailbox.qsize(),
+            "max_depth": self.max_depth,
+            "processed": self.processed,
+            "failed": self.failed,
+            # 起動してからの1秒あたりの処理数と、処理だけにかかった時間から見た上限
+            "throughput": self.processed / elapsed if elapsed else 0.0,
+            "capacity": self.processed / self.busy if self.busy else 0.0,
+            "wait_avg": self.wait_total / self.processed if self.processed else 0.0,
+            "wait_max": self.wait_max,
+        }
@@ -0,0 +1,162 @@
+from typing import Callable, Dict
+import asyncio
+import inspect
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# ロン・ダウトの受付時間のように、全ルームの期限をまとめて扱うタイマー
+#
+# ルームごとにasyncio.sleepのタスクを作る代わりに、イベントループごとに1つのタスクが
+# ハッシュ化したタイマーホイールを回し、期限の来たコールバックをまとめて呼ぶ。
+# 登録と取り消しはO(1)で、精度はtick(既定0.1秒)単位になる。
+
+
+class Timer:
+    __slots__ = ('wheel', 'tick', 'deadline', 'callback', 'args', 'active')
+
+    def __init__(self, wheel, tick, deadline, callback, args):
+        self.wheel = wheel
+        self.tick = tick
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.active = True
+
+    def cancel(self):
+        if self.active:
+            self.active = False
+            self.wheel._remove(self)
+
+
+class TimerWheel:
+    def __init__(self, tick: float = 0.1, size: int = 512):
+        self.tick = tick
+        self.size = size
+        # 各スロットは Timer -> None の辞書 (取り消しをO(1)にするため)
+        self.slots = [dict() for i in range(size)]
+        self.pending = 0
+
+        self.start = time.monotonic()
+        # 次に処理するtick
+        self.current = 0
+        self.task = None
+        self.wakeup = None
+
+        # 計測値
+        self.fired = 0
+        self.cancelled = 0
+        # 例外を出したコールバックの数 (同期・非同期とも)
+        self.failed = 0
+        self.batches = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+
+    def _tick_of(self, deadline: float) -> int:
+        # 期限より前に発火しないよう切り上げる
+        tick = int((deadline - self.start) / self.tick) + 1
+        return max(tick, self.current)
+
+    def schedule(self, delay: float, callback: Callable, *args) -> Timer:
+        """delay秒後にcallback(*args)を呼ぶ。callbackがコルーチンを返したら、まとめて1つのタスクで待つ"""
+        deadline = time.monotonic() + delay
+        timer = Timer(self, self._tick_of(deadline), deadline, callback, args)
+        self.slots[timer.tick % self.size][timer] = None
+        self.pending += 1
+
+        if self.task is None or self.task.done():
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.get_running_loop().create_task(self._run())
+        elif self.pending == 1:
+            self.wakeup.set()
+        return timer
+
+    def reschedule(self, timer: Timer, delay: float) -> Timer:
+        timer.cancel()
+        return self.schedule(delay, timer.callback, *timer.args)
+
+    def _remove(self, timer: Timer):
+        del self.slots[timer.tick % self.size][timer]
+        self.pending -= 1
+        self.cancelled += 1
+
+    async def _run(self):
+        while True:
+            if not self.pending:
+                # 期限がなければ次の登録まで眠る
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                self.current = max(self.current, int((time.monotonic() - self.start) / self.tick))
+                continue
+
+            await asyncio.sleep(max(0.0, self.start + self.current * self.tick - time.monotonic()))
+
+            # 遅れていた分のtickもまとめて処理する
+            now_tick = int((time.monotonic() - self.start) / self.tick)
+            due = []
+            while self.current <= now_tick:
+                slot = self.slots[self.current % self.size]
+                for timer in [t for t in slot if t.tick <= self.current]:
+                    del slot[timer]
+                    timer.active = False
+                    due.append(timer)
+                self.current += 1
+            if due:
+                self._fire(due)
+
+    def _fire(self, due):
+        self.pending -= len(due)
+        self.batches += 1
+        now = time.monotonic()
+        waiting = []
+        for timer in due:
+            lag = now - timer.deadline
+            self.fired += 1
+            self.lag_total += lag
+            self.lag_max = max(self.lag_max, lag)
+            try:
+                result = timer.callback(*timer.args)
+            except Exception:
+                # 1つの失敗でほかのタイマーを止めない
+                self.failed += 1
+                logger.exception("タイマーのコールバック%rが失敗しました", timer.callback)
+                continue
+            if inspect.isawaitable(result):
+                waiting.append(result)
+        if waiting:
+            async def wait_all():
+                results = await asyncio.gather(*waiting, return_exceptions=True)
+                for result in results:
+                    if isinstance(result, Exception):
+                        self.failed += 1
+                        logger.error("タイマーのコールバックが失敗しました", exc_info=result)
+
+            asyncio.get_running_loop().create_task(wait_all())
+
+    def metrics(self) -> dict:
+        return {
+            "pending": self.pending,
+            "fired": self.fired,
+            "cancelled": self.cancelled,
+            "failed": self.failed,
+            "batches": self.batches,
+            "lag_avg": self.lag_total / self.fired if self.fired else 0.0,
+            "lag_max": self.lag_max,
+        }
+
+
+# イベントループごとに1つのタイマーホイール
+_wheels: Dict[asyncio.AbstractEventLoop, TimerWheel] = {}
+
+
+def get_scheduler() -> TimerWheel:
+    loop = asyncio.get_running_loop()
+    wheel = _wheels.get(loop)
+    if wheel is None:
+        # 閉じたループのホイールは捨てる
+        for closed in [l for l in _wheels if l.is_closed()]:
+            del _wheels[closed]
+        wheel = TimerWheel()
+        _wheels[loop] = wheel
+    return wheel
@@ -0,0 +1,151 @@
+from fastapi import WebSocket
+from collections import deque
+from typing import Callable, Optional, Union
+from .protocol import JSON
+import asyncio
+import time
+
+# 送信キューが一杯のときの扱い
+# coalesce: 溜まっている状態 (差分・全体) を捨て、最新のゲーム状態の全体1つにまとめる
+#           イベント (game_started、ron_claimedなど) は状態を外して順番どおりに残し、
+#           イベントだけでも入りきらなければ接続を切る
+# drop: 新しいフレームを捨てる (次の送信でゲーム状態の全体を送り直す)
+# disconnect: 接続を切る
+POLICIES = ("coalesce", "drop", "disconnect")
+
+
+# 1つの接続の送信キュー
+# putはネットワークI/Oを待たずにキューに積むだけで、専用のタスクが順番に送信する。
+# 積むのはcodecでエンコード済みのフレーム (JSONなら文字列、バイナリならバイト列) で、
+# 同じフレームを複数の接続で共有してよい
+class SendQueue:
+    def __init__(self, websocket: WebSocket, maxsize: int = 64, policy: str = "coalesce", codec=JSON):
+        if policy not in POLICIES:
+            raise ValueError("不明な送信キューのポリシーです: " + str(policy))
+        self.websocket = websocket
+        # この接続で使うプロトコル (protocol.JSON / protocol.MSGPACK)
+        self.codec = codec
+        self.maxsize = maxsize
+        self.policy = policy
+
+        # (積んだ時刻, メッセージ, イベント)
+        # イベントはcoalesceのときに状態を外して送り直すための元のメッセージで、状態だけのフレームならNone
+        self.queue = deque()
+        self.ready = asyncio.Event()
+        self.closed = False
+        # RoomReaperが切断を積んだか
+        self.reaped = False
+        self.task = None
+
+        # 計測値
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def start(self):
+        self.task = asyncio.create_task(self._writer())
+
+    # メッセージを積む。一杯ならpolicyに従い、積めなかったらFalseを返す
+    # snapshotは coalesce のときに呼ばれ、ゲーム状態の全体を付けたメッセージを返す
+    # eventはこのメッセージの元のdictで、coalesceで状態を外して残す (状態だけのフレームならNone)
+    def put(self, message: Union[str, bytes], snapshot: Optional[Callable[[], Union[str, bytes]]] = None,
+            event: Optional[dict] = None) -> bool:
+        if self.closed:
+            return False
+
+        now = time.perf_counter()
+        if len(self.queue) >= self.maxsize:
+            if self.policy == "coalesce" and snapshot is not None:
+                events = [(queued_at, kept) for queued_at, _, kept in self.queue if kept is not None]
+                if event is not None:
+                    events.append((now, event))
+                if len(events) >= self.maxsize:
+                    # 最新の状態を足すとイベントを捨てることになるので、切断して取り直してもらう
+                    self.dropped += len(self.queue) + 1
+                    self.close(code=1013)
+                    return False
+                self.coalesced += len(self.queue) + 1 - len(events)
+                self.queue = deque(
+                    (queued_at, self._event_frame(kept), kept) for queued_at, kept in events
+                )
+                message = snapshot()
+                event = None
+            elif self.policy == "disconnect":
+                self.dropped += len(self.queue) + 1
+                self.close(code=1013)
+                return False
+            else:
+                self.dropped += 1
+                return False
+
+        self.queue.append((now, message, event))
+        self.max_depth = max(self.max_depth, len(self.queue))
+        self.ready.set()
+        return True
+
+    async def _writer(self):
+        try:
+            while True:
+                if not self.queue:
+                    self.ready.clear()
+                    await self.ready.wait()
+                    continue
+                queued_at, message, _ = self.queue.popleft()
+                if self.codec.binary:
+                    await self.websocket.send_bytes(message)
+                else:
+                    await self.websocket.send_text(message)
+
+                latency = time.perf_counter() - queued_at
+                self.sent += 1
+                self.latency_total += latency
+                self.latency_max = max(self.latency_max, latency)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # 相手が切断しているので、以降は積まない (後始末は受信側のWebSocketDisconnectで行う)
+            self.closed = True
+            self.queue.clear()
+
+    # 状態 (差分・全体) を外したイベントだけのフレーム
+    def _event_frame(self, event: dict) -> Union[str, bytes]:
+        body = {key: value for key, value in event.items() if key not in ("delta", "game_state")}
+        return self.codec.frame(self.codec.message(body))
+
+    # 遅すぎる接続を切る。受信ループがWebSocketDisconnectを受けて後始末をする
+    def close(self, code: int = 1000):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        if self.task:
+            self.task.cancel()
+
+        async def close_websocket():
+            try:
+                await self.websocket.close(code=code)
+            except Exception:
+                pass
+
+        asyncio.create_task(close_websocket())
+
+    # 送信タスクを止める (切断後の後始末)
+    def stop(self):
+        self.closed = True
+        self.queue.clear()
+        if self.task:
+            self.task.cancel()
+
+    def metrics(self) -> dict:
+        return {
+            "depth": len(self.queue),
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "latency_avg": self.latency_total / self.sent if self.sent else 0.0,
+            "latency_max": self.latency_max,
+        }
@@ -0,0 +1,255 @@
+from typing import List, Optional, Tuple
+from urllib.parse import quote, urlparse
+from sqlalchemy import delete
+from db import async_session
+from models import game_snapshot as game_snapshot_model
+from .. import janshi
+from .game_manager import BinaryMahjongGame
+from .replay import ReplayWriter
+from array import array
+import asyncio
+import msgpack
+import os
+import time
+
+# 対局中のBinaryMahjongGameのスナップショット
+#
+# プロセスを再起動しても対局を続けられるよう、状態の変わるたびにストアへ保存し、
+# 最初のプレイヤーが再接続したときに読み戻す。中身はmsgpackの配列で、
+# 山の並び(136バイト)と手牌・河を牌IDのバイト列で持つので、1局あたり数百バイトになる。
+# タイマーは壁時計の期限で持ち、読み戻したときの残り時間で登録し直す。
+#
+# SNAPSHOT_STORE で保存先を選ぶ
+#   (空)                    保存しない
+#   file:///var/lib/bmj     ディレクトリにルームごとのファイルで保存する
+#   db                      game_snapshotsテーブルに保存する
+
+VERSION = 1
+
+# 残り時間を保存するタイマー
+TIMERS = ('ron_timer', 'doubt_timer')
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def dump(game: BinaryMahjongGame) -> bytes:
+    players = []
+    for player_id, player in game.players.items():
+        players.append([
+            player_id, player.name, game.player_seats[player_id], player.first,
+            bytes(hai.idx136 for hai in player.tehai), bytes(hai.idx136 for hai in player.kawa),
+            player.riichi, player.tenbou,
+        ])
+
+    timers = []
+    now_wall, now = time.time(), time.monotonic()
+    for name in TIMERS:
+        timer = getattr(game, name)
+        if timer is not None:
+            # スケジューラーには (name, callback, args) で登録している
+            timers.append([name, now_wall + timer.deadline - now, list(timer.args[2])])
+
+    yama = game.taku.yama
+    last = game.last_discarded_hai
+    return msgpack.packb([
+        VERSION, game.room_id, game.seed, game.taku.aka, game.version,
+        game.game_started, game.game_finished, game.current_turn_idx,
+        game.doubt_available, game.ron_available, game.ron_player, game.winner,
+        last.idx136 if last else None, game.last_action_player,
+        bytes(yama.ids), yama.cursor, yama.rinshan_ctn, game.taku.kanctn,
+        game.ron_time_seconds, game.doubt_time_seconds,
+        players, timers,
+        game.replay.getvalue() if game.replay else None,
+    ], use_bin_type=True)
+
+
+def load(data: bytes) -> Tuple[BinaryMahjongGame, List[list]]:
+    """スナップショットからゲームを作り直し、(ゲーム, 残っているタイマー) を返す
+
+    タイマーはRoomActorを付けたあとでBinaryMahjongGame.resume_timersに渡す
+    """
+    try:
+        fields = msgpack.unpackb(data, raw=False, strict_map_key=False)
+    except Exception as e:
+        raise SnapshotError('スナップショットを読めません: ' + str(e))
+    if not isinstance(fields, list) or not fields or fields[0] != VERSION:
+        raise SnapshotError('対応していないスナップショットです')
+
+    (_, room_id, seed, aka, version,
+     game_started, game_finished, current_turn_idx,
+     doubt_available, ron_available, ron_player, winner,
+     last_discarded, last_action_player,
+     yama_ids, cursor, rinshan_ctn, kanctn,
+     ron_time_seconds, doubt_time_seconds,
+     players, timers, replay) = fields
+
+    game = BinaryMahjongGame(room_id, seed=seed, ron_time_seconds=ron_time_seconds,
+                             doubt_time_seconds=doubt_time_seconds)
+    if aka != game.taku.aka:
+        raise SnapshotError('赤ドラの設定が違います')
+    table = game.taku.hai
+    yama = game.taku.yama
+    yama.ids = array('B', yama_ids)
+    yama.cursor = cursor
+    yama.rinshan_ctn = rinshan_ctn
+    game.taku.kanctn = kanctn
+
+    for player_id, name, seat, first, tehai, kawa, riichi, tenbou in players:
+        player = janshi.Janshi(play=True, first=first)
+        player.name = name
+        player.tehai = [table[i] for i in tehai]
+        player.kawa = [table[i] for i in kawa]
+        player.riichi = riichi
+        player.tenbou = tenbou
+        for hai in player.tehai:
+            player.hai34[hai.idx34] += 1
+        player.update_machi()
+        game.players[player_id] = player
+        game.player_seats[player_id] = seat
+
+    game.game_started = game_started
+    game.game_finished = game_finished
+    game.current_turn_idx = current_turn_idx
+    game.doubt_available = doubt_available
+    game.ron_available = ron_available
+    game.ron_player = ron_player
+    game.winner = winner
+    game.last_discarded_hai = table[last_discarded] if last_discarded is not None else None
+    game.last_action_player = last_action_player
+    if replay is not None:
+        game.replay = ReplayWriter.frombytes(replay)
+    # 変更履歴は残っていないので、クライアントには全体を送り直す
+    game.version = version
+    return game, timers
+
+
+class SnapshotStore:
+    def __init__(self):
+        # 計測値
+        self.saves = 0
+        self.save_bytes = 0
+        self.save_seconds = 0.0
+        self.restores = 0
+        self.restore_seconds = 0.0
+        self.failed = 0
+
+    async def save(self, room_id: str, data: bytes):
+        raise NotImplementedError
+
+    async def load(self, room_id: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    async def delete(self, room_id: str):
+        raise NotImplementedError
+
+    async def checkpoint(self, game: BinaryMahjongGame, data: bytes):
+        started = time.perf_counter()
+        await self.save(game.room_id, data)
+        self.saves += 1
+        self.save_bytes += len(data)
+        self.save_seconds += time.perf_counter() - started
+
+    async def restore(self, room_id: str) -> Optional[Tuple[BinaryMahjongGame, List[list]]]:
+        """保存されていればゲームを作り直して返す。壊れていれば捨ててNoneを返す"""
+        started = time.perf_counter()
+        data = await self.load(room_id)
+        if data is None:
+            return None
+        try:
+            restored = load(data)
+        except SnapshotError:
+            self.failed += 1
+            await self.delete(room_id)
+            return None
+        self.restores += 1
+        self.restore_seconds += time.perf_counter() - started
+        return restored
+
+    def metrics(self) -> dict:
+        return {
+            "saves": self.saves,
+            "save_bytes_avg": self.save_bytes / self.saves if self.saves else 0,
+            "save_avg": self.save_seconds / self.saves if self.saves else 0.0,
+            "restores": self.restores,
+            "restore_avg": self.restore_seconds / self.restores if self.restores else 0.0,
+            "failed": self.failed,
+        }
+
+
+class FileSnapshotStore(SnapshotStore):
+    """ディレクトリにルームごとのファイルで保存する。書き込みは一時ファイルからの置き換えで行う"""
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, room_id: str) -> str:
+        return os.path.join(self.directory, quote(str(room_id), safe='') + '.bmjs')
+
+    def _write(self, path: str, data: bytes):
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _read(self, path: str) -> Optional[bytes]:
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    async def save(self, room_id: str, data: bytes):
+        await asyncio.to_thread(self._write, self._path(room_id), data)
+
+    async def load(self, room_id: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._read, self._path(room_id))
+
+    async def delete(self, room_id: str):
+        await asyncio.to_thread(self._remove, self._path(room_id))
+
+
+class DatabaseSnapshotStore(SnapshotStore):
+    """game_snapshotsテーブルに保存する"""
+
+    def __init__(self, session_factory=async_session):
+        super().__init__()
+        self.session_factory = session_factory
+
+    async def save(self, room_id: str, data: bytes):
+        async with self.session_factory() as session:
+            await session.merge(game_snapshot_model.GameSnapshot(room_id=str(room_id), data=data))
+            await session.commit()
+
+    async def load(self, room_id: str) -> Optional[bytes]:
+        async with self.session_factory() as session:
+            snapshot = await session.get(game_snapshot_model.GameSnapshot, str(room_id))
+            return snapshot.data if snapshot else None
+
+    async def delete(self, room_id: str):
+        async with self.session_factory() as session:
+            await session.execute(
+                delete(game_snapshot_model.GameSnapshot)
+                .where(game_snapshot_model.GameSnapshot.room_id == str(room_id))
+            )
+            await session.commit()
+
+
+def create_store(url: str) -> Optional[SnapshotStore]:
+    if not url:
+        return None
+    if url == "db":
+        return DatabaseSnapshotStore()
+    parsed = urlparse(url)
+    if parsed.scheme == "file":
+        return FileSnapshotStore(parsed.path)
+    raise ValueError("不明なスナップショットの保存先です: " + str(url))
@@ -0,0 +1,45 @@
+from typing import Optional, Union
+from .protocol import JSON
+
+
+# ゲーム状態をエンコードするクラス (ゲームとプロトコルの組ごとに1つ)
+# 全員に共通する部分は版ごとに1度だけ作ってエンコードし、本人にだけ見せる手牌はあとから継ぎ足す。
+# 手牌のない観戦者には同じ文字列(バイト列)をそのまま返す
+class StateRenderer:
+    def __init__(self, game, codec=JSON):
+        self.game = game
+        self.codec = codec
+        self.version = None
+        self.snapshot_public = None
+        # since -> (共通の差分, 手牌が変わったプレイヤー)。差分で表せなければNone
+        self.delta_public = {}
+
+    # ゲームの版が進んでいたらキャッシュを捨てる
+    def _refresh(self):
+        if self.version != self.game.version:
+            self.version = self.game.version
+            self.snapshot_public = None
+            self.delta_public = {}
+
+    def snapshot(self, viewer_id: str = None) -> Union[str, bytes]:
+        """get_game_stateと同じ内容"""
+        self._refresh()
+        if self.snapshot_public is None:
+            self.snapshot_public = self.codec.public_snapshot(self.game)
+        return self.codec.snapshot(self.snapshot_public, self.game, viewer_id)
+
+    def delta(self, viewer_id: str, since: int) -> Optional[Union[str, bytes]]:
+        """get_state_deltaと同じ内容。差分で表せなければNone"""
+        self._refresh()
+        if since not in self.delta_public:
+            self.delta_public[since] = self.codec.public_delta(self.game, since)
+
+        public = self.delta_public[since]
+        if public is None:
+            return None
+        public, hand_players = public
+        return self.codec.delta(public, self.game, viewer_id, viewer_id in hand_players)
+
+    def is_shared(self, viewer_id: str) -> bool:
+        """viewerに送るものがほかの観戦者と共通か"""
+        return viewer_id not in self.game.players
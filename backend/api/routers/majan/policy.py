@@ -0,0 +1,105 @@
+# 打牌や立直などの判断を行うクラス
+#
+# Gameは判断が必要になるとプレイヤーごとのPolicyのメソッドを呼ぶ。
+# メソッドはそのまま値を返しても、コルーチンにして値を返してもよい
+# (コルーチンを返すPolicyを使う場合はGame.agameで進行する)。
+
+
+class Policy:
+    # ツモ和了するか
+    def agari(self, game, idx):
+        return True
+
+    # ロンするか
+    def ron(self, game, idx, hai):
+        return True
+
+    # 立直するか
+    def riichi(self, game, idx):
+        return True
+
+    # 捨てる牌の手牌インデックス。riichi_idxがNoneでなければその中から選ぶ
+    def dahai(self, game, idx, riichi_idx=None):
+        return 13
+
+    # 立直中のツモ切り
+    def tsumogiri(self, game, idx):
+        return None
+
+
+class NpcPolicy(Policy):
+    """和了・ロン・立直はできるときに必ず行い、ツモ切りを続ける"""
+
+    def dahai(self, game, idx, riichi_idx=None):
+        if riichi_idx is not None and 13 not in riichi_idx:
+            return riichi_idx[0]
+        return 13
+
+
+class ShantenPolicy(NpcPolicy):
+    """向聴数が最も小さく、受け入れ枚数が最も多くなる牌を捨てる"""
+
+    def dahai(self, game, idx, riichi_idx=None):
+        janshi = game.janshi[idx]
+        kouho = janshi.dahai_kouho(saiyuukou=True)
+        best = None
+        best_key = None
+        for i, hai in enumerate(janshi.tehai):
+            if riichi_idx is not None and i not in riichi_idx:
+                continue
+            shantensu, ukeire = kouho[hai.idx34]
+            if ukeire is None:
+                continue
+            # 同じ評価ならツモ切りを優先する
+            key = (shantensu, -ukeire, i != 13)
+            if best_key is None or key < best_key:
+                best = i
+                best_key = key
+        return best
+
+
+class ConsolePolicy(Policy):
+    """標準入力でプレイヤーに判断させる"""
+
+    def agari(self, game, idx):
+        temp = input('和了しますか?(Y/N) : ')
+        return temp == 'Y' or temp == 'y'
+
+    def ron(self, game, idx, hai):
+        temp = input(game.janshi[idx].name + 'のロンしますか?(Y/N) : ')
+        return temp == 'Y' or temp == 'y'
+
+    def riichi(self, game, idx):
+        temp = input('立直しますか?(Y/N) : ')
+        return temp == 'Y' or temp == 'y'
+
+    def dahai(self, game, idx, riichi_idx=None):
+        # 立直するときの入力処理
+        if riichi_idx is not None:
+            while 1:
+                try:
+                    print(riichi_idx)
+                    txt = '捨て牌の番号を入力してください' + str(riichi_idx) + ' : '
+                    sutehai = int(input(txt))
+                except ValueError:
+                    print('半角の整数で入力してください')
+                    continue
+                if not sutehai in riichi_idx:
+                    print('その牌では立直できません')
+                else:
+                    return sutehai
+
+        # 通常時の処理
+        while 1:
+            try:
+                sutehai = int(input('捨て牌の番号を入力してください(0~13) : '))
+            except ValueError:
+                print('0から13の整数を半角で入力してください')
+                continue
+            if sutehai < 0 or 13 < sutehai:
+                print('0から13の整数を入力してください')
+            else:
+                return sutehai
+
+    def tsumogiri(self, game, idx):
+        input('ツモ切りします(Press Enter) ')
@@ -1,17 +1,16 @@
-from mahjong.shanten import Shanten
-from mahjong.hand_calculating.hand import HandCalculator
-from mahjong.hand_calculating.hand_config import HandConfig, OptionalRules
+from . import shanten_table
+from .scoring import scorer
 from mahjong.meld import Meld
 
 class HaiList:
     def hai34(tehai):
         hai34 = [0 for i in range(34)]
         for hai in tehai:
-            hai34[hai.kinds * 9 + hai.number] += 1
+            hai34[hai.idx34] += 1
         return hai34
 
     def hai136(tehai):
-        hai136 = [hai.number for hai in tehai]
+        hai136 = [hai.idx136 for hai in tehai]
         return hai136
 
 
@@ -19,21 +18,18 @@ class HaiList:
 class Rule:
 
     def shantensuu(tehai):
-        shanten = Shanten()
-        tiles = HaiList.hai34(tehai)
-        result = shanten.calculate_shanten(tiles)
-        return result
+        return Rule.shantensuu34(HaiList.hai34(tehai))
 
+    # Janshi.hai34のような34種の枚数リストから直接計算する
+    def shantensuu34(hai34):
+        return shanten_table.shanten(hai34)
 
+    # 打牌候補の種類ごとに(打牌後の向聴数, 受け入れ枚数)をまとめて計算する
+    def dahai_kouho(hai34, ukeire=True, saiyuukou=False):
+        return shanten_table.dahai_kouho(hai34, ukeire, saiyuukou)
 
+
+
+    # 計算器と設定は使い回し、同じ条件の手は結果をキャッシュから返す (scoring.HandScorer)
     def agari(tehai, dora, tsumo, riichi, jikaze, bakaze):
-        aka = tehai[0].akaari
-        calculator = HandCalculator()
-        tiles = HaiList.hai136(tehai)  # Corrected method name
-        win_tile = HaiList.hai136([tehai[13]])[0]  # Corrected method name
-        dora_indicators = HaiList.hai136(dora)  # Corrected method name
-        melds = None
-        config = HandConfig(is_tsumo=tsumo, is_riichi=riichi, player_wind=jikaze, round_wind=bakaze,
-                            options=OptionalRules(has_aka_dora=aka, has_open_tanyao=True))
-        tehai_result = calculator.estimate_hand_value(tiles, win_tile, melds, dora_indicators, config)
-        return tehai_result
\ No newline at end of file
+        return scorer.score(tehai, tehai[13], dora, tsumo, riichi, jikaze, bakaze)
\ No newline at end of file
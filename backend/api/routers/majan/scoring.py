@@ -0,0 +1,87 @@
+from collections import OrderedDict
+from copy import copy
+from mahjong.hand_calculating.hand import HandCalculator
+from mahjong.hand_calculating.hand_config import HandConfig, OptionalRules
+from .hai import Hai
+
+
+class HandScorer:
+    """和了の点数計算を使い回すためのクラス
+
+    HandCalculatorと条件ごとのHandConfigを1度だけ作って使い回し、
+    計算結果は件数上限つきのLRUで保持する。
+    結果のHandResponseは共有されるので、呼び出し側で書き換えないこと。
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.calculator = HandCalculator()
+        self.configs = {}
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def config(self, tsumo, riichi, jikaze, bakaze, aka):
+        key = (tsumo, riichi, jikaze, bakaze, aka)
+        config = self.configs.get(key)
+        if config is None:
+            config = HandConfig(is_tsumo=tsumo, is_riichi=riichi, player_wind=jikaze, round_wind=bakaze,
+                                options=OptionalRules(has_aka_dora=aka, has_open_tanyao=True))
+            self.configs[key] = config
+        return config
+
+    @staticmethod
+    def key(tehai, win_hai, dora, tsumo, riichi, jikaze, bakaze, aka):
+        # 同じ種類の牌は区別しないので34種の枚数で表す。赤ドラありなら赤5の枚数も含める
+        hai34 = [0] * 34
+        akasuu = 0
+        for hai in tehai:
+            hai34[hai.idx34] += 1
+            if aka and hai.idx136 in Hai.AKADORA:
+                akasuu += 1
+        dora34 = tuple(sorted(hai.idx34 for hai in dora))
+        return (bytes(hai34), akasuu, win_hai.idx34, dora34, tsumo, riichi, jikaze, bakaze, aka)
+
+    def score(self, tehai, win_hai, dora, tsumo, riichi, jikaze, bakaze, aka=None):
+        if aka is None:
+            aka = tehai[0].akaari
+        key = self.key(tehai, win_hai, dora, tsumo, riichi, jikaze, bakaze, aka)
+
+        result = self.cache.get(key)
+        if result is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return result
+
+        self.misses += 1
+        result = self.calculator.estimate_hand_value(
+            [hai.idx136 for hai in tehai],
+            win_hai.idx136,
+            None,
+            [hai.idx136 for hai in dora],
+            self.config(tsumo, riichi, jikaze, bakaze, aka),
+        )
+        # ドラの役は使い回しているHandConfigの中で翻数を書き換えられるので、計算時点の値を複製しておく
+        if result.yaku:
+            result.yaku = [copy(yaku) for yaku in result.yaku]
+        self.cache[key] = result
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+        return result
+
+    def cache_info(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.cache),
+            "maxsize": self.maxsize,
+        }
+
+    def clear(self):
+        self.cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# プロセス内で共有する点数計算
+scorer = HandScorer()
@@ -0,0 +1,407 @@
+from array import array
+from operator import itemgetter, mul
+from mahjong.shanten import Shanten
+
+# テーブル引きによる向聴数計算
+#
+# 数牌は色ごとに9種の枚数を5進数でエンコードしたキーで表を引く。
+# 各色の評価値は「雀頭の有無(0/1)」×「面子候補の枠数(0~4)」ごとの
+# 2 * 面子数 + 塔子数 の最大値で、これを4色分(字牌を含む)合成すると通常手の向聴数になる。
+# 評価値の種類は数十通りしかないので番号を振って表には番号だけを持たせ、
+# 番号どうしの合成結果もメモしておく。これで1回の計算は表引き数回で済む。
+# 値はmahjong.shanten.Shantenの通常手と同じ数え方
+# (対子は1つを雀頭、残りを塔子として数え、面子候補は4つまで)に揃えている。
+
+AGARI_STATE = -1
+
+KOKUSHI_IDX = (0, 8, 9, 17, 18, 26, 27, 28, 29, 30, 31, 32, 33)
+
+_POW5 = tuple(5 ** i for i in range(9))
+_KOKUSHI = itemgetter(*KOKUSHI_IDX)
+# 枚数(0~4)を数字の文字に置き換え、int(..., 5)で5進数キーにする
+_DIGITS = bytes.maketrans(bytes(range(5)), b'01234')
+_COUNTS = bytes.maketrans(b'01234', bytes(range(5)))
+
+# 成立しない組み合わせを表す値
+_NG = -100
+# 表の未計算を表す番号
+_MISHUTOKU = 0xff
+
+# 評価値の番号 -> 評価値 (長さ10のタプル)
+_vectors = []
+_vector_ids = {}
+
+# 5進数キー -> 評価値の番号
+_suit_table = bytearray([_MISHUTOKU]) * 5 ** 9
+_jihai_table = bytearray([_MISHUTOKU]) * 5 ** 7
+
+# 合成結果のメモ
+_merged = []
+_merged_ids = {}
+_merge_memo = {}
+_finish_memo = {}
+
+# 数牌の部分手牌ごとの分解結果
+_bunkai_memo = {}
+
+# 4枚使いの牌を含む手はライブラリ独自の補正があるため、そちらで計算する
+_fallback = Shanten()
+
+
+def suit_key(hai34, start):
+    return sum(map(mul, hai34[start:start + 9], _POW5))
+
+
+def jihai_key(hai34):
+    return sum(map(mul, hai34[27:34], _POW5))
+
+
+def _decode(key, n):
+    counts = []
+    for i in range(n):
+        counts.append(key % 5)
+        key //= 5
+    return counts
+
+
+def _add(result, h, m, t):
+    # (雀頭, 面子数)ごとに塔子数の最大値だけを残す
+    if h > 1 or m > 4:
+        return
+    k = (h, m)
+    if result.get(k, -1) < t:
+        result[k] = t
+
+
+def _bunkai(counts):
+    """数牌1色の分解結果を{(雀頭, 面子数): 塔子数}で返す"""
+    counts = tuple(counts)
+    if counts in _bunkai_memo:
+        return _bunkai_memo[counts]
+
+    i = 0
+    while i < 9 and counts[i] == 0:
+        i += 1
+    if i == 9:
+        result = {(0, 0): 0}
+        _bunkai_memo[counts] = result
+        return result
+
+    result = {}
+    c = list(counts)
+
+    def sub(dh, dm, dt, idxs):
+        for j in idxs:
+            c[j] -= 1
+        for (h, m), t in _bunkai(c).items():
+            _add(result, h + dh, m + dm, t + dt)
+        for j in idxs:
+            c[j] += 1
+
+    # 刻子
+    if c[i] >= 3:
+        sub(0, 1, 0, (i, i, i))
+    # 順子
+    if i < 7 and c[i + 1] and c[i + 2]:
+        sub(0, 1, 0, (i, i + 1, i + 2))
+    # 対子 (雀頭または塔子)
+    if c[i] >= 2:
+        sub(1, 0, 0, (i, i))
+        sub(0, 0, 1, (i, i))
+    # 両面・辺張
+    if i < 8 and c[i + 1]:
+        sub(0, 0, 1, (i, i + 1))
+    # 嵌張
+    if i < 7 and c[i + 2]:
+        sub(0, 0, 1, (i, i + 2))
+    # 孤立牌
+    sub(0, 0, 0, (i,))
+
+    _bunkai_memo[counts] = result
+    return result
+
+
+def _vector(bunkai):
+    """分解結果を 雀頭(0/1) × 面子候補の枠数(0~4) の評価値に変換する"""
+    vec = [_NG] * 10
+    for (h, m), t in bunkai.items():
+        for k in range(m, 5):
+            v = 2 * m + min(t, k - m)
+            if vec[h * 5 + k] < v:
+                vec[h * 5 + k] = v
+    return tuple(vec)
+
+
+def _intern(vec, vectors, ids):
+    vid = ids.get(vec)
+    if vid is None:
+        vid = len(vectors)
+        vectors.append(vec)
+        ids[vec] = vid
+    return vid
+
+
+def suit_vector_id(key):
+    vid = _suit_table[key]
+    if vid == _MISHUTOKU:
+        vid = _intern(_vector(_bunkai(_decode(key, 9))), _vectors, _vector_ids)
+        _suit_table[key] = vid
+    return vid
+
+
+def jihai_vector_id(key):
+    vid = _jihai_table[key]
+    if vid == _MISHUTOKU:
+        counts = _decode(key, 7)
+        m = counts.count(3)
+        p = counts.count(2)
+        bunkai = {(0, m): p}
+        if p:
+            bunkai[(1, m)] = p - 1
+        vid = _intern(_vector(bunkai), _vectors, _vector_ids)
+        _jihai_table[key] = vid
+    return vid
+
+
+def _merge(a, b):
+    vec = [_NG] * 10
+    for ha in range(2):
+        for hb in range(2 - ha):
+            h = ha + hb
+            for ka in range(5):
+                va = a[ha * 5 + ka]
+                if va == _NG:
+                    continue
+                for kb in range(5 - ka):
+                    vb = b[hb * 5 + kb]
+                    if vb == _NG:
+                        continue
+                    k = h * 5 + ka + kb
+                    if vec[k] < va + vb:
+                        vec[k] = va + vb
+    return tuple(vec)
+
+
+def _finish(a, b, n):
+    # 最後の1色は必要な枠数の値だけを求める
+    init_mentsu = (14 - n) // 3
+    waku = 4 - init_mentsu
+    best = _NG
+    for ha in range(2):
+        for hb in range(2 - ha):
+            for ka in range(waku + 1):
+                va = a[ha * 5 + ka]
+                vb = b[hb * 5 + waku - ka]
+                if va == _NG or vb == _NG:
+                    continue
+                v = va + vb + ha + hb
+                if best < v:
+                    best = v
+    return 8 - 2 * init_mentsu - best
+
+
+def merge_id(a, b, b_is_merged=False):
+    """評価値の番号aと番号bを合成した評価値の番号を返す"""
+    key = (a, b, b_is_merged)
+    mid = _merge_memo.get(key)
+    if mid is None:
+        vb = _merged[b] if b_is_merged else _vectors[b]
+        mid = _intern(_merge(_vectors[a], vb), _merged, _merged_ids)
+        _merge_memo[key] = mid
+    return mid
+
+
+def finish(merged_id, jihai_id, n):
+    """3色を合成した評価値と字牌の評価値から向聴数を求める"""
+    key = (merged_id, jihai_id, n)
+    result = _finish_memo.get(key)
+    if result is None:
+        result = _finish(_merged[merged_id], _vectors[jihai_id], n)
+        _finish_memo[key] = result
+    return result
+
+
+def regular_from_ids(m, p, s, z, n):
+    """各色の評価値の番号と手牌の枚数から通常手の向聴数を求める"""
+    return finish(merge_id(s, merge_id(m, p), True), z, n)
+
+
+def _digits(hai34):
+    return bytes(hai34).translate(_DIGITS)
+
+
+def _regular(digits, n):
+    if b'4' in digits:
+        return _fallback.calculate_shanten_for_regular_hand(list(digits.translate(_COUNTS)))
+    # 上位桁から並べるため逆順に切り出す
+    return regular_from_ids(
+        suit_vector_id(int(digits[8::-1], 5)),
+        suit_vector_id(int(digits[17:8:-1], 5)),
+        suit_vector_id(int(digits[26:17:-1], 5)),
+        jihai_vector_id(int(digits[33:26:-1], 5)),
+        n,
+    )
+
+
+def _chiitoitsu(digits):
+    # 1種あたり4枚までなので、2枚以上ある種類 = 34 - 0枚の種類 - 1枚の種類
+    pairs = 34 - digits.count(b'0') - digits.count(b'1')
+    if pairs == 7:
+        return AGARI_STATE
+    return 6 - pairs
+
+
+def shanten_regular(hai34):
+    return _regular(_digits(hai34), sum(hai34))
+
+
+def shanten_chiitoitsu(hai34):
+    return _chiitoitsu(_digits(hai34))
+
+
+def shanten_kokushi(hai34):
+    yaochu = _KOKUSHI(hai34)
+    terminals = 13 - yaochu.count(0)
+    completed = terminals - yaochu.count(1) > 0
+    return 13 - terminals - completed
+
+
+def shanten(hai34):
+    digits = _digits(hai34)
+    return min(_regular(digits, sum(hai34)), _chiitoitsu(digits), shanten_kokushi(hai34))
+
+
+def _shanten_keys(c, keys, n):
+    # 5進数キーを差分で持っている場合の向聴数計算
+    if 4 in c:
+        regular = _fallback.calculate_shanten_for_regular_hand(c)
+    else:
+        regular = regular_from_ids(
+            suit_vector_id(keys[0]),
+            suit_vector_id(keys[1]),
+            suit_vector_id(keys[2]),
+            jihai_vector_id(keys[3]),
+            n,
+        )
+    pairs = 34 - c.count(0) - c.count(1)
+    chiitoitsu = AGARI_STATE if pairs == 7 else 6 - pairs
+    return min(regular, chiitoitsu, shanten_kokushi(c))
+
+
+def _tsumo_kouho(c):
+    # 向聴数が下がりうるツモ牌: 手牌にある牌とその前後2つ(数牌)、および么九牌(国士無双)。
+    # それ以外の孤立した牌を引いても、どの形の向聴数も変わらない。
+    # ただし4枚使いの牌があると、ライブラリは孤立牌がその牌しかない手を1つ遠く数えるので、
+    # どの孤立牌を引いても向聴数が下がりうる。その場合は全種類を候補にする
+    if 4 in c:
+        return list(range(34))
+    kouho = set(KOKUSHI_IDX)
+    for k in range(34):
+        if c[k]:
+            if k < 27:
+                start = k - k % 9
+                kouho.update(range(max(start, k - 2), min(start + 9, k + 3)))
+            else:
+                kouho.add(k)
+    return sorted(kouho)
+
+
+def dahai_kouho(hai34, ukeire=True, saiyuukou=False):
+    """打牌候補ごとの(打牌後の向聴数, 受け入れ枚数)を{34種インデックス: タプル}で返す
+
+    同じ種類の牌は1回だけ評価する。5進数キーは1枚の増減で1桁だけ変わるので、
+    手牌全体のキーを1度作り、打牌とツモの分だけ足し引きして使い回す。
+    受け入れ枚数は自分の手牌と捨てた牌を除いた残り枚数で数える。ukeire=Falseなら数えずNoneにする。
+    saiyuukou=Trueなら打牌後の向聴数が最小になる候補だけ受け入れ枚数を数え、ほかはNoneにする。
+    """
+    c = list(hai34)
+    n = sum(c) - 1
+    keys = [suit_key(c, 0), suit_key(c, 9), suit_key(c, 18), jihai_key(c)]
+
+    result = {}
+    for d in range(34):
+        if not c[d]:
+            continue
+        d_iro, d_pos = divmod(d, 9)
+        c[d] -= 1
+        keys[d_iro] -= _POW5[d_pos]
+        result[d] = _shanten_keys(c, keys, n)
+        c[d] += 1
+        keys[d_iro] += _POW5[d_pos]
+
+    if not ukeire:
+        return {d: (shanten, None) for d, shanten in result.items()}
+
+    tsumo_kouho = _tsumo_kouho(c)
+    best = min(result.values())
+    for d, shanten in result.items():
+        if saiyuukou and shanten != best:
+            result[d] = (shanten, None)
+            continue
+        d_iro, d_pos = divmod(d, 9)
+        c[d] -= 1
+        keys[d_iro] -= _POW5[d_pos]
+
+        maisuu = 0
+        for k in tsumo_kouho:
+            # 手牌と捨てた牌で4枚とも見えている
+            if hai34[k] == 4:
+                continue
+            k_iro, k_pos = divmod(k, 9)
+            c[k] += 1
+            keys[k_iro] += _POW5[k_pos]
+            if _shanten_keys(c, keys, n + 1) < shanten:
+                maisuu += 4 - hai34[k]
+            c[k] -= 1
+            keys[k_iro] -= _POW5[k_pos]
+
+        c[d] += 1
+        keys[d_iro] += _POW5[d_pos]
+        result[d] = (shanten, maisuu)
+    return result
+
+
+def build_table():
+    """合計14枚以下の組み合わせをすべて表に載せる"""
+    for key in range(5 ** 9):
+        if sum(_decode(key, 9)) <= 14:
+            suit_vector_id(key)
+    for key in range(5 ** 7):
+        if sum(_decode(key, 7)) <= 14:
+            jihai_vector_id(key)
+    _bunkai_memo.clear()
+
+
+def save_table(path):
+    """表をバイナリファイルに書き出す
+
+    評価値の種類数(1byte)、評価値(10byte×種類数)、数牌の表(5^9 byte)、字牌の表(5^7 byte)の順に並べる。
+    """
+    build_table()
+    with open(path, 'wb') as f:
+        f.write(bytes([len(_vectors)]))
+        f.write(array('b', [v for vec in _vectors for v in vec]).tobytes())
+        f.write(_suit_table)
+        f.write(_jihai_table)
+
+
+def load_table(path):
+    """save_tableで書き出した表を読み込む"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    n = data[0]
+    values = array('b', data[1:1 + n * 10])
+    pos = 1 + n * 10
+
+    _vectors.clear()
+    _vector_ids.clear()
+    for i in range(n):
+        _intern(tuple(values[i * 10:(i + 1) * 10]), _vectors, _vector_ids)
+    _suit_table[:] = data[pos:pos + 5 ** 9]
+    pos += 5 ** 9
+    _jihai_table[:] = data[pos:pos + 5 ** 7]
+
+    _merged.clear()
+    _merged_ids.clear()
+    _merge_memo.clear()
+    _finish_memo.clear()
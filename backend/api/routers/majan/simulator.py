@@ -0,0 +1,210 @@
+# 自己対戦によるモンテカルロシミュレーション
+#
+# 入出力なしのGameを複数プロセスで並列に回し、和了率・流局率・平均巡目・持ち点の分布を集計する。
+# 各プロセスは渡されたシードのrandom.Randomで山を作るので、同じ引数なら同じ結果になる。
+#
+#   python -m routers.majan.simulator --games 1000 --policy shanten --out result.json
+
+import argparse
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .game import Game
+from .policy import NpcPolicy, ShantenPolicy
+from .sink import EventSink
+
+
+POLICIES = {'npc': NpcPolicy, 'shanten': ShantenPolicy}
+
+# 持ち点の分布をまとめる幅
+TENBOU_BIN = 5000
+
+
+class StatsSink(EventSink):
+    """局の結果だけを数える"""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def emit(self, game, event, **data):
+        stats = self.stats
+        if event == 'agari':
+            stats['tsumo' if data['tsumo'] else 'ron'] += 1
+            if data['result'].cost is None:
+                stats['agari_error'] += 1
+            stats['junme'] += game.junme
+        elif event == 'ryuukyoku':
+            stats['ryuukyoku'] += 1
+            stats['junme'] += game.junme
+        elif event == 'kyoku_end':
+            stats['kyoku'] += 1
+
+
+class TimedGame(Game):
+    """配牌・判断・和了計算・流局処理にかかった時間を計る"""
+
+    def __init__(self, timing, **kwargs):
+        super().__init__(**kwargs)
+        self.timing = timing
+
+    def _timed(self, phase, func, *args, **kwargs):
+        t = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.timing[phase] += time.perf_counter() - t
+
+    def start(self):
+        return self._timed('start', super().start)
+
+    def agari_shori(self, *args, **kwargs):
+        return self._timed('agari', super().agari_shori, *args, **kwargs)
+
+    def ryuukyoku_shori(self):
+        return self._timed('ryuukyoku', super().ryuukyoku_shori)
+
+    def _decide(self, decision):
+        return self._timed('policy', super()._decide, decision)
+
+
+def new_stats():
+    return {
+        'games': 0,
+        'kyoku': 0,
+        'tsumo': 0,
+        'ron': 0,
+        'agari_error': 0,
+        'ryuukyoku': 0,
+        'junme': 0,
+        'tobi': 0,
+        'tenbou': {},
+        'timing': {'total': 0.0, 'start': 0.0, 'policy': 0.0, 'agari': 0.0, 'ryuukyoku': 0.0},
+    }
+
+
+def simulate(games, seed, hanchan=False, policy='shanten', aka=False, first=0):
+    """1プロセス分の対局を行い、集計結果を返す
+
+    乱数は対局ごとに seed と通し番号 (first + i) から作るので、
+    どう分割してどのプロセスで回しても同じ seed なら同じ結果になる
+    """
+    stats = new_stats()
+    timing = stats['timing']
+    sink = StatsSink(stats)
+    policy_class = POLICIES[policy]
+
+    for i in range(games):
+        rng = random.Random(f'{seed}:{first + i}')
+        game = TimedGame(timing, hanchan=hanchan, aka=aka, player=0, headless=True,
+                         policies=[policy_class() for j in range(4)], sink=sink, rng=rng)
+        t = time.perf_counter()
+        game.game()
+        timing['total'] += time.perf_counter() - t
+
+        stats['games'] += 1
+        if game.tobi:
+            stats['tobi'] += 1
+        for janshi in game.janshi:
+            tenbou = int(janshi.tenbou // TENBOU_BIN * TENBOU_BIN)
+            stats['tenbou'][tenbou] = stats['tenbou'].get(tenbou, 0) + 1
+    return stats
+
+
+def merge(total, stats):
+    for key, value in stats.items():
+        if key == 'tenbou':
+            for tenbou, count in value.items():
+                total['tenbou'][tenbou] = total['tenbou'].get(tenbou, 0) + count
+        elif key == 'timing':
+            for phase, sec in value.items():
+                total['timing'][phase] += sec
+        else:
+            total[key] += value
+    return total
+
+
+def split(games, chunks):
+    base, rest = divmod(games, chunks)
+    return [base + (1 if i < rest else 0) for i in range(chunks)]
+
+
+def run(games, workers=None, seed=0, hanchan=False, policy='shanten', aka=False, chunks=None):
+    """gamesを分割してworkers個のプロセスで回し、まとめた集計結果を返す"""
+    workers = workers or os.cpu_count() or 1
+    # 対局の長さにばらつきがあるので、プロセス数より細かく分けて配る
+    chunks = chunks or workers * 4
+    sizes = [n for n in split(games, chunks) if n > 0]
+    firsts = [sum(sizes[:i]) for i in range(len(sizes))]
+
+    total = new_stats()
+    started = time.perf_counter()
+    if workers == 1:
+        for n, first in zip(sizes, firsts):
+            merge(total, simulate(n, seed, hanchan, policy, aka, first))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(simulate, n, seed, hanchan, policy, aka, first)
+                       for n, first in zip(sizes, firsts)]
+            for future in futures:
+                merge(total, future.result())
+    elapsed = time.perf_counter() - started
+
+    return summarize(total, elapsed, workers)
+
+
+def summarize(stats, elapsed, workers):
+    kyoku = stats['kyoku'] or 1
+    agari = stats['tsumo'] + stats['ron']
+    timing = stats['timing']
+    engine = timing['total'] - timing['start'] - timing['policy'] - timing['agari'] - timing['ryuukyoku']
+    return {
+        'games': stats['games'],
+        'kyoku': stats['kyoku'],
+        'agari_rate': agari / kyoku,
+        'tsumo_rate': stats['tsumo'] / kyoku,
+        'ron_rate': stats['ron'] / kyoku,
+        'agari_error_rate': stats['agari_error'] / kyoku,
+        'ryuukyoku_rate': stats['ryuukyoku'] / kyoku,
+        'average_junme': stats['junme'] / kyoku,
+        'tobi_rate': stats['tobi'] / (stats['games'] or 1),
+        'tenbou': {str(k): v for k, v in sorted(stats['tenbou'].items())},
+        'workers': workers,
+        'elapsed': elapsed,
+        'games_per_sec': stats['games'] / elapsed if elapsed else 0.0,
+        # 各フェーズの合計時間(全プロセス分のCPU時間)
+        'timing': dict(timing, engine=engine),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='自己対戦のモンテカルロシミュレーション')
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--hanchan', action='store_true')
+    parser.add_argument('--aka', action='store_true')
+    parser.add_argument('--policy', choices=sorted(POLICIES), default='shanten')
+    parser.add_argument('--out', default=None, help='集計結果を書き出すJSONファイル')
+    args = parser.parse_args(argv)
+
+    result = run(args.games, args.workers, args.seed, args.hanchan, args.policy, args.aka)
+
+    print(f"{result['games']}試合 ({result['kyoku']}局) {result['elapsed']:.2f}秒 "
+          f"{result['games_per_sec']:.1f} games/sec, {result['workers']} workers")
+    print(f"和了率 {result['agari_rate']:.3f} (ツモ {result['tsumo_rate']:.3f} ロン {result['ron_rate']:.3f}) "
+          f"流局率 {result['ryuukyoku_rate']:.3f} 平均巡目 {result['average_junme']:.2f} "
+          f"トビ率 {result['tobi_rate']:.3f}")
+    print('時間(秒): ' + ' '.join(f'{k} {v:.2f}' for k, v in result['timing'].items()))
+    print('持ち点分布: ' + ' '.join(f'{k}: {v}' for k, v in result['tenbou'].items()))
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    return result
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# Gameの進行を受け取るクラス
+#
+# Gameは標準出力に書く代わりに emit(game, event, **data) を呼ぶ。
+# EventSinkは何もしないので、シミュレーションなどではそのまま使えばI/Oが発生しない。
+
+
+class EventSink:
+    def emit(self, game, event, **data):
+        pass
+
+
+class ListSink(EventSink):
+    """イベントを(event, data)のリストに溜める"""
+
+    def __init__(self):
+        self.events = []
+
+    def emit(self, game, event, **data):
+        self.events.append((event, data))
+
+
+class PrintSink(EventSink):
+    """これまで標準出力に出していた表示を行う。pauseなら局の開始と終了で入力を待つ"""
+
+    def __init__(self, pause=False):
+        self.pause = pause
+
+    def emit(self, game, event, **data):
+        handler = getattr(self, 'on_' + event, None)
+        if handler:
+            handler(game, **data)
+
+    def on_chiicha(self, game, idx):
+        print('起家 ' + game.janshi[idx].name + '\n')
+
+    def on_kyoku_start(self, game, bakaze, kyoku):
+        print(game.KAZE[bakaze] + ' ' + str(kyoku) + '局\n')
+
+    def on_haipai(self, game, idx, jun):
+        janshi = game.janshi[idx]
+        if janshi.play:
+            print(janshi.jikaze_str + f'{jun+1}の手牌')
+            print([hai.str for hai in janshi.tehai])
+            print('\n')
+
+    def on_dora(self, game, dora_hyouji):
+        print('ドラ表示牌')
+        print([dora.str for dora in dora_hyouji])
+        if self.pause:
+            input('Press any key')
+
+    def on_junme(self, game, junme):
+        print('\n' + str(junme) + '巡目')
+
+    def on_teban(self, game, idx):
+        janshi = game.janshi[idx]
+        print(janshi.jikaze_str + '(' + janshi.name + ')' + 'の手番')
+        if game.kansen:
+            print([hai.str for hai in janshi.tehai], end=' ')
+        elif janshi.play:
+            print([str(j) + ': ' + janshi.tehai[j].str for j in range(len(janshi.tehai))], end=' ')
+
+    def on_tsumo(self, game, idx, hai):
+        if game.kansen:
+            print(hai.str)
+        elif game.janshi[idx].play:
+            print('13: ' + hai.str)
+
+    def on_shanten(self, game, idx, shantensu):
+        if game.kansen or game.janshi[idx].play:
+            if shantensu == 0:
+                print('聴牌')
+            else:
+                print(str(shantensu) + '向聴')
+
+    def on_riichi(self, game, idx):
+        print(game.janshi[idx].jikaze_str + 'のリーチ')
+
+    def on_dahai(self, game, idx, hai):
+        print('打 ' + hai.str)
+
+    def on_ron(self, game, idx, hai):
+        print(game.janshi[idx].name + 'のロン')
+
+    def on_agari(self, game, idx, tsumo, result):
+        janshi = game.janshi[idx]
+        print(janshi.name + 'の和了')
+        if result.cost:
+            print(result.yaku)
+            if not tsumo:
+                print(str(result.cost['main']) + '点\n')
+            elif janshi.jikaze == game.WIND[0]:
+                print(str(result.cost['main']) + 'オール\n')
+            else:
+                print(str(result.cost['main']), str(result.cost['additional']) + '点\n')
+        else:
+            print('和了の計算に失敗しました')
+
+    def on_ryuukyoku(self, game):
+        print('流局\n')
+
+    def on_tenpai(self, game, idx, tenpai):
+        if tenpai:
+            print(game.janshi[idx].name + '聴牌')
+        else:
+            print(game.janshi[idx].name + '不聴')
+
+    def on_kyoku_end(self, game, tobi):
+        for janshi in game.janshi:
+            print(janshi.name + ' ' + str(janshi.tenbou) + '点')
+            if janshi.tenbou < 0:
+                print('トビ')
+        print('\n')
+        if self.pause:
+            input('Press any key')
+
+    def on_teban_end(self, game, idx):
+        print('\n')
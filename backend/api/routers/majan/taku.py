@@ -1,25 +1,26 @@
 from . import hai
+from .yama import Yama
 from mahjong.constants import EAST, SOUTH, WEST, NORTH
 
 class Taku:
     def __init__(self,aka=False):
         self.bakaze = EAST
-        self.hai = []
         self.aka = aka
         self.kyoku = 1
 
-        self.hai = []
-        for i in range(136):
-            self.hai.append(hai.Hai(i, self.aka))
+        # 牌はプロセス共有の牌テーブルを参照する
+        self.hai = hai.hai_table(self.aka)
 
-        self.yama = self.hai.copy()
+        self.yama = Yama(self.hai)
 
         self.kanctn = 0
-        self.dora_hyouji = []
-        self.dora_hyouji.append(self.yama[-(6 + self.kanctn * 2)])
 
         self.riibou = 0
 
+    @property
+    def dora_hyouji(self):
+        # 洗牌後の山から読むので、シャッフルや山の作り直しに追従する
+        return [self.yama.dora_hyouji(i) for i in range(self.kanctn + 1)]
+
     def kan(self):
-        self.kanctn += 1
-        self.dora_hyouji.append(self.yama[-(6 + self.kanctn * 2)])
\ No newline at end of file
+        self.kanctn += 1
\ No newline at end of file
@@ -0,0 +1,53 @@
+from array import array
+import random
+
+
+class Yama:
+    # 王牌の枚数
+    WANPAI = 14
+
+    def __init__(self, hai, order=None):
+        # 牌テーブル (hai.hai_table) と、その添字(牌ID)を並べた山
+        self.hai = hai
+        self.ids = array('B', range(136) if order is None else order)
+
+        # 次にツモる位置と、嶺上牌をツモった枚数
+        self.cursor = 0
+        self.rinshan_ctn = 0
+
+    def shuffle(self, rng=None):
+        (rng or random).shuffle(self.ids)
+
+    def __len__(self):
+        # 王牌も含めて残っている枚数
+        return 136 - self.cursor - self.rinshan_ctn
+
+    @property
+    def nokori(self):
+        # 王牌を除いたツモれる残り枚数
+        return max(0, 136 - self.WANPAI - self.cursor - self.rinshan_ctn)
+
+    def tsumo(self):
+        if len(self) == 0:
+            raise IndexError('yama is empty')
+        hai = self.hai[self.ids[self.cursor]]
+        self.cursor += 1
+        return hai
+
+    def haipai(self, n):
+        if len(self) < n:
+            raise IndexError('yama is empty')
+        tehai = [self.hai[i] for i in self.ids[self.cursor:self.cursor + n]]
+        self.cursor += n
+        return tehai
+
+    def rinshan(self):
+        # 嶺上牌は山の末尾から取る。その分、海底が1枚手前にずれる
+        if len(self) == 0:
+            raise IndexError('yama is empty')
+        hai = self.hai[self.ids[135 - self.rinshan_ctn]]
+        self.rinshan_ctn += 1
+        return hai
+
+    def dora_hyouji(self, kanctn=0):
+        return self.hai[self.ids[136 - (6 + kanctn * 2)]]
@@ -1,5 +1,6 @@
-from db import get_db
-from fastapi import APIRouter, Depends
+from db import get_db, get_read_db
+from fastapi import APIRouter, Depends, Query
+from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from schemas import room as room_schema
 from cruds.user import get_current_user_from_cookie
@@ -18,9 +19,20 @@ async def create_room(
     return await room_crud.create_room(form_data, db, current_user)
 
 @room_router.get("/room")
-async def get_rooms(db: AsyncSession = Depends(get_db)):
+async def get_rooms(db: AsyncSession = Depends(get_read_db)):
     return await room_crud.get_rooms(db)
 
+@room_router.get("/room/lobby", response_model=room_schema.LobbyPage)
+async def get_lobby(
+    after: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    game_type: Optional[room_schema.GameType] = None,
+    open: bool = False,
+    db: AsyncSession = Depends(get_read_db)
+    ):
+
+    return await room_crud.get_lobby(db, after, limit, game_type.value if game_type else None, open)
+
 @room_router.put("/room/{room_id}", response_model=room_schema.Room)
 async def update_room(
     room_id: int,
@@ -61,7 +73,7 @@ async def leave_room(
 @room_router.get("/room/{room_id}/players")
 async def get_room_players(
     room_id: int,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
     ):
 
     return await room_crud.get_room_players(room_id, db)
\ No newline at end of file
@@ -12,6 +12,7 @@ async def register(user_body: user_schema.UserCreate, db: AsyncSession = Depends
         
     return await user_crud.register(user_body, db)
 
+# ログインは登録の直後でも見えるよう、レプリカではなくプライマリから読む
 @user_router.post("/user/login", response_model=user_schema.Token)
 async def login_for_access_token(
     response: Response,
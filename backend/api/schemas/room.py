@@ -1,4 +1,5 @@
 from pydantic import BaseModel, Field
+from typing import List, Optional
 from enum import Enum
 
 class GameType(str, Enum):
@@ -20,6 +21,15 @@ class Room(RoomBase):
     
 class RoomUpdate(BaseModel):
     game_type: GameType = Field(..., title="ゲームタイプ")
+
+# room in the lobby
+class LobbyRoom(Room):
+    players: int = Field(..., title="参加人数")
+
+# one page of the lobby
+class LobbyPage(BaseModel):
+    rooms: List[LobbyRoom] = Field(..., title="ルーム")
+    next: Optional[int] = Field(None, title="次のページのafter")
     
 
     
\ No newline at end of file
@@ -0,0 +1,11 @@
+import os
+import sys
+from os.path import abspath, dirname
+
+# backend/api をimportのルートにする (アプリはここから `from env import Env` のように読み込む)
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+# Envが必須にしている値。テストでは使わないので仮の値でよい
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
@@ -0,0 +1,89 @@
+import asyncio
+import random
+
+from fastapi import HTTPException
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from cruds import room as room_crud
+from db import Base
+from models import player as player_model
+from models import room as room_model
+from schemas import room as room_schema
+
+ROOMS = 5
+USERS = 300
+MAX_PLAYERS = 4
+
+
+async def join_concurrently(path: str):
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{path}", connect_args={"timeout": 60}, pool_size=50, max_overflow=0
+    )
+    try:
+        async with engine.begin() as conn:
+            # usersのDDL (ON UPDATE) はMySQLにしかないので、外部キーの先として最低限の表を作る
+            await conn.execute(text(
+                "CREATE TABLE users (id INTEGER PRIMARY KEY, name VARCHAR(255), email VARCHAR(255),"
+                " password VARCHAR(255), created_at DATETIME, updated_at DATETIME)"
+            ))
+            await conn.run_sync(lambda sync: Base.metadata.create_all(
+                sync, tables=[room_model.Room.__table__, player_model.Player.__table__]
+            ))
+            for user_id in range(1, ROOMS + USERS + 1):
+                await conn.execute(text(
+                    f"INSERT INTO users (id, name, email, password) VALUES ({user_id}, 'u{user_id}', 'e', 'x')"
+                ))
+        session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+        async with session() as db:
+            for owner in range(1, ROOMS + 1):
+                await room_crud.create_room(
+                    room_schema.RoomCreate(max_players=MAX_PLAYERS, game_type="yonma"), db, {"id": owner}
+                )
+
+        rng = random.Random(0)
+        users = list(range(ROOMS + 1, ROOMS + USERS + 1))
+        # 同じユーザーが同じルームに二重に入ろうとする場合も混ぜる
+        attempts = [(user_id, rng.randint(1, ROOMS)) for user_id in users]
+        attempts += rng.sample(attempts, 50)
+
+        async def join(user_id: int, room_id: int) -> bool:
+            async with session() as db:
+                try:
+                    await room_crud.join_room(room_id, db, {"id": user_id})
+                    return True
+                except HTTPException:
+                    return False
+
+        joined = await asyncio.gather(*(join(user_id, room_id) for user_id, room_id in attempts))
+
+        async with session() as db:
+            rows = dict((await db.execute(
+                select(player_model.Player.room_id, func.count()).group_by(player_model.Player.room_id)
+            )).all())
+            counts = dict((await db.execute(
+                select(room_model.Room.id, room_model.Room.player_count)
+            )).all())
+            pairs = (await db.execute(
+                select(player_model.Player.user_id, player_model.Player.room_id)
+            )).all()
+        return joined, rows, counts, pairs
+    finally:
+        await engine.dispose()
+
+
+def test_concurrent_joins_never_overfill_a_room(tmp_path):
+    joined, rows, counts, pairs = asyncio.run(join_concurrently(str(tmp_path / "rooms.db")))
+
+    assert all(count <= MAX_PLAYERS for count in counts.values())
+    assert all(count <= MAX_PLAYERS for count in rows.values())
+    # 人数の列と参加者の行数が一致する
+    assert counts == {room_id: rows.get(room_id, 0) for room_id in counts}
+    # 同じユーザーが同じルームに二重に入っていない
+    assert len(pairs) == len(set(pairs))
+    # 成功した参加はすべて行になっている (作成者の分を除く)
+    assert sum(joined) == sum(rows.values()) - ROOMS
+    # 全ルームが埋まるだけの参加があった
+    assert sum(rows.values()) == ROOMS * MAX_PLAYERS
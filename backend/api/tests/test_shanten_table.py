@@ -0,0 +1,69 @@
+import random
+
+import pytest
+from mahjong.shanten import Shanten
+
+from routers.majan import shanten_table
+
+# 表引きの向聴数がmahjong.shanten.Shantenと一致するかを乱数の手牌で突き合わせる
+
+_shanten = Shanten()
+
+
+def random_hand(rng, n, quad=False, suits=range(34)):
+    """山(各4枚)からn枚を引いた34種の枚数。quad=Trueなら4枚使いの牌を必ず含める"""
+    wall = [k for k in suits for _ in range(4)]
+    hai34 = [0] * 34
+    if quad:
+        k = rng.choice(list(suits))
+        hai34[k] = 4
+        wall = [w for w in wall if w != k]
+        n -= 4
+    for k in rng.sample(wall, n):
+        hai34[k] += 1
+    return hai34
+
+
+def hands(seed, count, sizes, quad=False):
+    rng = random.Random(seed)
+    if quad:
+        sizes = [n for n in sizes if n >= 4]
+    result = []
+    for i in range(count):
+        # 1色に寄せた手も混ぜ、面子・塔子の取り方が込み入った形を出す
+        suits = range(34) if i % 2 else range(9 * (i // 2 % 3), 9 * (i // 2 % 3) + 9)
+        result.append(random_hand(rng, rng.choice(sizes), quad, suits))
+    return result
+
+
+@pytest.mark.parametrize("quad", [False, True])
+def test_shanten_matches_library(quad):
+    for hai34 in hands(1 + quad, 2000, [1, 4, 5, 7, 8, 10, 11, 13, 14], quad):
+        assert shanten_table.shanten_regular(hai34) == _shanten.calculate_shanten_for_regular_hand(hai34), hai34
+        if sum(hai34) >= 13:
+            assert shanten_table.shanten(hai34) == _shanten.calculate_shanten(hai34), hai34
+            assert (shanten_table.shanten_kokushi(hai34)
+                    == _shanten.calculate_shanten_for_kokushi_hand(hai34)), hai34
+            assert (shanten_table.shanten_chiitoitsu(hai34)
+                    == _shanten.calculate_shanten_for_chiitoitsu_hand(hai34)), hai34
+
+
+@pytest.mark.parametrize("quad", [False, True])
+def test_dahai_kouho_matches_library(quad):
+    for hai34 in hands(3 + quad, 150, [14], quad):
+        kouho = shanten_table.dahai_kouho(hai34)
+        assert sorted(kouho) == [k for k in range(34) if hai34[k]]
+        for d, (shanten, maisuu) in kouho.items():
+            c = list(hai34)
+            c[d] -= 1
+            assert shanten == _shanten.calculate_shanten(c), (hai34, d)
+            # 受け入れはツモ候補を絞らずに34種すべてで数え直す
+            expected = 0
+            for k in range(34):
+                if hai34[k] == 4:
+                    continue
+                c[k] += 1
+                if _shanten.calculate_shanten(c) < shanten:
+                    expected += 4 - hai34[k]
+                c[k] -= 1
+            assert maisuu == expected, (hai34, d)
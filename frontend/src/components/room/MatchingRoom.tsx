@@ -3,6 +3,7 @@ import { useParams, useNavigate } from "react-router-dom";
 import { Container, List, ListItem, ListItemText, Typography, Button, Card, Grid, Dialog, DialogTitle, DialogContent } from "@mui/material";
 import { fetchRoomPlayers, leaveRoom, deleteRoom } from "../../utils/roomApi";
 import { PaiList } from "./PaiList.ts"
+import { SUBPROTOCOL, decodeFrame, sendMessage } from "../../utils/binaryProtocol";
 
 interface PlayerType {
     user_id: number;
@@ -25,7 +26,9 @@ const MatchingRoom = () => {
         if (!roomId) return;
 
         const WS_URL = `ws://172.20.10.2:8000/room/${roomId}/ws`;
-        const ws = new WebSocket(WS_URL);
+        // バイナリ(msgpack)のサブプロトコルを要求する。牌は牌IDで届き、decodeFrameで名前に戻す
+        const ws = new WebSocket(WS_URL, [SUBPROTOCOL]);
+        ws.binaryType = "arraybuffer";
         setSocket(ws);
 
         ws.onopen = () => {
@@ -33,7 +36,7 @@ const MatchingRoom = () => {
         };
 
         ws.onmessage = (event) => {
-            const data = JSON.parse(event.data);
+            const data = decodeFrame(event.data);
             console.log("WebSocket Message:", data);
 
             if (data.action === "game_started") {
@@ -44,9 +47,8 @@ const MatchingRoom = () => {
             if (data.action === "game_state") {
                 console.log("プレイヤー一覧:", data.game_state.players);
 
-                const currentPlayerId = Object.keys(data.game_state.players).find(
-                    (id) => Array.isArray(data.game_state.players[id]?.hand) && data.game_state.players[id].hand.length > 0
-                );
+                // 自分の手牌はplayersではなくgame_state.handに入っている (観戦者にはない)
+                const currentPlayerId = data.game_state.viewer_id;
 
                 if (!currentPlayerId) {
                     console.warn("手牌を持つプレイヤーが見つかりませんでした。");
@@ -59,9 +61,9 @@ const MatchingRoom = () => {
                 }
 
                 console.log("現在のプレイヤーID:", currentPlayerId);
-                console.log("取得した手牌:", data.game_state.players[currentPlayerId]?.hand);
+                console.log("取得した手牌:", data.game_state.hand);
 
-                setHand(data.game_state.players[currentPlayerId]?.hand ?? []);
+                setHand(data.game_state.hand ?? []);
                 setDiscarded(data.game_state.players[currentPlayerId]?.discarded ?? []);
                 setWinner(data.game_state.winner ?? null);
                 const newDiscardedTiles: { [key: string]: string[] } = {};
@@ -70,13 +72,26 @@ const MatchingRoom = () => {
                 });
                 setDiscardedTiles(newDiscardedTiles);
             }
-            if (data.action === "hai_discarded") {
-                const { last_action_player, last_discarded_hai } = data;
-
-                setDiscardedTiles((prev) => ({
-                    ...prev,
-                    [last_action_player]: [...(prev[last_action_player] || []), last_discarded_hai],
-                }));
+            // broadcastには前回からの差分(delta)が付く。捨て牌は追加分、手牌は変わったときだけ入っている
+            if (data.delta?.discarded) {
+                const added: { [key: string]: string[] } = data.delta.discarded;
+
+                setDiscardedTiles((prev) => {
+                    const next = { ...prev };
+                    Object.keys(added).forEach((id) => {
+                        next[id] = [...(prev[id] || []), ...added[id]];
+                    });
+                    return next;
+                });
+            }
+            if (data.delta?.hand) {
+                setHand(data.delta.hand);
+            }
+            if (data.delta?.state?.ron_player) {
+                setRonPlayer(data.delta.state.ron_player);
+            }
+            if (data.delta?.state?.winner) {
+                setWinner(data.delta.state.winner);
             }
 
 
@@ -88,7 +103,7 @@ const MatchingRoom = () => {
 
         const interval = setInterval(() => {
             if (ws.readyState === WebSocket.OPEN) {
-                ws.send(JSON.stringify({ action: "get_game_state" }));
+                sendMessage(ws, { action: "get_game_state" });
             }
         }, 1000);
 
@@ -105,13 +120,13 @@ const MatchingRoom = () => {
 
     const sendGetGameState = (ws: WebSocket) => {
         if (ws.readyState === WebSocket.OPEN) {
-            ws.send(JSON.stringify({ action: "get_game_state" }));
+            sendMessage(ws, { action: "get_game_state" });
         }
     };
 
     const handleStartGame = () => {
         if (socket && socket.readyState === WebSocket.OPEN) {
-            socket.send(JSON.stringify({ action: "start_game" }));
+            sendMessage(socket, { action: "start_game" });
             console.log("ゲームスタート");
             setGameStarted(true);
         }
@@ -147,7 +162,7 @@ const MatchingRoom = () => {
 
     const sendAction = (action: string, payload: any = {}) => {
         if (socket && socket.readyState === WebSocket.OPEN) {
-            socket.send(JSON.stringify({ action, ...payload }));
+            sendMessage(socket, { action, ...payload });
         }
     };
 
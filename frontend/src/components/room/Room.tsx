@@ -1,18 +1,91 @@
-import { use } from "react";
-import { Container, List,Typography,} from "@mui/material";
-import { fetchRooms,} from "../../utils/roomApi";
+import { use, useEffect, useRef, useState } from "react";
+import { Button, Container, List,Typography,} from "@mui/material";
+import { fetchLobby,} from "../../utils/roomApi";
 import RoomListItem from "./RoomListItem.tsx";
 
 interface RoomType {
     id: number;
     max_players: number;
     game_type: string;
+    players: number;
 }
 
-const roomListPromise = fetchRooms();
+interface LobbyPage {
+    rooms: RoomType[];
+    next: number | null;
+}
+
+// /lobby/wsから届くロビーの変更 (backend/api/routers/majan/manager/lobby.py)
+type LobbyEvent =
+    | { type: "room_created"; room: RoomType }
+    | { type: "room_updated"; room_id: number; game_type: string }
+    | { type: "player_joined" | "player_left"; room_id: number; user_id: number; players: number | null }
+    | { type: "room_deleted"; room_id: number };
+
+const LOBBY_WS_URL = "ws://172.20.10.2:8000/lobby/ws";
+
+const lobbyPromise: Promise<LobbyPage> = fetchLobby();
+
+const applyEvent = (rooms: RoomType[], event: LobbyEvent, hasMore: boolean): RoomType[] => {
+    switch (event.type) {
+        case "room_created":
+            // 新しいルームは最後のページに入るので、まだ読み込んでいなければ足さない
+            if (hasMore || rooms.some((room) => room.id === event.room.id)) return rooms;
+            return [...rooms, event.room];
+        case "room_updated":
+            return rooms.map((room) => room.id === event.room_id ? { ...room, game_type: event.game_type } : room);
+        case "player_joined":
+        case "player_left": {
+            const delta = event.type === "player_joined" ? 1 : -1;
+            return rooms.map((room) => room.id === event.room_id
+                ? { ...room, players: event.players ?? Math.max(room.players + delta, 0) }
+                : room);
+        }
+        case "room_deleted":
+            return rooms.filter((room) => room.id !== event.room_id);
+    }
+};
 
 const Room = () => {
-    const rooms: RoomType[] = use(roomListPromise);
+    const firstPage = use(lobbyPromise);
+    const [rooms, setRooms] = useState<RoomType[]>(firstPage.rooms);
+    const [next, setNext] = useState<number | null>(firstPage.next);
+    // 接続を張り直さずに、受信したときのnextを見る
+    const nextRef = useRef<number | null>(firstPage.next);
+    nextRef.current = next;
+
+    // 一覧は取り直さず、サーバーからまとめて届く変更を反映する
+    useEffect(() => {
+        const ws = new WebSocket(LOBBY_WS_URL);
+
+        ws.onmessage = async (event) => {
+            const data = JSON.parse(event.data);
+            if (data.type === "lobby_reset") {
+                // 変更を取りこぼしたので最初のページから取り直す
+                const page: LobbyPage = await fetchLobby();
+                setRooms(page.rooms);
+                setNext(page.next);
+                return;
+            }
+            if (data.type === "lobby") {
+                setRooms((prev) => data.events.reduce(
+                    (acc: RoomType[], e: LobbyEvent) => applyEvent(acc, e, nextRef.current !== null), prev));
+            }
+        };
+
+        ws.onerror = (error) => {
+            console.error("ロビーのWebSocketエラー:", error);
+        };
+
+        return () => ws.close();
+    }, []);
+
+    const handleLoadMore = async () => {
+        if (next === null) return;
+        const page: LobbyPage = await fetchLobby(next);
+        setRooms((prev) => [...prev, ...page.rooms]);
+        setNext(page.next);
+    };
 
     return (
         <Container sx={{ mt: 4 }}>
@@ -21,9 +94,14 @@ const Room = () => {
             </Typography>
             <List>
                 {rooms.map((room) => (
-                    <RoomListItem key={room.id} id={room.id} max_players={room.max_players} game_type={room.game_type}/>
+                    <RoomListItem key={room.id} id={room.id} max_players={room.max_players} game_type={room.game_type} players={room.players}/>
                 ))}
             </List>
+            {next !== null && (
+                <Button variant="outlined" onClick={handleLoadMore}>
+                    もっと見る
+                </Button>
+            )}
         </Container>
     );
 };
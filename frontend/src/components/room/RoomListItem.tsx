@@ -6,9 +6,10 @@ interface RoomType {
     id: number;
     max_players: number;
     game_type: string;
+    players: number;
 }
 
-const RoomListItem: React.FC<RoomType> = ({ id, max_players, game_type }) => {
+const RoomListItem: React.FC<RoomType> = ({ id, max_players, game_type, players }) => {
     const navigate = useNavigate();
 
     const handleJoinRoom = async (roomId: number) => {
@@ -25,9 +26,9 @@ const RoomListItem: React.FC<RoomType> = ({ id, max_players, game_type }) => {
         <ListItem sx={{ display: "flex", justifyContent: "space-between" }}>
             <ListItemText
                 primary={`部屋ID: ${id}`}
-                secondary={`最大プレイヤー: ${max_players}, ゲームタイプ: ${game_type}`}
+                secondary={`プレイヤー: ${players}/${max_players}, ゲームタイプ: ${game_type}`}
             />
-            <Button variant="contained" color="success" onClick={() => handleJoinRoom(id)}>
+            <Button variant="contained" color="success" disabled={players >= max_players} onClick={() => handleJoinRoom(id)}>
                 参加
             </Button>
         </ListItem>
@@ -0,0 +1,200 @@
+// WebSocketのバイナリ(msgpack)プロトコル
+// サーバー側の backend/api/routers/majan/manager/protocol.py と一覧の並びを揃えること
+
+export const SUBPROTOCOL = "bmj.msgpack.v1";
+
+const ACTIONS = [
+    "player_connected", "player_joined", "player_disconnected", "game_started", "hai_discarded",
+    "ron_claimed", "doubt_result", "doubt_timeout", "game_state",
+    "start_game", "discard", "claim_ron", "claim_doubt", "get_game_state",
+];
+
+const KEYS = [
+    "player_id", "name", "message", "error", "ron_available", "ron_timeout", "doubt_available",
+    "doubt_timeout", "doubter_id", "target_id", "winner", "reason", "hai_idx",
+];
+
+const STATE_FIELDS = [
+    "version", "room_id", "game_started", "game_finished", "current_turn", "current_player_id",
+    "hai_left", "dora_indicator", "players", "doubt_available", "ron_player", "winner",
+    "last_discarded_hai", "last_action_player",
+];
+
+// 0~135の牌IDから牌の名前 (サーバーのHai.strと同じ、赤ドラあり)
+const KINDS = ["萬", "筒", "索"];
+const JIHAI = ["東", "南", "西", "北", "白", "発", "中"];
+const AKADORA: { [key: number]: string } = { 16: "赤5萬", 52: "赤5筒", 88: "赤5索" };
+
+export const tileName = (id: number): string => {
+    if (id in AKADORA) return AKADORA[id];
+    if (id < 108) return `${Math.floor(id / 4) % 9 + 1}${KINDS[Math.floor(id / 36)]}`;
+    return JIHAI[Math.floor((id - 108) / 4)];
+};
+
+// ---- msgpack (使う型だけ) ----
+
+const textDecoder = new TextDecoder();
+const textEncoder = new TextEncoder();
+
+const unpack = (bytes: Uint8Array): any => {
+    const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+    let pos = 0;
+
+    const str = (n: number) => {
+        const s = textDecoder.decode(bytes.subarray(pos, pos + n));
+        pos += n;
+        return s;
+    };
+    const array = (n: number) => {
+        const a = [];
+        for (let i = 0; i < n; i++) a.push(read());
+        return a;
+    };
+    const map = (n: number) => {
+        const m: { [key: string]: any } = {};
+        for (let i = 0; i < n; i++) {
+            const k = read();
+            m[k] = read();
+        }
+        return m;
+    };
+    const read = (): any => {
+        const b = view.getUint8(pos++);
+        let v: any;
+        if (b <= 0x7f) return b;
+        if (b >= 0xe0) return b - 0x100;
+        if ((b & 0xe0) === 0xa0) return str(b & 0x1f);
+        if ((b & 0xf0) === 0x90) return array(b & 0x0f);
+        if ((b & 0xf0) === 0x80) return map(b & 0x0f);
+        switch (b) {
+            case 0xc0: return null;
+            case 0xc2: return false;
+            case 0xc3: return true;
+            case 0xcc: return view.getUint8(pos++);
+            case 0xcd: v = view.getUint16(pos); pos += 2; return v;
+            case 0xce: v = view.getUint32(pos); pos += 4; return v;
+            case 0xcf: v = Number(view.getBigUint64(pos)); pos += 8; return v;
+            case 0xd0: return view.getInt8(pos++);
+            case 0xd1: v = view.getInt16(pos); pos += 2; return v;
+            case 0xd2: v = view.getInt32(pos); pos += 4; return v;
+            case 0xd3: v = Number(view.getBigInt64(pos)); pos += 8; return v;
+            case 0xca: v = view.getFloat32(pos); pos += 4; return v;
+            case 0xcb: v = view.getFloat64(pos); pos += 8; return v;
+            case 0xd9: return str(view.getUint8(pos++));
+            case 0xda: v = view.getUint16(pos); pos += 2; return str(v);
+            case 0xdb: v = view.getUint32(pos); pos += 4; return str(v);
+            case 0xdc: v = view.getUint16(pos); pos += 2; return array(v);
+            case 0xdd: v = view.getUint32(pos); pos += 4; return array(v);
+            case 0xde: v = view.getUint16(pos); pos += 2; return map(v);
+            case 0xdf: v = view.getUint32(pos); pos += 4; return map(v);
+        }
+        throw new Error(`msgpack: 未対応の型 0x${b.toString(16)}`);
+    };
+    return read();
+};
+
+const pack = (value: any, out: number[] = []): number[] => {
+    if (value === null || value === undefined) {
+        out.push(0xc0);
+    } else if (typeof value === "boolean") {
+        out.push(value ? 0xc3 : 0xc2);
+    } else if (typeof value === "number" && Number.isInteger(value) && value >= 0 && value <= 0xffffffff) {
+        if (value <= 0x7f) out.push(value);
+        else if (value <= 0xff) out.push(0xcc, value);
+        else if (value <= 0xffff) out.push(0xcd, value >> 8, value & 0xff);
+        else out.push(0xce, (value >>> 24) & 0xff, (value >> 16) & 0xff, (value >> 8) & 0xff, value & 0xff);
+    } else if (typeof value === "number" && Number.isInteger(value) && value < 0 && value >= -0x80000000) {
+        out.push(0xd2, (value >>> 24) & 0xff, (value >> 16) & 0xff, (value >> 8) & 0xff, value & 0xff);
+    } else if (typeof value === "number") {
+        const buf = new DataView(new ArrayBuffer(8));
+        buf.setFloat64(0, value);
+        out.push(0xcb, ...new Uint8Array(buf.buffer));
+    } else if (typeof value === "string") {
+        const bytes = textEncoder.encode(value);
+        if (bytes.length <= 0x1f) out.push(0xa0 | bytes.length);
+        else if (bytes.length <= 0xff) out.push(0xd9, bytes.length);
+        else out.push(0xda, bytes.length >> 8, bytes.length & 0xff);
+        out.push(...bytes);
+    } else if (Array.isArray(value)) {
+        if (value.length <= 0x0f) out.push(0x90 | value.length);
+        else out.push(0xdc, value.length >> 8, value.length & 0xff);
+        value.forEach((v) => pack(v, out));
+    } else {
+        const entries = Object.entries(value);
+        if (entries.length <= 0x0f) out.push(0x80 | entries.length);
+        else out.push(0xde, entries.length >> 8, entries.length & 0xff);
+        entries.forEach(([k, v]) => {
+            // サーバーと決めたキーは番号で送る
+            const code = KEYS.indexOf(k);
+            pack(code >= 0 ? code : k, out);
+            pack(v, out);
+        });
+    }
+    return out;
+};
+
+// ---- フレームをJSONのときと同じ形にする ----
+
+const expandSnapshot = ([pub, priv]: [any[], [any, number[]] | null]) => {
+    const state: { [key: string]: any } = {};
+    STATE_FIELDS.forEach((field, i) => {
+        if (pub[i] !== null && pub[i] !== undefined) state[field] = pub[i];
+    });
+    state.ron_player = pub[STATE_FIELDS.indexOf("ron_player")];
+    state.current_player_id = pub[STATE_FIELDS.indexOf("current_player_id")];
+    if (state.dora_indicator !== undefined) state.dora_indicator = tileName(state.dora_indicator);
+    if (state.last_discarded_hai !== undefined) state.last_discarded_hai = tileName(state.last_discarded_hai);
+    const players: { [key: string]: any } = {};
+    (state.players ?? []).forEach(([id, name, seat, discarded]: [any, string, number, number[]]) => {
+        players[id] = { name, seat, discarded: discarded.map(tileName) };
+    });
+    state.players = players;
+    if (priv) {
+        state.viewer_id = priv[0];
+        state.hand = priv[1].map(tileName);
+    }
+    return state;
+};
+
+const expandDelta = ([[from, to, fields, discarded], hand]: [[number, number, { [key: number]: any }, { [key: string]: number[] } | null], number[] | null]) => {
+    const state: { [key: string]: any } = {};
+    Object.keys(fields).forEach((code) => {
+        state[STATE_FIELDS[Number(code)]] = fields[Number(code)];
+    });
+    if (state.last_discarded_hai !== undefined) state.last_discarded_hai = tileName(state.last_discarded_hai);
+    const delta: { [key: string]: any } = { from, to, state };
+    if (discarded) {
+        delta.discarded = {};
+        Object.keys(discarded).forEach((id) => {
+            delta.discarded[id] = discarded[id].map(tileName);
+        });
+    }
+    if (hand) delta.hand = hand.map(tileName);
+    return delta;
+};
+
+// 受け取ったフレームを {action, ..., game_state?, delta?} にする。テキストならJSONとして読む
+export const decodeFrame = (data: ArrayBuffer | string): any => {
+    if (typeof data === "string") return JSON.parse(data);
+
+    const [action, extras, snapshot, delta] = unpack(new Uint8Array(data));
+    const message: { [key: string]: any } = { action: typeof action === "number" ? ACTIONS[action] : action };
+    Object.keys(extras ?? {}).forEach((key) => {
+        const code = Number(key);
+        message[Number.isInteger(code) && KEYS[code] ? KEYS[code] : key] = extras[key];
+    });
+    if (snapshot) message.game_state = expandSnapshot(snapshot);
+    if (delta) message.delta = expandDelta(delta);
+    return message;
+};
+
+// ws.protocolに合わせてJSONかmsgpackで送る
+export const sendMessage = (ws: WebSocket, message: { action: string; [key: string]: any }) => {
+    if (ws.protocol !== SUBPROTOCOL) {
+        ws.send(JSON.stringify(message));
+        return;
+    }
+    const { action, ...extras } = message;
+    const code = ACTIONS.indexOf(action);
+    ws.send(new Uint8Array(pack([code >= 0 ? code : action, extras])));
+};
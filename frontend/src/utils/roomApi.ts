@@ -7,6 +7,12 @@ export const fetchRooms = async () => {
         .then(res => res.data);
 };
 
+// 参加人数付きのルーム一覧を1ページ分取得する。次のページはnextをafterに渡す
+export const fetchLobby = async (after = 0, limit = 20) => {
+    return axios.get(`${API_URL}/room/lobby`, { params: { after, limit }, withCredentials: true })
+        .then(res => res.data);
+};
+
 // export const updateRoom = async (roomId: number, gameType: string, maxPlayers: number) => {
 //     return axios.put(`${API_URL}/room/${roomId}`,
 //         { game_type: gameType, max_players: maxPlayers },
@@ -1,6 +1,7 @@
 DROP TABLE IF EXISTS users;
 DROP TABLE IF EXISTS rooms;
 DROP TABLE IF EXISTS players;
+DROP TABLE IF EXISTS game_snapshots;
 
 
 CREATE TABLE users (
@@ -15,7 +16,8 @@ CREATE TABLE users (
 CREATE TABLE rooms (
                        id INT AUTO_INCREMENT PRIMARY KEY,
                        max_players INT NOT NULL CHECK (max_players IN (3, 4)),
-                       game_type ENUM('sanma', 'yonma') NOT NULL
+                       game_type ENUM('sanma', 'yonma') NOT NULL,
+                       player_count INT NOT NULL DEFAULT 0 CHECK (player_count BETWEEN 0 AND max_players)
 );
 
 CREATE TABLE players (
@@ -25,4 +27,10 @@ CREATE TABLE players (
                          FOREIGN KEY (user_id) REFERENCES users(id),
                          FOREIGN KEY (room_id) REFERENCES rooms(id),
                          UNIQUE KEY unique_user_room (user_id, room_id)
+);
+
+CREATE TABLE game_snapshots (
+                         room_id VARCHAR(64) PRIMARY KEY,
+                         data BLOB NOT NULL,
+                         updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
 );
\ No newline at end of file
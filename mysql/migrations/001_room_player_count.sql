@@ -0,0 +1,31 @@
+-- 既存のデータベースにrooms.player_countとplayersの一意制約を足す
+-- (init.sqlは新しく作るときにしか流れないので、作成済みのデータベースにはこれを1度だけ流す)
+--   docker compose exec -T mysql sh -c 'mysql -u root -p"$MYSQL_ROOT_PASSWORD" brachion' < mysql/migrations/001_room_player_count.sql
+
+START TRANSACTION;
+
+-- 同じユーザーが同じルームに重複して入っている行は、最初の1行を残して消す
+DELETE p1 FROM players p1
+    JOIN players p2 ON p1.user_id = p2.user_id AND p1.room_id = p2.room_id AND p1.id > p2.id;
+
+-- 以前の同時参加で定員を超えたルームは、後から入った行を消して定員に戻す
+DELETE FROM players WHERE id IN (
+    SELECT id FROM (
+        SELECT p.id,
+               ROW_NUMBER() OVER (PARTITION BY p.room_id ORDER BY p.id) AS seat,
+               r.max_players
+        FROM players p JOIN rooms r ON r.id = p.room_id
+    ) seats
+    WHERE seats.seat > seats.max_players
+);
+
+COMMIT;
+
+ALTER TABLE rooms ADD COLUMN player_count INT NOT NULL DEFAULT 0;
+
+-- 参加者の行数から埋める
+UPDATE rooms r
+    SET player_count = (SELECT COUNT(*) FROM players p WHERE p.room_id = r.id);
+
+ALTER TABLE rooms ADD CONSTRAINT rooms_player_count_check CHECK (player_count BETWEEN 0 AND max_players);
+ALTER TABLE players ADD UNIQUE KEY unique_user_room (user_id, room_id);